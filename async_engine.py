@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+asyncio子进程引擎 - 在一个后台事件循环中运行所有GEHistoricalImagery子进程
+逐行读取子进程的stdout/stderr(同时按\\r和\\n分行，兼容控制台进度条)，实时解析进度；
+只保留最后若干行输出，日志再长也不会占用大量内存；支持随时终止正在运行的子进程
+"""
+
+import asyncio
+import codecs
+import os
+import re
+import signal
+import subprocess
+import threading
+import time
+from collections import deque
+
+OUTPUT_TAIL_LINES = 200  # 每个流保留的最后行数
+READ_SIZE = 4096
+MAX_LINE = 65536  # 没有换行的超长输出只保留末尾
+TERMINATE_GRACE = 5  # 终止子进程后等待其退出的秒数
+
+_LINE_SPLIT = re.compile(r"[\r\n]+")
+_COUNT_PATTERN = re.compile(r"(\d+)\s*(?:/|of)\s*(\d+)")
+_PERCENT_PATTERN = re.compile(r"(\d+(?:\.\d+)?)\s*%")
+
+
+def parse_progress(line):
+    """
+    从一行输出中解析进度
+    :return:0~1之间的完成比例，无法解析时返回None
+    """
+    m = _COUNT_PATTERN.search(line)
+    if m is not None:
+        done, total = int(m.group(1)), int(m.group(2))
+        if 0 < total and done <= total:
+            return done / total
+    m = _PERCENT_PATTERN.search(line)
+    if m is not None:
+        percent = float(m.group(1))
+        if percent <= 100:
+            return percent / 100.0
+    return None
+
+
+class ProcessResult:
+    """子进程的执行结果"""
+
+    def __init__(self, returncode=None, stdout="", stderr="", timed_out=False, cancelled=False, error=None,
+                 spawn_seconds=0.0):
+        self.returncode = returncode
+        self.stdout = stdout
+        self.stderr = stderr
+        self.timed_out = timed_out
+        self.cancelled = cancelled
+        self.error = error  # 无法启动子进程时的异常信息
+        self.spawn_seconds = spawn_seconds  # 启动子进程的耗时
+
+
+class AsyncProcessEngine:
+    """后台事件循环，run()可以在任意线程中调用并阻塞到子进程结束"""
+
+    def __init__(self, encoding='gbk'):
+        self.encoding = encoding
+        self.cancelled = False
+        self._processes = set()
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="AsyncProcessEngine", daemon=True)
+        self._thread.start()
+
+    def run(self, cmd, cwd=None, timeout=None, on_line=None):
+        """
+        执行命令并等待结束
+        :param on_line:回调on_line(stream, line)，stream为"stdout"或"stderr"，在事件循环线程中调用
+        :return:ProcessResult
+        """
+        if self.cancelled:
+            return ProcessResult(cancelled=True)
+        future = asyncio.run_coroutine_threadsafe(self._run(cmd, cwd, timeout, on_line), self._loop)
+        return future.result()
+
+    async def _run(self, cmd, cwd, timeout, on_line):
+        start = time.perf_counter()
+        try:
+            # POSIX下放入独立的进程组，终止时连同其子进程一起结束，否则残留的子进程会占住输出管道
+            proc = await asyncio.create_subprocess_exec(
+                *cmd, cwd=cwd, stdin=subprocess.DEVNULL,
+                stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+                start_new_session=os.name != "nt")
+        except Exception as e:
+            return ProcessResult(error=e, spawn_seconds=time.perf_counter() - start)
+        spawn_seconds = time.perf_counter() - start
+
+        self._processes.add(proc)
+        stdout_tail = deque(maxlen=OUTPUT_TAIL_LINES)
+        stderr_tail = deque(maxlen=OUTPUT_TAIL_LINES)
+        timed_out = False
+        try:
+            await asyncio.wait_for(asyncio.gather(
+                self._pump(proc.stdout, "stdout", stdout_tail, on_line),
+                self._pump(proc.stderr, "stderr", stderr_tail, on_line),
+                proc.wait()), timeout)
+        except asyncio.TimeoutError:
+            timed_out = True
+            await self._terminate(proc)
+        finally:
+            self._processes.discard(proc)
+
+        return ProcessResult(proc.returncode, "\n".join(stdout_tail), "\n".join(stderr_tail), timed_out=timed_out,
+                             cancelled=self.cancelled and not timed_out and proc.returncode != 0,
+                             spawn_seconds=spawn_seconds)
+
+    async def _pump(self, stream, name, tail, on_line):
+        """按块读取输出流并切分成行，只保留最后几行"""
+        decoder = codecs.getincrementaldecoder(self.encoding)(errors='ignore')
+        pending = ""
+        while True:
+            data = await stream.read(READ_SIZE)
+            text = decoder.decode(data, final=not data)
+            pending += text
+            parts = _LINE_SPLIT.split(pending)
+            # 最后一段可能是不完整的行，留到下次读取；到达末尾时全部处理
+            pending = parts.pop()[-MAX_LINE:] if data else ""
+            for line in parts:
+                line = line.strip()
+                if not line:
+                    continue
+                tail.append(line)
+                if on_line is not None:
+                    try:
+                        on_line(name, line)
+                    except Exception as e:
+                        print(f"Output callback failed: {e}")
+            if not data:
+                return
+
+    async def _terminate(self, proc):
+        if proc.returncode is not None:
+            return
+        try:
+            self._signal(proc)
+            await asyncio.wait_for(proc.wait(), TERMINATE_GRACE)
+        except ProcessLookupError:
+            pass
+        except asyncio.TimeoutError:
+            self._signal(proc, kill=True)
+            await proc.wait()
+
+    @staticmethod
+    def _signal(proc, kill=False):
+        if os.name == "nt":
+            if kill:
+                proc.kill()
+            else:
+                proc.terminate()
+        else:
+            os.killpg(proc.pid, signal.SIGKILL if kill else signal.SIGTERM)
+
+    def cancel_all(self):
+        """终止所有正在运行的子进程，之后的run()直接返回已取消"""
+        self.cancelled = True
+        if self._loop.is_closed():
+            return
+
+        def terminate_all():
+            for proc in list(self._processes):
+                self._loop.create_task(self._terminate(proc))
+
+        self._loop.call_soon_threadsafe(terminate_all)
+
+    def close(self):
+        if self._loop.is_closed():
+            return
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+GCJ02->WGS84反算基准测试
+在覆盖全国的规则网格上比较单步近似与迭代反算的吞吐量和残差
+用法: python benchmarks/bench_gcj02_inversion.py --grid 400
+"""
+
+import argparse
+import math
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from coord_convert import (gcj02_to_wgs84, gcj02_to_wgs84_batch, gcj02_to_wgs84_precise,
+                           gcj02_to_wgs84_precise_batch, wgs84_to_gcj02_batch)
+
+METERS_PER_DEGREE = 6378137.0 * math.pi / 180.0
+
+
+def china_grid(size):
+    """生成size x size个WGS84真值点，以及对应的GCJ02坐标"""
+    lng, lat = np.meshgrid(np.linspace(74.0, 134.5, size), np.linspace(4.5, 53.0, size))
+    truth = np.column_stack([lng.ravel(), lat.ravel()])
+    return truth, wgs84_to_gcj02_batch(truth)
+
+
+def error_meters(result, truth):
+    """近似的地面误差(米)"""
+    dlng = (result[:, 0] - truth[:, 0]) * np.cos(np.radians(truth[:, 1]))
+    dlat = result[:, 1] - truth[:, 1]
+    return np.hypot(dlng, dlat) * METERS_PER_DEGREE
+
+
+def timed(func, repeat):
+    best = float("inf")
+    value = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        value = func()
+        best = min(best, time.perf_counter() - start)
+    return best, value
+
+
+def main():
+    parser = argparse.ArgumentParser(description="GCJ02->WGS84反算基准测试")
+    parser.add_argument("--grid", type=int, default=300, help="网格边长，总点数为grid*grid")
+    parser.add_argument("--scalar-points", type=int, default=20000, help="标量版本测试的点数")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    truth, gcj = china_grid(args.grid)
+    n = len(gcj)
+    sample = gcj[:: max(1, n // args.scalar_points)]
+    sample_truth = truth[:: max(1, n // args.scalar_points)]
+
+    rows = []
+
+    t, fast = timed(lambda: gcj02_to_wgs84_batch(gcj), args.repeat)
+    rows.append(("fast batch", n, t, error_meters(fast, truth), None))
+
+    t, (precise, iterations) = timed(lambda: gcj02_to_wgs84_precise_batch(gcj), args.repeat)
+    rows.append(("precise batch", n, t, error_meters(precise, truth), iterations))
+
+    t, fast_scalar = timed(lambda: np.array([gcj02_to_wgs84(x, y) for x, y in sample]), 1)
+    rows.append(("fast scalar", len(sample), t, error_meters(fast_scalar, sample_truth), None))
+
+    t, precise_scalar = timed(lambda: np.array([gcj02_to_wgs84_precise(x, y) for x, y in sample]), 1)
+    rows.append(("precise scalar", len(sample), t, error_meters(precise_scalar[:, :2], sample_truth),
+                 precise_scalar[:, 2]))
+
+    print(f"{'method':<16}{'points':>10}{'Mpts/s':>10}{'mean err(m)':>14}{'max err(m)':>14}{'iters':>8}")
+    for name, count, seconds, err, iters in rows:
+        iter_text = "-" if iters is None else f"{np.mean(iters):.2f}"
+        print(f"{name:<16}{count:>10}{count / seconds / 1e6:>10.3f}{err.mean():>14.3e}{err.max():>14.3e}{iter_text:>8}")
+
+
+if __name__ == "__main__":
+    main()
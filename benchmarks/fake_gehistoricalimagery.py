@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+模拟GEHistoricalImagery的本地可执行程序，基准测试不需要联网
+支持download、availability和info子命令，按瓦片数模拟耗时、进度输出和输出文件大小
+
+环境变量:
+    FAKE_GE_LATENCY       每次调用的固定耗时(秒)，默认0.05
+    FAKE_GE_TILE_LATENCY  每个瓦片增加的耗时(秒)，默认0
+    FAKE_GE_TILE_BYTES    每个瓦片写出的字节数，默认4096
+    FAKE_GE_FAIL_RATE     download失败的概率(0~1)，默认0
+    FAKE_GE_DATES         availability和info列出的影像日期(逗号分隔，yyyy/MM/dd)，默认FAKE_DATES
+
+用法: DownloadScheduler(..., exe_path=[sys.executable, "benchmarks/fake_gehistoricalimagery.py"])
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tile_grid import grid_for_provider
+
+FAKE_DATES = ("2014/05/21", "2017/09/03", "2019/03/04", "2020/07/15", "2023/11/02")
+
+
+def env_float(name, default):
+    return float(os.environ.get(name, default))
+
+
+def parse_point(text):
+    lat, lng = (float(v) for v in text.split(","))
+    return lat, lng
+
+
+def download(args):
+    south, west = parse_point(args.lower_left)
+    north, east = parse_point(args.upper_right)
+    tiles = grid_for_provider(args.provider).tile_count((west, south, east, north), args.zoom)
+    latency = env_float("FAKE_GE_LATENCY", 0.05) + env_float("FAKE_GE_TILE_LATENCY", 0.0) * tiles
+
+    steps = min(tiles, 10)
+    for i in range(1, steps + 1):
+        time.sleep(latency / steps)
+        sys.stdout.write(f"Downloading tiles {i * tiles // steps}/{tiles}\r")
+        sys.stdout.flush()
+    sys.stdout.write("\n")
+
+    if random.random() < env_float("FAKE_GE_FAIL_RATE", 0.0):
+        sys.stderr.write("Simulated network error\n")
+        return 3
+    with open(args.output, "wb") as f:
+        f.write(b"\0" * (tiles * int(env_float("FAKE_GE_TILE_BYTES", 4096))))
+    print(f"Saved {tiles} tiles to {args.output}")
+    return 0
+
+
+def list_dates(args):
+    time.sleep(env_float("FAKE_GE_LATENCY", 0.05))
+    dates = os.environ.get("FAKE_GE_DATES")
+    for i, date in enumerate(dates.split(",") if dates else FAKE_DATES):
+        print(f"[{i}] {date}")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="GEHistoricalImagery模拟程序")
+    sub = parser.add_subparsers(dest="command")
+    p = sub.add_parser("download")
+    p.add_argument("--lower-left", required=True)
+    p.add_argument("--upper-right", required=True)
+    p.add_argument("--zoom", type=int, required=True)
+    p.add_argument("--date")
+    p.add_argument("--provider", default="TM")
+    p.add_argument("--output", required=True)
+    for name in ("availability", "info"):
+        p = sub.add_parser(name)
+        p.add_argument("--lower-left")
+        p.add_argument("--upper-right")
+        p.add_argument("--location")
+        p.add_argument("--zoom", type=int)
+        p.add_argument("--provider", default="TM")
+    args = parser.parse_args()
+    if args.command == "download":
+        return download(args)
+    if args.command in ("availability", "info"):
+        return list_dates(args)
+    parser.print_help()
+    return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
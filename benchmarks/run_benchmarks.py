@@ -0,0 +1,340 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+性能基准测试 - 坐标转换(标量/批量)、GeoJSON流式读取、区域规划(bbox和文件名分配)以及
+使用模拟GEHistoricalImagery的端到端下载，记录吞吐量、单次操作延迟的p50/p95/p99和峰值内存，
+并与保存的基线比较，不需要联网
+
+用法:
+    python benchmarks/run_benchmarks.py                     # 运行并与baseline.json比较
+    python benchmarks/run_benchmarks.py --quick --only transform
+    python benchmarks/run_benchmarks.py --save-baseline     # 把本次结果保存为新的基线
+    python benchmarks/run_benchmarks.py --check             # 有退化时返回1，可用于CI
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from coord_convert import (bd09_to_wgs84, bd09_to_wgs84_batch, gcj02_to_wgs84, gcj02_to_wgs84_batch,
+                           gcj02_to_wgs84_precise_batch, wgs84_to_gcj02, wgs84_to_gcj02_batch)
+from download_scheduler import DownloadScheduler
+from geojson_stream import iter_rings
+from metrics import RunMetrics, percentile
+
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, "baseline.json")
+FAKE_EXE = [sys.executable, os.path.join(BENCH_DIR, "fake_gehistoricalimagery.py")]
+DEFAULT_TOLERANCE = 0.25  # 吞吐量下降或延迟/内存上升超过25%视为退化
+
+
+def china_points(count, seed=0):
+    """在全国范围内随机生成count个点，返回Nx2数组"""
+    rng = np.random.default_rng(seed)
+    return np.column_stack([rng.uniform(74.0, 134.5, count), rng.uniform(18.0, 53.0, count)])
+
+
+def write_geojson(path, features, vertices=6, seed=0):
+    """生成含features个小多边形的FeatureCollection"""
+    rnd = random.Random(seed)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write('{"type": "FeatureCollection", "features": [\n')
+        for i in range(features):
+            lng, lat = rnd.uniform(100.0, 120.0), rnd.uniform(22.0, 40.0)
+            ring = [[lng + 0.01 * np.cos(a), lat + 0.01 * np.sin(a)]
+                    for a in np.linspace(0, 2 * np.pi, vertices, endpoint=False)]
+            ring.append(ring[0])
+            feature = {"type": "Feature", "properties": {"id": i},
+                       "geometry": {"type": "Polygon", "coordinates": [ring]}}
+            f.write(("," if i else "") + json.dumps(feature) + "\n")
+        f.write("]}\n")
+
+
+def timed_calls(func, args_list):
+    """逐个调用并记录每次调用的耗时"""
+    latencies = []
+    for args in args_list:
+        start = time.perf_counter()
+        func(*args)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def timed_iteration(iterable):
+    """记录迭代器产出每个元素的耗时"""
+    latencies = []
+    iterator = iter(iterable)
+    while True:
+        start = time.perf_counter()
+        try:
+            next(iterator)
+        except StopIteration:
+            return latencies
+        latencies.append(time.perf_counter() - start)
+
+
+class Case:
+    """
+    一个基准测试用例
+    :param func:func()执行一轮，返回(处理的条目数, 每次操作的延迟列表)
+    :param unit:条目的单位，用于显示吞吐量
+    """
+
+    def __init__(self, name, func, unit, setup=None):
+        self.name = name
+        self.func = func
+        self.unit = unit
+        self.setup = setup
+
+
+def transform_cases(points):
+    data = china_points(points)
+    pairs = [tuple(p) for p in data[: min(points, 20000)]]
+    batch = china_points(points * 10, seed=1)
+
+    def scalar(func):
+        return lambda: (len(pairs), timed_calls(func, pairs))
+
+    def batched(func):
+        # 每次操作转换整批点，延迟为一次批量调用的耗时
+        return lambda: (len(batch) * 3, timed_calls(func, [(batch,)] * 3))
+
+    return [
+        Case("transform.scalar.wgs84_to_gcj02", scalar(wgs84_to_gcj02), "pts"),
+        Case("transform.scalar.gcj02_to_wgs84", scalar(gcj02_to_wgs84), "pts"),
+        Case("transform.scalar.bd09_to_wgs84", scalar(bd09_to_wgs84), "pts"),
+        Case("transform.batch.wgs84_to_gcj02", batched(wgs84_to_gcj02_batch), "pts"),
+        Case("transform.batch.gcj02_to_wgs84", batched(gcj02_to_wgs84_batch), "pts"),
+        Case("transform.batch.gcj02_to_wgs84_precise", batched(gcj02_to_wgs84_precise_batch), "pts"),
+        Case("transform.batch.bd09_to_wgs84", batched(bd09_to_wgs84_batch), "pts"),
+    ]
+
+
+def readjson_cases(workdir, sizes):
+    """DownloadWorker的解析阶段即迭代iter_rings(path)，这里直接测iter_rings，避免导入Qt"""
+    cases = []
+    for size in sizes:
+        path = os.path.join(workdir, f"features_{size}.geojson")
+
+        def setup(path=path, size=size):
+            if not os.path.exists(path):
+                write_geojson(path, size)
+
+        def run(path=path):
+            latencies = timed_iteration(iter_rings(path))
+            return len(latencies), latencies
+
+        cases.append(Case(f"readjson.features_{size}", run, "features", setup=setup))
+    return cases
+
+
+def plan_cases(workdir, regions, existing):
+    """区域规划：计算bbox、切分分块并分配输出文件名"""
+    rings = list(_sample_rings(regions))
+
+    def plan_in(directory):
+        scheduler = DownloadScheduler(directory, zoom_level=18, exe_path=FAKE_EXE)
+        latencies = timed_iteration(scheduler.iter_plan(rings))
+        return len(latencies), latencies
+
+    def fresh_dir(name, prefill=0):
+        directory = os.path.join(workdir, name)
+
+        def setup():
+            shutil.rmtree(directory, ignore_errors=True)
+            os.makedirs(directory)
+            for i in range(prefill):
+                open(os.path.join(directory, f"historical_img_{i}.tif"), "wb").close()
+
+        return directory, setup
+
+    empty_dir, empty_setup = fresh_dir("plan_empty")
+    crowded_dir, crowded_setup = fresh_dir("plan_crowded", existing)
+    return [
+        Case(f"plan.regions_{regions}", lambda: plan_in(empty_dir), "regions", setup=empty_setup),
+        Case(f"plan.regions_{regions}_existing_{existing}", lambda: plan_in(crowded_dir), "regions",
+             setup=crowded_setup),
+    ]
+
+
+def _sample_rings(count, seed=2):
+    rnd = random.Random(seed)
+    for _ in range(count):
+        lng, lat = rnd.uniform(100.0, 120.0), rnd.uniform(22.0, 40.0)
+        yield np.array([[lng, lat], [lng + 0.004, lat], [lng + 0.004, lat + 0.004], [lng, lat + 0.004]])
+
+
+def download_cases(workdir, regions, workers):
+    """使用模拟程序的端到端下载，延迟为每个分块从启动子进程到结束的时间"""
+    directory = os.path.join(workdir, "download")
+    rings = list(_sample_rings(regions, seed=3))
+
+    def setup():
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory)
+
+    def run():
+        metrics = RunMetrics()
+        # 分块足够大，每个区域只有一个分块，不需要GDAL拼接
+        scheduler = DownloadScheduler(directory, zoom_level=17, max_workers=workers, exe_path=FAKE_EXE,
+                                      chunk_tiles=1024, metrics=metrics)
+        with contextlib.redirect_stdout(io.StringIO()):
+            results = scheduler.run(scheduler.plan(rings))
+        failed = [r for r in results if not r.ok]
+        if failed:
+            raise RuntimeError(failed[0].error)
+        return len(results), [s["seconds"] for s in metrics.spans if s["stage"] == "download"]
+
+    return [Case(f"download.fake_exe_{regions}x{workers}", run, "regions", setup=setup)]
+
+
+def measure(case, repeat, memory=True):
+    """
+    执行用例repeat轮，另外用tracemalloc单独执行一轮测峰值内存(tracemalloc会拖慢速度，不计入耗时)
+    """
+    items = 0
+    elapsed = 0.0
+    latencies = []
+    for _ in range(repeat):
+        if case.setup is not None:
+            case.setup()
+        start = time.perf_counter()
+        count, lat = case.func()
+        elapsed += time.perf_counter() - start
+        items += count
+        latencies.extend(lat)
+
+    peak = None
+    if memory:
+        if case.setup is not None:
+            case.setup()
+        tracemalloc.start()
+        try:
+            case.func()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    latencies.sort()
+    return {
+        "unit": case.unit,
+        "throughput": items / elapsed if elapsed > 0 else 0.0,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+        "samples": len(latencies),
+        "peak_bytes": peak,
+    }
+
+
+def compare(current, baseline, tolerance):
+    """
+    :return:退化项列表[(用例, 指标, 基线值, 当前值)]
+    """
+    regressions = []
+    for name, result in current.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if base["throughput"] and result["throughput"] < base["throughput"] * (1 - tolerance):
+            regressions.append((name, "throughput", base["throughput"], result["throughput"]))
+        for key in ("p95", "peak_bytes"):
+            if base.get(key) and result.get(key) is not None and result[key] > base[key] * (1 + tolerance):
+                regressions.append((name, key, base[key], result[key]))
+    return regressions
+
+
+def format_change(current, base):
+    if not base:
+        return "-"
+    return f"{(current / base - 1) * 100:+.0f}%"
+
+
+def print_table(results, baseline):
+    print(f"{'case':<46}{'throughput':>16}{'vs base':>9}{'p50':>11}{'p95':>11}{'p99':>11}{'peak':>10}")
+    for name, r in results.items():
+        base = baseline.get(name, {})
+        peak = "-" if r["peak_bytes"] is None else f"{r['peak_bytes'] / 1024 ** 2:.1f}MB"
+        print(f"{name:<46}{r['throughput']:>10.0f} {r['unit']:<5}{format_change(r['throughput'], base.get('throughput')):>9}"
+              f"{r['p50'] * 1e3:>9.3f}ms{r['p95'] * 1e3:>9.3f}ms{r['p99'] * 1e3:>9.3f}ms{peak:>10}")
+
+
+def environment():
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "date": time.strftime("%Y-%m-%d"),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="性能基准测试")
+    parser.add_argument("--only", help="只运行名称包含该字符串的用例")
+    parser.add_argument("--quick", action="store_true", help="缩小数据规模，快速检查")
+    parser.add_argument("--repeat", type=int, default=3, help="每个用例执行的轮数")
+    parser.add_argument("--no-memory", action="store_true", help="不测峰值内存")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="基线文件")
+    parser.add_argument("--save-baseline", action="store_true", help="把本次结果写入基线文件")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="允许的相对变化")
+    parser.add_argument("--check", action="store_true", help="有退化时返回非零退出码")
+    parser.add_argument("--output", help="把本次结果写出为JSON")
+    args = parser.parse_args()
+
+    scale = 0.1 if args.quick else 1.0
+    workdir = tempfile.mkdtemp(prefix="ge_bench_")
+    try:
+        cases = (transform_cases(int(20000 * scale))
+                 + readjson_cases(workdir, [int(n * scale) for n in (1000, 10000, 100000)])
+                 + plan_cases(workdir, int(2000 * scale), int(5000 * scale))
+                 + download_cases(workdir, max(4, int(32 * scale)), 4))
+        if args.only:
+            cases = [c for c in cases if args.only in c.name]
+
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline, encoding="utf-8") as f:
+                baseline = json.load(f).get("cases", {})
+
+        results = {}
+        for case in cases:
+            print(f"Running {case.name}...", file=sys.stderr)
+            results[case.name] = measure(case, args.repeat, memory=not args.no_memory)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print_table(results, baseline)
+    report = {"environment": environment(), "quick": args.quick, "cases": results}
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+
+    regressions = compare(results, baseline, args.tolerance)
+    for name, key, base, value in regressions:
+        print(f"REGRESSION {name} {key}: {base:.6g} -> {value:.6g}")
+    if not baseline:
+        print(f"No baseline found at {args.baseline}, run with --save-baseline to create one")
+    return 1 if args.check and regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
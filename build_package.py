@@ -43,6 +43,15 @@ def main():
         for file in missing_resource_files:
             print(f"  - {file}")
     
+    # 预先生成地图页面模板，打包后的程序启动时直接读取，不需要导入folium渲染
+    map_template = resources_dir / "map_template.html"
+    try:
+        subprocess.run([sys.executable, str(current_dir / "map_page.py"), f"--output={map_template}"],
+                       cwd=current_dir, check=True)
+        print(f"已生成地图模板: {map_template}")
+    except subprocess.CalledProcessError as e:
+        print(f"警告：地图模板生成失败，程序首次启动时将现场渲染: {e}")
+    
     print("开始打包应用程序...")
     
     # 构建PyInstaller命令
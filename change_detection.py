@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+变化检测 - 定期重复下载同一批区域时，只下载影像日期发生变化的瓦片，并覆盖到已有的拼接结果上
+输出目录中的tile_dates.sqlite记录每个区域的拼接结果和其中每个瓦片的影像日期；
+每次运行时按格网单元查询最新的影像日期，与记录不同的单元才下载，下载后拼接到原来的输出文件中
+GEHistoricalImagery只能按范围查询日期，单元内的瓦片都记为单元的最新日期，单元越小查询越多、判断越精细
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from defaults import DEFAULT_MAX_WORKERS
+from download_scheduler import RegionTask, ring_bbox
+from imagery_dates import query_available_dates
+from region_cache import quantize_bbox
+
+INDEX_FILE = "tile_dates.sqlite"
+DEFAULT_CELL_TILES = 16  # 查询日期的单元边长(瓦片数)，按全局网格对齐
+
+
+def region_key(bbox, zoom, provider):
+    """区域在索引中的键，同一区域每次运行的键相同"""
+    west, south, east, north = quantize_bbox(bbox)
+    return f"{provider}/{zoom}/{west},{south},{east},{north}"
+
+
+class TileDateIndex:
+    """
+    每个区域已有的拼接结果和其中每个瓦片的影像日期，保存在输出目录中，可以在多个线程中使用
+    拼接结果按文件名记录，输出目录整体移动后仍然有效
+    """
+
+    def __init__(self, output_path):
+        self.output_path = output_path
+        self.path = os.path.join(output_path, INDEX_FILE)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS mosaics (region TEXT PRIMARY KEY, output_file TEXT, updated REAL)")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS tiles ("
+                " region TEXT, x INTEGER, y INTEGER, date TEXT, PRIMARY KEY (region, x, y))")
+
+    def mosaic(self, key):
+        """:return:区域已有的拼接结果路径，没有记录或文件已被删除时返回None"""
+        with self._lock:
+            row = self._conn.execute("SELECT output_file FROM mosaics WHERE region = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        path = os.path.join(self.output_path, row[0])
+        return path if os.path.exists(path) else None
+
+    def held_dates(self, key, tile_range):
+        """:return:区域的拼接结果中tile_range内各瓦片的影像日期{(x, y): 日期}"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT x, y, date FROM tiles WHERE region = ? AND x BETWEEN ? AND ? AND y BETWEEN ? AND ?",
+                (key, tile_range.x0, tile_range.x1, tile_range.y0, tile_range.y1)).fetchall()
+        return {(x, y): date for x, y, date in rows}
+
+    def update(self, key, output_file, cells):
+        """
+        区域拼接成功后记录新的拼接结果和下载的单元的日期
+        :param cells:[(TileRange, 日期)]
+        """
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO mosaics (region, output_file, updated) VALUES (?, ?, ?)",
+                               (key, os.path.relpath(output_file, self.output_path), time.time()))
+            for tile_range, date in cells:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO tiles (region, x, y, date) VALUES (?, ?, ?, ?)",
+                    ((key, x, y, date) for y in range(tile_range.y0, tile_range.y1 + 1)
+                     for x in range(tile_range.x0, tile_range.x1 + 1)))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class ChangePlanner:
+    """
+    为每个区域查询各单元的最新影像日期，只把变化的单元交给调度器下载
+    :param scheduler:DownloadScheduler，使用它的格网、缩放级别、数据源和输出目录
+    :param cell_tiles:单元边长(瓦片数)
+    :param query:可选的回调query(bbox)->最新影像日期yyyy-MM-dd，默认通过GEHistoricalImagery查询
+    :param workers:同时查询的单元数
+    """
+
+    def __init__(self, scheduler, cell_tiles=DEFAULT_CELL_TILES, query=None, workers=DEFAULT_MAX_WORKERS):
+        self.scheduler = scheduler
+        self.index = TileDateIndex(scheduler.output_path)
+        self.cell_tiles = cell_tiles
+        self.query = query if query is not None else self.newest_date
+        self.workers = max(1, int(workers))
+        self.unchanged = 0  # 没有变化而跳过的区域数
+        self.changed_tiles = 0
+        self._pending = {}  # RegionTask -> (区域键, [(TileRange, 日期)])，拼接成功后写入索引
+        self._lock = threading.Lock()
+
+    def newest_date(self, bbox):
+        s = self.scheduler
+        return query_available_dates(bbox, s.zoom_level, s.provider, s.exe_path)[-1].isoformat()
+
+    def detect(self, index, key, bbox, mosaic, pool):
+        """
+        :param mosaic:区域已有的拼接结果，为None时所有单元都需要下载
+        :return:(变化的单元[(TileRange, 范围, 日期)], 查询失败的单元数)
+        """
+        s = self.scheduler
+        cells = list(s.grid.iter_chunks(bbox, s.zoom_level, self.cell_tiles))
+        futures = [pool.submit(self.query, cell_bbox) for _, cell_bbox in cells]
+        changed = []
+        failed = 0
+        for (tile_range, cell_bbox), future in zip(cells, futures):
+            try:
+                date = future.result()
+            except Exception as e:
+                print(f"Failed to query imagery dates for region {index} cell {tile_range.x0}_{tile_range.y0}: {e}")
+                failed += 1
+                continue
+            if mosaic is not None:
+                held = self.index.held_dates(key, tile_range)
+                if len(held) == tile_range.count and all(d == date for d in held.values()):
+                    continue
+            changed.append((tile_range, cell_bbox, date))
+        return changed, failed
+
+    def iter_plan(self, coordinates):
+        """
+        与DownloadScheduler.iter_plan相同，产出区域任务；没有变化的区域不产出
+        恢复的任务不需要跳过已完成的区域，它们的单元已经记录在索引中，不会再被判为变化
+        """
+        s = self.scheduler
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for i, coords in enumerate(coordinates, start=1):
+                bbox = ring_bbox(coords)
+                key = region_key(bbox, s.zoom_level, s.provider)
+                mosaic = self.index.mosaic(key)
+                with s.metrics.span("detect", region=i, zoom=s.zoom_level) as span:
+                    changed, failed = self.detect(i, key, bbox, mosaic, pool)
+                    span["tiles"] = sum(tile_range.count for tile_range, _, _ in changed)
+                if failed and mosaic is None:
+                    # 没有拼接结果可以补缺，查询不到的单元无法下载
+                    yield RegionTask(i, bbox, None, error=f"Failed to query imagery dates for region {i}")
+                    continue
+                if not changed:
+                    self.unchanged += 1
+                    print(f"Region {i} unchanged since the last run")
+                    continue
+                region = s.plan_patch(i, bbox, changed, mosaic)
+                tiles = sum(tile_range.count for tile_range, _, _ in changed)
+                action = f"patching {os.path.basename(mosaic)}" if mosaic is not None else "new mosaic"
+                print(f"Region {i}: {len(changed)} cells ({tiles} tiles) changed, {action}")
+                with self._lock:
+                    self.changed_tiles += tiles
+                    self._pending[region] = (key, [(tile_range, date) for tile_range, _, date in changed])
+                yield region
+
+    def commit(self, result):
+        """区域下载并拼接成功后更新索引，在on_result中调用；失败的区域下次仍判为变化"""
+        with self._lock:
+            pending = self._pending.pop(result.task, None)
+        if pending is None or not result.ok:
+            return
+        key, cells = pending
+        self.index.update(key, result.task.output_file, cells)
+
+    def close(self):
+        self.index.close()
@@ -0,0 +1,273 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+命令行批量下载 - 不依赖Qt/folium，适合在无界面的Linux节点、cron或集群作业中运行
+与图形界面共用同一套GeoJSON读取、坐标转换和下载调度逻辑
+
+用法:
+    python cli.py regions.geojson --zoom 18 --date 2024-01-01 --workers 4
+    python cli.py ./aoi_dir -o ./output --no-cache --merge
+    python cli.py regions.geojson --date 2018-06-01 2020-06-01 2022-06-01
+    python cli.py regions.geojson --date-range 2015-01-01 2024-12-31
+"""
+
+import argparse
+import glob
+import multiprocessing
+import os
+import sys
+import time
+
+from change_detection import ChangePlanner, DEFAULT_CELL_TILES
+from coord_convert import (MODE_FAST, MODE_PRECISE, bd09_to_wgs84_batch, gcj02_to_wgs84_batch,
+                           gcj02_to_wgs84_precise_batch)
+from defaults import DEFAULT_MAX_WORKERS, COMPRESS_CHOICES
+from download_scheduler import DownloadScheduler, DEFAULT_TIMEOUT, EXE_PATH
+from gdal_runtime import load_gdal
+from geojson_stream import iter_rings
+from imagery_dates import DateResolver
+from job_planner import ThroughputHistory, JobGuard, JobLimitExceeded, JobLimits, estimate_job
+from metrics import RunMetrics, format_summary
+from pipeline import ThreadedStage
+from postprocess import PostProcessOptions, PostProcessor, DEFAULT_POST_WORKERS
+from rate_governor import RateGovernor
+from retry_policy import RetryPolicy, summarize_failures, DEFAULT_MAX_ATTEMPTS, DEFAULT_TIMEOUT_PER_TILE
+from region_cache import RegionCache, DEFAULT_CACHE_DIR, DEFAULT_MAX_BYTES
+
+GEOJSON_PATTERNS = ("*.geojson", "*.json")
+
+
+def find_geojson_files(path):
+    """输入为目录时返回其中所有GeoJSON文件(按文件名排序)"""
+    if os.path.isdir(path):
+        files = set()
+        for pattern in GEOJSON_PATTERNS:
+            files.update(glob.glob(os.path.join(path, pattern)))
+        return sorted(files)
+    return [path]
+
+
+def to_wgs84(ring, input_crs, mode):
+    """把一个坐标环转换为WGS84"""
+    if input_crs == "wgs84":
+        return ring
+    if input_crs == "bd09":
+        return bd09_to_wgs84_batch(ring, out=ring)
+    if mode == MODE_PRECISE:
+        return gcj02_to_wgs84_precise_batch(ring, out=ring)[0]
+    return gcj02_to_wgs84_batch(ring, out=ring)
+
+
+def iter_wgs84_rings(files, input_crs, mode, metrics=None):
+    """边读边转换，调度器可以在文件读完之前开始下载；每个文件的读取和转换耗时各记录为一个区间"""
+    if metrics is None:
+        metrics = RunMetrics()
+    for path in files:
+        print(f"Reading {path}")
+        name = os.path.basename(path)
+        convert_seconds = 0.0
+        points = 0
+        for ring in metrics.timed_iter(iter_rings(path), "read_geojson", file=name):
+            start = time.perf_counter()
+            ring = to_wgs84(ring, input_crs, mode)
+            convert_seconds += time.perf_counter() - start
+            points += len(ring)
+            yield ring
+        metrics.record("convert", convert_seconds, file=name, items=points)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="小白影像下载器 - 命令行批量下载")
+    parser.add_argument("input", help="GeoJSON文件，或包含GeoJSON文件的目录")
+    parser.add_argument("-o", "--output", help="输出目录，默认与输入文件相同")
+    parser.add_argument("-z", "--zoom", type=int, default=18, help="缩放级别(1-20)，默认18")
+    parser.add_argument("-d", "--date", nargs="+", default=["2024-01-01"],
+                        help="影像日期，格式yyyy-MM-dd；给出多个日期时按实际影像去重后分别下载")
+    parser.add_argument("--date-range", nargs=2, metavar=("START", "END"),
+                        help="下载该日期范围内的所有影像(时间序列)")
+    parser.add_argument("-j", "--workers", type=int, default=DEFAULT_MAX_WORKERS, help="并发下载数")
+    parser.add_argument("--provider", default="TM", help="GEHistoricalImagery数据源，默认TM")
+    parser.add_argument("--input-crs", choices=("gcj02", "wgs84", "bd09"), default="gcj02",
+                        help="输入坐标系，地图界面导出的文件为gcj02")
+    parser.add_argument("--precise", action="store_true", help="GCJ02反算使用迭代高精度模式")
+    parser.add_argument("--timeout", type=int, default=DEFAULT_TIMEOUT, help="每个分块的基础超时时间(秒)")
+    parser.add_argument("--timeout-per-tile", type=float, default=DEFAULT_TIMEOUT_PER_TILE,
+                        help="每个瓦片增加的超时时间(秒)")
+    parser.add_argument("--attempts", type=int, default=DEFAULT_MAX_ATTEMPTS,
+                        help="临时性失败(超时、网络错误)时每个分块最多尝试的次数")
+    parser.add_argument("--max-tiles-per-second", type=float,
+                        help="所有并发下载合计的瓦片/秒上限，默认不限；失败率升高时并发数自动减少")
+    parser.add_argument("--max-mbps", type=float, help="所有并发下载合计的带宽上限(MB/s)，默认不限")
+    parser.add_argument("--exe", default=EXE_PATH, help="GEHistoricalImagery可执行文件路径")
+    parser.add_argument("--no-cache", action="store_true", help="不使用下载结果缓存")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR, help="缓存目录")
+    parser.add_argument("--cache-size", type=float, default=DEFAULT_MAX_BYTES / 1024 ** 3, help="缓存上限(GB)")
+    parser.add_argument("--merge", action="store_true", help="下载完成后把所有区域合并为一个COG")
+    parser.add_argument("--footprint", action="store_true",
+                        help="只下载与多边形相交的分块，并把输出裁剪到多边形(裁剪需要GDAL)")
+    parser.add_argument("--dedup", action="store_true",
+                        help="区域重叠时共享的瓦片只下载一次，再按各区域范围裁剪输出(需要GDAL)")
+    parser.add_argument("--postprocess", action="store_true",
+                        help="每个区域下载完成后建立金字塔并写出<输出>.json元数据(需要GDAL)")
+    parser.add_argument("--compress", choices=COMPRESS_CHOICES, help="后处理时重新压缩为该格式的COG")
+    parser.add_argument("--t-srs", help="后处理时重投影到该坐标系，如EPSG:3857")
+    parser.add_argument("--post-workers", type=int, default=DEFAULT_POST_WORKERS, help="后处理进程数")
+    parser.add_argument("--changes", action="store_true",
+                        help="变化检测：只下载最新影像日期与上次运行不同的单元，并覆盖到已有的输出上(需要GDAL)")
+    parser.add_argument("--change-cell", type=int, default=DEFAULT_CELL_TILES,
+                        help="变化检测时查询日期的单元边长(瓦片数)，越小越精细、查询越多")
+    parser.add_argument("--dry-run", action="store_true", help="只显示瓦片数和预计数据量、耗时，不下载")
+    parser.add_argument("--max-tiles", type=int, help="瓦片总数上限，超过时拒绝下载(默认见planner.json)")
+    parser.add_argument("--max-gb", type=float, help="预计数据量上限(GB)，超过时拒绝下载")
+    parser.add_argument("--force", action="store_true", help="忽略规模上限")
+    parser.add_argument("--report-dir", help="运行报告(JSON/CSV)的输出目录，默认为输出目录")
+    parser.add_argument("--no-report", action="store_true", help="不写出运行报告")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    files = find_geojson_files(args.input)
+    if not files:
+        print(f"No GeoJSON files found in {args.input}")
+        return 2
+    output_path = os.path.abspath(args.output) if args.output else os.path.dirname(os.path.abspath(files[0]))
+    os.makedirs(output_path, exist_ok=True)
+
+    cache = None if args.no_cache else RegionCache(args.cache_dir, int(args.cache_size * 1024 ** 3))
+    metrics = RunMetrics()
+    # 只在给出限速时创建，否则调度器不经过限速器
+    governor = None
+    if args.max_tiles_per_second or args.max_mbps:
+        governor = RateGovernor(args.max_tiles_per_second,
+                                args.max_mbps * 1024 ** 2 if args.max_mbps else None, args.workers)
+    scheduler = DownloadScheduler(output_path, args.zoom, args.date[0], args.workers, exe_path=args.exe,
+                                  provider=args.provider, timeout=args.timeout, cache=cache, metrics=metrics,
+                                  retry=RetryPolicy(args.attempts, timeout_per_tile=args.timeout_per_tile),
+                                  footprint=args.footprint, dedup=args.dedup, governor=governor)
+    dates = None
+    if args.date_range or len(args.date) > 1:
+        dates = DateResolver(args.zoom, args.provider, args.exe, requested=args.date, date_range=args.date_range)
+    mode = MODE_PRECISE if args.precise else MODE_FAST
+
+    # 规模上限；时间序列的期数在查询前未知，按1期估算
+    history = ThroughputHistory()
+    # 复制一份再按参数覆盖，本次的上限不会随吞吐量写回planner.json
+    limits = JobLimits(**history.limits.to_dict())
+    if args.max_tiles is not None:
+        limits.max_tiles = args.max_tiles
+    if args.max_gb is not None:
+        limits.max_bytes = int(args.max_gb * 1024 ** 3)
+    if args.force:
+        limits = JobLimits(None, None)
+    dates_per_region = 1 if args.date_range else len(set(args.date))
+    if args.dry_run:
+        # 只估算规模(只计算bbox，流式读取不占内存)
+        estimate = estimate_job(iter_wgs84_rings(files, args.input_crs, mode), args.zoom, args.provider,
+                                args.workers, history=history, dates_per_region=dates_per_region,
+                                footprint=args.footprint, dedup=scheduler.dedup)
+        print(estimate.format())
+        return 0
+
+    if args.merge and load_gdal() is None:
+        # 下载前就提示，不要等所有区域下载完才失败
+        print("--merge needs GDAL Python bindings, outputs are kept per region")
+        args.merge = False
+
+    # 变化检测按单元下载最新影像，再拼接到上次的输出中
+    planner = None
+    if args.changes:
+        if load_gdal() is None:
+            print("Change detection needs GDAL Python bindings to patch existing outputs")
+            return 2
+        if dates is not None or args.footprint or scheduler.dedup:
+            print("Change detection always downloads the newest imagery of each region's bbox, "
+                  "--date, --date-range, --footprint and --dedup are ignored")
+        planner = ChangePlanner(scheduler, args.change_cell, workers=args.workers)
+
+    # 后处理在进程池中与后面区域的下载同时进行；指定压缩或坐标系时自动启用
+    postprocessor = None
+    if args.postprocess or args.compress or args.t_srs:
+        if load_gdal() is None:
+            print("Post-processing disabled: GDAL Python bindings are not available")
+        else:
+            options = PostProcessOptions(target_srs=args.t_srs, compress=args.compress)
+            postprocessor = PostProcessor(options, args.post_workers, metrics)
+
+    def on_result(result, done, total):
+        if planner is not None:
+            planner.commit(result)
+        status = "cached" if result.cached else ("ok" if result.ok else "FAILED")
+        progress = f"{done}/{total}" if total else f"{done}"
+        print(f"[{progress}] {result.task.label}: {status} -> {result.task.output_file}")
+        if not result.ok:
+            print(f"    {result.error}")
+        elif postprocessor is not None:
+            task = result.task
+            postprocessor.submit(task.output_file, {"region": task.index, "date": task.date, "zoom": args.zoom,
+                                                    "provider": args.provider, "bbox": list(task.bbox)})
+
+    # 读取转换和规划各在一个线程中运行，通过有界队列交给调度器
+    start = time.perf_counter()
+    # 输入只读取一遍：规模在规划的同时逐个区域累计，超过上限时取消已经开始的下载
+    guard = JobGuard(limits, args.zoom, args.provider, args.workers, history=history,
+                     dates_per_region=dates_per_region, footprint=args.footprint, dedup=scheduler.dedup,
+                     on_exceeded=scheduler.cancel)
+    rings = ThreadedStage("read", guard.check(iter_wgs84_rings(files, args.input_crs, mode, metrics)))
+    tasks = planner.iter_plan(rings) if planner is not None else scheduler.iter_plan(rings, dates)
+    plan = ThreadedStage("plan", tasks)
+    try:
+        results = scheduler.run(plan, on_result=on_result)
+    except JobLimitExceeded:
+        results = []
+    finally:
+        plan.close()
+        rings.close()
+        if planner is not None:
+            planner.close()
+    print(guard.job.format())
+    if guard.error is not None:
+        if postprocessor is not None:
+            postprocessor.cancel()
+        print(f"Refusing to download: {guard.error}")
+        print("Lower the zoom level, split the input, or pass --force")
+        return 3
+    if planner is not None:
+        print(f"{planner.changed_tiles} changed tiles, {planner.unchanged} regions unchanged")
+    failed = [r for r in results if not r.ok]
+
+    status = 1 if failed else 0
+    if postprocessor is not None:
+        print("Waiting for post-processing to finish...")
+        post_failures = postprocessor.wait()
+        if post_failures:
+            print(f"{len(post_failures)} outputs failed post-processing")
+            status = 1
+    if args.merge and len(failed) < len(results):
+        try:
+            for mosaic_file in scheduler.merge_results(results):
+                print(f"Merged outputs into {mosaic_file}")
+        except Exception as e:
+            print(f"Failed to merge outputs: {e}")
+            status = 1
+
+    if failed:
+        print(summarize_failures(results))
+    print(format_summary(metrics.summary()))
+    if history.update(metrics):
+        try:
+            history.save()
+        except OSError as e:
+            print(f"Failed to save throughput history: {e}")
+    if not args.no_report:
+        report_dir = args.report_dir or output_path
+        os.makedirs(report_dir, exist_ok=True)
+        for path in metrics.write_report(report_dir):
+            print(f"Run report written to {path}")
+    print(f"{len(results) - len(failed)}/{len(results)} regions succeeded in {time.perf_counter() - start:.1f}s")
+    return status
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main())
@@ -12,11 +12,19 @@
 
 import math
 
+import numpy as np
+
 x_pi = math.pi  * 3000.0 / 180.0
 
 a = 6378245.0  # 长半轴
 ee = 0.00669342162296594323  # 扁率
 
+# GCJ02->WGS84反算模式
+MODE_FAST = "fast"  # 单步线性近似，误差为米级
+MODE_PRECISE = "precise"  # 不动点迭代，直到残差小于容差
+DEFAULT_TOLERANCE = 1e-9  # 迭代容差(度)，约0.1毫米
+DEFAULT_MAX_ITER = 20
+
 
 def gcj02_to_bd09(lng, lat):
     """
@@ -61,12 +69,12 @@ def wgs84_to_gcj02(lng, lat):
         return lng, lat
     dlat = _transformlat(lng - 105.0, lat - 35.0)
     dlng = _transformlng(lng - 105.0, lat - 35.0)
-    radlat = lat / 180.0 * pi
+    radlat = lat / 180.0 * math.pi
     magic = math.sin(radlat)
     magic = 1 - ee * magic * magic
     sqrtmagic = math.sqrt(magic)
-    dlat = (dlat * 180.0) / ((a * (1 - ee)) / (magic * sqrtmagic) * pi)
-    dlng = (dlng * 180.0) / (a / sqrtmagic * math.cos(radlat) * pi)
+    dlat = (dlat * 180.0) / ((a * (1 - ee)) / (magic * sqrtmagic) * math.pi)
+    dlng = (dlng * 180.0) / (a / sqrtmagic * math.cos(radlat) * math.pi)
     mglat = lat + dlat
     mglng = lng + dlng
     return [mglng, mglat]
@@ -94,6 +102,32 @@ def gcj02_to_wgs84(lng, lat):
     return [lng * 2 - mglng, lat * 2 - mglat]
 
 
+def gcj02_to_wgs84_precise(lng, lat, tol=DEFAULT_TOLERANCE, max_iter=DEFAULT_MAX_ITER):
+    """
+    GCJ02(火星坐标系)转GPS84，高精度迭代版本
+    以不动点迭代 w = w - (wgs84_to_gcj02(w) - g) 反解，第1次迭代的结果与gcj02_to_wgs84相同
+    :param lng:火星坐标系的经度
+    :param lat:火星坐标系纬度
+    :param tol:正算残差的容差(度)
+    :param max_iter:最大迭代次数
+    :return:[经度, 纬度, 迭代次数]
+    """
+    if out_of_china(lng, lat):
+        return [lng, lat, 0]
+    wgs_lng, wgs_lat = lng, lat
+    iterations = 0
+    while iterations < max_iter:
+        gcj_lng, gcj_lat = wgs84_to_gcj02(wgs_lng, wgs_lat)
+        dlng = gcj_lng - lng
+        dlat = gcj_lat - lat
+        if abs(dlng) < tol and abs(dlat) < tol:
+            break
+        wgs_lng -= dlng
+        wgs_lat -= dlat
+        iterations += 1
+    return [wgs_lng, wgs_lat, iterations]
+
+
 def bd09_to_wgs84(bd_lon, bd_lat):
     lon, lat = bd09_to_gcj02(bd_lon, bd_lat)
     return gcj02_to_wgs84(lon, lat)
@@ -139,6 +173,198 @@ def out_of_china(lng, lat):
     """
     return not (lng > 73.66 and lng < 135.05 and lat > 3.86 and lat < 53.55)
 
+
+# ---------------------------------------------------------------------------
+# NumPy批量接口：输入经度、纬度数组(或Nx2坐标数组)，结果写入(N, 2)输出数组
+# 运算顺序与上面的标量函数保持一致，逐点结果相同
+# ---------------------------------------------------------------------------
+
+# np.arctan2与math.atan2在末位上可能不同，BD-09转换逐点调用math.atan2以保证结果一致
+_atan2_ufunc = np.frompyfunc(math.atan2, 2, 1)
+
+
+def _atan2(y, x):
+    return np.asarray(_atan2_ufunc(y, x), dtype=np.float64)
+
+
+def _split_coords(lng, lat):
+    """lat为None时把lng视为Nx2的[lng, lat]坐标数组"""
+    if lat is None:
+        coords = np.asarray(lng, dtype=np.float64)
+        return coords[..., 0], coords[..., 1]
+    return np.asarray(lng, dtype=np.float64), np.asarray(lat, dtype=np.float64)
+
+
+def _pack_coords(lng, lat, out):
+    if out is None:
+        out = np.empty(lng.shape + (2,), dtype=np.float64)
+    out[..., 0] = lng
+    out[..., 1] = lat
+    return out
+
+
+def _transformlat_batch(lng, lat):
+    ret = -100.0 + 2.0 * lng + 3.0 * lat + 0.2 * lat * lat + \
+          0.1 * lng * lat + 0.2 * np.sqrt(np.fabs(lng))
+    ret += (20.0 * np.sin(6.0 * lng * math.pi) + 20.0 * np.sin(2.0 * lng * math.pi)) * 2.0 / 3.0
+    ret += (20.0 * np.sin(lat * math.pi) + 40.0 * np.sin(lat / 3.0 * math.pi)) * 2.0 / 3.0
+    ret += (160.0 * np.sin(lat / 12.0 * math.pi) + 320 * np.sin(lat * math.pi / 30.0)) * 2.0 / 3.0
+    return ret
+
+
+def _transformlng_batch(lng, lat):
+    ret = 300.0 + lng + 2.0 * lat + 0.1 * lng * lng + \
+          0.1 * lng * lat + 0.1 * np.sqrt(np.fabs(lng))
+    ret += (20.0 * np.sin(6.0 * lng * math.pi) + 20.0 *
+            np.sin(2.0 * lng * math.pi)) * 2.0 / 3.0
+    ret += (20.0 * np.sin(lng * math.pi) + 40.0 *
+            np.sin(lng / 3.0 * math.pi)) * 2.0 / 3.0
+    ret += (150.0 * np.sin(lng / 12.0 * math.pi) + 300.0 *
+            np.sin(lng / 30.0 * math.pi)) * 2.0 / 3.0
+    return ret
+
+
+def out_of_china_batch(lng, lat=None):
+    """
+    out_of_china的批量版本
+    :return:布尔数组，True表示不在国内
+    """
+    lng, lat = _split_coords(lng, lat)
+    return ~((lng > 73.66) & (lng < 135.05) & (lat > 3.86) & (lat < 53.55))
+
+
+def _gcj02_offset_batch(lng, lat):
+    """计算WGS84->GCJ02的偏移量(dlng, dlat)"""
+    dlat = _transformlat_batch(lng - 105.0, lat - 35.0)
+    dlng = _transformlng_batch(lng - 105.0, lat - 35.0)
+    radlat = lat / 180.0 * math.pi
+    magic = np.sin(radlat)
+    magic = 1 - ee * magic * magic
+    sqrtmagic = np.sqrt(magic)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        dlat = (dlat * 180.0) / ((a * (1 - ee)) / (magic * sqrtmagic) * math.pi)
+        dlng = (dlng * 180.0) / (a / sqrtmagic * np.cos(radlat) * math.pi)
+    return dlng, dlat
+
+
+def wgs84_to_gcj02_batch(lng, lat=None, out=None):
+    """
+    wgs84_to_gcj02的批量版本
+    :param lng:WGS84经度数组，lat为None时为Nx2坐标数组
+    :param lat:WGS84纬度数组
+    :param out:可选的(N, 2)输出数组，可以与输入是同一块内存
+    :return:(N, 2)的GCJ02坐标数组
+    """
+    lng, lat = _split_coords(lng, lat)
+    outside = out_of_china_batch(lng, lat)
+    dlng, dlat = _gcj02_offset_batch(lng, lat)
+    mglng = np.where(outside, lng, lng + dlng)
+    mglat = np.where(outside, lat, lat + dlat)
+    return _pack_coords(mglng, mglat, out)
+
+
+def gcj02_to_wgs84_batch(lng, lat=None, out=None):
+    """
+    gcj02_to_wgs84的批量版本
+    :param lng:火星坐标系经度数组，lat为None时为Nx2坐标数组
+    :param lat:火星坐标系纬度数组
+    :param out:可选的(N, 2)输出数组，可以与输入是同一块内存
+    :return:(N, 2)的WGS84坐标数组
+    """
+    lng, lat = _split_coords(lng, lat)
+    outside = out_of_china_batch(lng, lat)
+    dlng, dlat = _gcj02_offset_batch(lng, lat)
+    mglat = lat + dlat
+    mglng = lng + dlng
+    wgs_lng = np.where(outside, lng, lng * 2 - mglng)
+    wgs_lat = np.where(outside, lat, lat * 2 - mglat)
+    return _pack_coords(wgs_lng, wgs_lat, out)
+
+
+def gcj02_to_wgs84_precise_batch(lng, lat=None, out=None, tol=DEFAULT_TOLERANCE, max_iter=DEFAULT_MAX_ITER):
+    """
+    gcj02_to_wgs84_precise的批量版本，已收敛的点不再更新
+    :param lng:火星坐标系经度数组，lat为None时为Nx2坐标数组
+    :param lat:火星坐标系纬度数组
+    :param out:可选的(N, 2)输出数组，可以与输入是同一块内存
+    :return:((N, 2)的WGS84坐标数组, 每个点的迭代次数数组)
+    """
+    lng, lat = _split_coords(lng, lat)
+    lng = np.array(lng, dtype=np.float64)
+    lat = np.array(lat, dtype=np.float64)
+    wgs_lng = lng.copy()
+    wgs_lat = lat.copy()
+    iterations = np.zeros(lng.shape, dtype=np.int32)
+    active = ~out_of_china_batch(lng, lat)
+    for _ in range(max_iter):
+        if not active.any():
+            break
+        gcj = wgs84_to_gcj02_batch(wgs_lng[active], wgs_lat[active])
+        dlng = gcj[..., 0] - lng[active]
+        dlat = gcj[..., 1] - lat[active]
+        pending = (np.fabs(dlng) >= tol) | (np.fabs(dlat) >= tol)
+        index = np.flatnonzero(active)[pending]
+        wgs_lng.flat[index] -= dlng[pending]
+        wgs_lat.flat[index] -= dlat[pending]
+        iterations.flat[index] += 1
+        active.flat[np.flatnonzero(active)[~pending]] = False
+    return _pack_coords(wgs_lng, wgs_lat, out), iterations
+
+
+def gcj02_to_bd09_batch(lng, lat=None, out=None):
+    """gcj02_to_bd09的批量版本"""
+    lng, lat = _split_coords(lng, lat)
+    z = np.sqrt(lng * lng + lat * lat) + 0.00002 * np.sin(lat * x_pi)
+    theta = _atan2(lat, lng) + 0.000003 * np.cos(lng * x_pi)
+    bd_lng = z * np.cos(theta) + 0.0065
+    bd_lat = z * np.sin(theta) + 0.006
+    return _pack_coords(bd_lng, bd_lat, out)
+
+
+def bd09_to_gcj02_batch(bd_lon, bd_lat=None, out=None):
+    """bd09_to_gcj02的批量版本"""
+    bd_lon, bd_lat = _split_coords(bd_lon, bd_lat)
+    x = bd_lon - 0.0065
+    y = bd_lat - 0.006
+    z = np.sqrt(x * x + y * y) - 0.00002 * np.sin(y * x_pi)
+    theta = _atan2(y, x) - 0.000003 * np.cos(x * x_pi)
+    gg_lng = z * np.cos(theta)
+    gg_lat = z * np.sin(theta)
+    return _pack_coords(gg_lng, gg_lat, out)
+
+
+def bd09_to_wgs84_batch(bd_lon, bd_lat=None, out=None):
+    """bd09_to_wgs84的批量版本"""
+    gcj = bd09_to_gcj02_batch(bd_lon, bd_lat, out=out)
+    return gcj02_to_wgs84_batch(gcj, out=gcj)
+
+
+def wgs84_to_bd09_batch(lon, lat=None, out=None):
+    """wgs84_to_bd09的批量版本"""
+    gcj = wgs84_to_gcj02_batch(lon, lat, out=out)
+    return gcj02_to_bd09_batch(gcj, out=gcj)
+
+
+def rings_gcj02_to_wgs84(rings, mode=MODE_FAST):
+    """
+    把多个GCJ02坐标环一次性转换为WGS84
+    所有顶点拼成一个数组统一转换，再按原来的环切分
+    :param rings:坐标环列表，每个环为[[lng, lat], ...]或Nx2数组
+    :param mode:MODE_FAST单步近似，MODE_PRECISE迭代反算
+    :return:Nx2 WGS84数组的列表
+    """
+    if not rings:
+        return []
+    arrays = [np.asarray(ring, dtype=np.float64).reshape(-1, 2) for ring in rings]
+    coords = np.concatenate(arrays)
+    if mode == MODE_PRECISE:
+        gcj02_to_wgs84_precise_batch(coords, out=coords)
+    else:
+        gcj02_to_wgs84_batch(coords, out=coords)
+    offsets = np.cumsum([len(ring) for ring in arrays])[:-1]
+    return np.split(coords, offsets)
+
+
 if __name__ == '__main__':
     lng = 113.224367
     lat = 25.69346
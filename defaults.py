@@ -0,0 +1,9 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+默认参数 - 命令行、界面和下载模块共用的常量
+只包含常量、不导入其他模块，界面启动时导入它不会连带加载下载调度等模块
+"""
+
+DEFAULT_MAX_WORKERS = 4  # 默认并发下载数
+COMPRESS_CHOICES = ("DEFLATE", "JPEG", "WEBP")  # 后处理重新压缩可选的格式
@@ -0,0 +1,845 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+下载调度器 - 以有限并发同时运行多个GEHistoricalImagery download子进程
+不依赖Qt，由DownloadWorker在后台线程中驱动
+大区域按瓦片网格切成分块，每个分块是一个独立的子任务，进度记录在下载清单中，中断后可以续传
+"""
+
+import os
+import shutil
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import numpy as np
+
+from footprint import FootprintCover
+from gdal_runtime import load_gdal
+from job_manifest import JobManifest, region_signature
+from metrics import RunMetrics, bbox_area_km2
+from mosaic import build_cog
+from output_names import OutputNameAllocator
+from retry_policy import RetryPolicy, classify_output, CANCELLED, PERMANENT, TRANSIENT
+from defaults import DEFAULT_MAX_WORKERS
+from tile_claims import TileClaimIndex
+from tile_grid import grid_for_provider, DEFAULT_CHUNK_TILES
+
+# GEHistoricalImagery.exe的默认路径
+EXE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "GEHistoricalImagery.exe")
+DEFAULT_TIMEOUT = 300  # 每个分块5分钟超时
+PROGRESS_INTERVAL = 0.5  # 实时进度回调的最小间隔(秒)
+
+
+def exe_command(exe_path):
+    """
+    可执行文件的命令前缀
+    :param exe_path:可执行文件路径，或命令列表(如[sys.executable, "fake_gehistoricalimagery.py"])
+    """
+    if isinstance(exe_path, (list, tuple)):
+        return list(exe_path)
+    return [exe_path]
+
+
+def reorganize_coords(coords):
+    """
+    把[[lng, lat], ...]形式的环拆成经度列表和纬度列表
+    :param coords:坐标点序列或Nx2数组
+    :return:(longitudes, latitudes)
+    """
+    if hasattr(coords, "ndim") and coords.ndim == 2:
+        return coords[:, 0].tolist(), coords[:, 1].tolist()
+    longitudes = []
+    latitudes = []
+    for point in coords:
+        longitude, latitude = point
+        longitudes.append(longitude)
+        latitudes.append(latitude)
+    return longitudes, latitudes
+
+
+def ring_bbox(coords):
+    """:return:坐标环的(west, south, east, north)"""
+    longitudes, latitudes = reorganize_coords(coords)
+    return min(longitudes), min(latitudes), max(longitudes), max(latitudes)
+
+
+class ChunkTask:
+    """区域中的一个分块，是实际执行下载命令的单位"""
+
+    def __init__(self, region, key, tile_range, bbox, output_file, done=False, date=None):
+        self.region = region
+        self.key = key  # 分块键，如"x0_y0"
+        self.tile_range = tile_range
+        self.bbox = bbox  # (west, south, east, north)
+        self.output_file = output_file
+        self.done = done  # 续传时已完成的分块
+        self.date = date  # 变化检测时分块自己的影像日期，为None时使用区域的日期
+        self.lock = threading.Lock()
+        self.consumers = []  # 等待该分块结束的区域(包括所属区域和引用它的重叠区域)
+        self.result = None  # 下载结束后的RegionResult
+        self.references = 0  # 拼接时引用该分块文件的区域数，归零后删除
+
+    @property
+    def index(self):
+        return self.region.index
+
+    @property
+    def label(self):
+        if len(self.region.chunks) == 1:
+            return self.region.label
+        return f"{self.region.label} chunk {self.key}"
+
+    @property
+    def imagery_date(self):
+        return self.date or self.region.date
+
+    @property
+    def lower_left(self):
+        return f"{self.bbox[1]},{self.bbox[0]}"  # "lat,lng"
+
+    @property
+    def upper_right(self):
+        return f"{self.bbox[3]},{self.bbox[2]}"  # "lat,lng"
+
+
+class RegionTask:
+    """单个区域的下载任务"""
+
+    def __init__(self, index, bbox, output_file, manifest=None, reserved_name=None, date=None, series=False,
+                 error=None):
+        self.index = index  # 区域序号，从1开始
+        self.bbox = bbox  # (west, south, east, north)
+        self.output_file = output_file
+        self.date = date  # 影像日期yyyy-MM-dd
+        self.series = series  # 是否为时间序列中的一期
+        self.error = error  # 规划阶段就已确定的错误，如查询不到影像日期
+        self.reserved_name = reserved_name  # 由OutputNameAllocator预留的名字，区域结束后释放
+        self.manifest = manifest  # 多分块区域的下载清单
+        self.chunks = []  # 拼接需要的分块，去重时包含其他区域下载的分块
+        self.lock = threading.Lock()
+        self.remaining = 0  # 尚未结束的分块数
+        self.chunk_results = []  # 已结束分块的结果
+        self.failed = False
+        self.merge_error = None
+        self.footprint = None  # 只下载多边形覆盖的分块时为WGS84坐标环，拼接后按其裁剪
+        self.base_file = None  # 变化检测时已有的拼接结果，变化的分块覆盖在它上面
+
+    @property
+    def needs_merge(self):
+        """区域的输出是否需要由分块拼接(或覆盖到已有的输出上)"""
+        single = len(self.chunks) == 1 and self.chunks[0].output_file == self.output_file
+        return not single or self.base_file is not None
+
+    @property
+    def own_chunks(self):
+        """由本区域下载的分块"""
+        return [chunk for chunk in self.chunks if chunk.region is self]
+
+    @property
+    def label(self):
+        if self.series:
+            return f"region {self.index} ({self.date})"
+        return f"region {self.index}"
+
+    @property
+    def lower_left(self):
+        return f"{self.bbox[1]},{self.bbox[0]}"  # "lat,lng"
+
+    @property
+    def upper_right(self):
+        return f"{self.bbox[3]},{self.bbox[2]}"  # "lat,lng"
+
+
+class RegionResult:
+    """单个区域(或分块)的下载结果"""
+
+    def __init__(self, task, returncode=None, stdout="", stderr="", error=None, cached=False, failure_kind=None):
+        self.task = task
+        self.returncode = returncode
+        self.stdout = stdout
+        self.stderr = stderr
+        self.error = error  # 失败时的错误信息，成功时为None
+        self.cached = cached  # 结果是否直接取自缓存
+        self.failure_kind = failure_kind  # 失败类型: transient/permanent/cancelled
+        self.attempts = 1  # 尝试次数
+        self.timed_out = False
+        self.chunk_results = []
+
+    @property
+    def index(self):
+        return self.task.index
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+class TransferStats:
+    """汇总所有分块的实时进度和吞吐量，可以在多个线程中更新"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.start = time.monotonic()
+        self.total_chunks = 0
+        self.finished_chunks = 0
+        self.partial = {}  # 正在下载的分块 -> 完成比例
+        self.tiles_done = 0.0  # 本次运行中已完成分块的瓦片数
+        self.bytes_done = 0  # 本次运行中已写出的字节数
+        self._last_report = 0.0
+
+    def add_chunks(self, total, finished):
+        with self._lock:
+            self.total_chunks += total
+            self.finished_chunks += finished
+
+    def update(self, chunk, fraction):
+        """
+        更新分块的完成比例
+        :return:距离上次回调超过PROGRESS_INTERVAL时返回True
+        """
+        with self._lock:
+            self.partial[chunk] = max(fraction, self.partial.get(chunk, 0.0))
+            now = time.monotonic()
+            if now - self._last_report < PROGRESS_INTERVAL:
+                return False
+            self._last_report = now
+            return True
+
+    def finish(self, chunk, ok, bytes_written=0):
+        with self._lock:
+            self.partial.pop(chunk, None)
+            self.finished_chunks += 1
+            if ok:
+                self.tiles_done += chunk.tile_range.count
+            self.bytes_done += bytes_written
+            self._last_report = time.monotonic()
+
+    def snapshot(self):
+        """
+        :return:{"fraction": 总体完成比例, "tiles_per_second", "bytes_per_second", "elapsed"}
+        """
+        with self._lock:
+            elapsed = max(time.monotonic() - self.start, 1e-6)
+            partial_tiles = sum(fraction * chunk.tile_range.count for chunk, fraction in self.partial.items())
+            done = self.finished_chunks + sum(self.partial.values())
+            return {
+                "fraction": done / self.total_chunks if self.total_chunks else 0.0,
+                "tiles_per_second": (self.tiles_done + partial_tiles) / elapsed,
+                "bytes_per_second": self.bytes_done / elapsed,
+                "elapsed": elapsed,
+            }
+
+
+class DownloadScheduler:
+    """
+    并发下载调度器
+    最多同时运行max_workers个子进程，结果按区域序号依次回调，保证界面收到的顺序确定
+    """
+
+    def __init__(self, output_path, zoom_level=18, date="2010-01-01", max_workers=DEFAULT_MAX_WORKERS,
+                 exe_path=EXE_PATH, provider="TM", timeout=DEFAULT_TIMEOUT, cache=None,
+                 chunk_tiles=DEFAULT_CHUNK_TILES, keep_parts=False, metrics=None, retry=None, footprint=False,
+                 dedup=False, governor=None):
+        self.output_path = output_path
+        self.zoom_level = zoom_level
+        self.date = date
+        self.max_workers = max(1, int(max_workers))
+        self.exe_path = exe_path
+        self.provider = provider
+        self.timeout = timeout  # 基础超时时间，实际超时由retry按瓦片数放宽
+        self.retry = retry if retry is not None else RetryPolicy()
+        self.governor = governor  # RateGovernor，为None时不限速，并发数固定为max_workers
+        self.cache = cache  # RegionCache，为None时不使用缓存
+        self.chunk_tiles = chunk_tiles
+        self.keep_parts = keep_parts  # 拼接完成后是否保留分块文件
+        self.footprint = footprint  # 是否只下载与多边形相交的分块并裁剪到多边形
+        self.can_merge = load_gdal() is not None  # 分块拼接、多边形裁剪和去重需要GDAL
+        if dedup and not self.can_merge:
+            print("GDAL not available, overlapping regions are downloaded separately")
+            dedup = False
+        self.dedup = dedup  # 重叠区域的瓦片是否只下载一次(拼接需要GDAL)
+        self.claims = None  # TileClaimIndex，去重时首次规划时创建
+        # 规划线程认领分块并增加引用，与工作线程释放引用、撤销认领互斥，
+        # 已删除的分块文件不会再被后面规划的区域引用
+        self._claims_lock = threading.Lock()
+        self.grid = grid_for_provider(provider)
+        self.metrics = metrics if metrics is not None else RunMetrics()  # 各阶段耗时
+        self.names = None  # OutputNameAllocator，首次规划时创建
+        self.engine = None  # AsyncProcessEngine，run期间有效
+        self.stats = None  # TransferStats，run期间有效
+        self._completed = deque()  # 所有分块都已结束的区域，由工作线程加入，调度线程取出
+        self.on_progress = None
+        self.cancelled = False
+        self._cancel_event = threading.Event()  # 用于打断重试前的等待
+        self.results = []
+
+    def plan(self, coordinates, dates=None):
+        """
+        为每个区域计算下载范围、切分分块并分配输出文件名
+        :param coordinates:WGS84坐标环列表
+        :param dates:见iter_plan
+        :return:RegionTask列表
+        """
+        return list(self.iter_plan(coordinates, dates))
+
+    def iter_plan(self, coordinates, dates=None, skip=None):
+        """
+        plan的惰性版本，coordinates可以是边读边产出的迭代器
+        :param dates:可选的回调dates(bbox)->日期字符串列表(如imagery_dates.DateResolver)，
+                     每个日期生成一个区域任务，输出名为historical_img_N_yyyyMMdd；为None时只下载self.date
+        :param skip:可选的回调skip(区域序号, 日期)，返回True的区域任务不再规划(如任务队列中已完成的区域)，
+                    其余区域保持原来的序号
+        """
+        if self.names is None:
+            self.names = OutputNameAllocator(self.output_path)
+        if self.dedup and self.claims is None:
+            self.claims = TileClaimIndex(self.chunk_tiles)
+        occurrences = {}
+        for i, coords in enumerate(coordinates, start=1):
+            bbox = ring_bbox(coords)
+            ring = coords if self.footprint else None
+            if dates is None:
+                if skip is None or not skip(i, self.date):
+                    yield self.plan_region(i, bbox, self.date, occurrences, ring=ring)
+                continue
+
+            try:
+                region_dates = dates(bbox)
+            except Exception as e:
+                yield RegionTask(i, bbox, None, error=f"Failed to resolve imagery dates for region {i}: {e}")
+                continue
+            if not region_dates:
+                yield RegionTask(i, bbox, None, error=f"No imagery available for region {i} on the requested dates")
+                continue
+            base_name = []  # 同一区域的各期影像共用一个序号，首次需要时分配
+            for date in region_dates:
+                if skip is None or not skip(i, date):
+                    yield self.plan_region(i, bbox, date, occurrences, base_name, ring=ring)
+
+    def plan_chunks(self, bbox, ring=None):
+        """
+        区域的分块列表；给出ring时只保留与多边形相交的分块
+        分块需要GDAL拼接，没有GDAL或区域不超过一个分块的瓦片数时整个区域作为一个下载任务；
+        去重时分块须与全局网格对齐，总是切分
+        :return:(分块列表, 是否按多边形切分)
+        """
+        has_ring = ring is not None and len(ring) >= 3
+        if self.claims is None:
+            full = self.grid.tile_range(bbox, self.zoom_level)
+            if not self.can_merge or full.count <= self.chunk_tiles ** 2:
+                # 单个任务不需要拼接；有GDAL时仍按多边形裁剪输出
+                return [(full, bbox)], has_ring and self.can_merge
+        if has_ring:
+            chunks = list(FootprintCover(np.asarray(ring), bbox, self.grid, self.zoom_level)
+                          .iter_chunks(self.chunk_tiles))
+            if chunks:
+                return chunks, True
+        return list(self.grid.iter_chunks(bbox, self.zoom_level, self.chunk_tiles)), False
+
+    def claim_chunks(self, chunks, date):
+        """
+        在重叠索引中认领区域的分块，已被前面区域认领的瓦片不再下载
+        认领的范围是完整的瓦片，分块范围不再与区域求交，后面的区域才能直接使用
+        :return:(引用的其他区域的分块列表, 本区域需要下载的(TileRange, 范围)列表)
+        """
+        shared = []
+        own = []
+        for tile_range, _ in chunks:
+            owners, pieces = self.claims.claim(date, tile_range)
+            shared.extend(chunk for chunk in owners if chunk not in shared)
+            own.extend((piece, self.grid.range_bounds(piece)) for piece in pieces)
+        return shared, own
+
+    def plan_region(self, index, bbox, date, occurrences, series_name=None, ring=None):
+        """
+        为一个区域和日期切分分块、分配输出文件名
+        :param series_name:时间序列模式下保存区域序号名的列表，为None表示单日期
+        :param ring:区域的WGS84坐标环，只下载与其相交的分块
+        """
+        chunks, footprint = self.plan_chunks(bbox, ring)
+        with self._claims_lock:
+            return self._plan_region(index, bbox, date, occurrences, series_name, ring, chunks, footprint)
+
+    def _plan_region(self, index, bbox, date, occurrences, series_name, ring, chunks, footprint):
+        shared = []
+        if self.claims is not None:
+            shared, chunks = self.claim_chunks(chunks, date)
+        # 去重时所有区域都由分块拼接并裁回自己的范围
+        merged = len(chunks) > 1 or self.claims is not None
+
+        # 多分块区域先查找未完成的下载清单，找到时沿用原来的输出文件名
+        manifest = None
+        signature = None
+        if merged:
+            occurrence = occurrences.get((bbox, date), 0)
+            occurrences[(bbox, date)] = occurrence + 1
+            signature = region_signature(bbox, self.zoom_level, date, self.provider, occurrence, footprint,
+                                         self.claims is not None)
+            manifest = JobManifest.load(self.output_path, signature)
+
+        reserved_name = None
+        if manifest is not None:
+            output_filename = os.path.splitext(manifest.output_file)[0]
+            print(f"Resuming region {index} from manifest {manifest.path}")
+        elif series_name is None:
+            # 生成唯一的输出文件名
+            output_filename = reserved_name = self.names.allocate()
+        else:
+            if series_name:
+                self.names.retain(series_name[0])
+            else:
+                series_name.append(self.names.allocate())
+            reserved_name = series_name[0]
+            output_filename = f"{reserved_name}_{date.replace('-', '')}"
+
+        region = RegionTask(index, bbox, os.path.join(self.output_path, f"{output_filename}.tif"),
+                            reserved_name=reserved_name, date=date, series=series_name is not None)
+        if footprint:
+            region.footprint = np.asarray(ring)
+        if not merged:
+            tile_range, chunk_bbox = chunks[0]
+            region.chunks.append(ChunkTask(region, f"{tile_range.x0}_{tile_range.y0}", tile_range, chunk_bbox,
+                                           region.output_file))
+        else:
+            parts_dir = f"{output_filename}_parts"
+            if chunks:
+                os.makedirs(os.path.join(self.output_path, parts_dir), exist_ok=True)
+            names = {}
+            for tile_range, chunk_bbox in chunks:
+                key = f"{tile_range.x0}_{tile_range.y0}"
+                if self.claims is not None:
+                    # 去重后同一个分块格中可能有多个矩形
+                    key += f"_{tile_range.x1}_{tile_range.y1}"
+                names[key] = os.path.join(parts_dir, f"chunk_{key}.tif")
+                region.chunks.append(ChunkTask(region, key, tile_range, chunk_bbox,
+                                               os.path.join(self.output_path, names[key])))
+            if manifest is None or set(manifest.chunk_keys()) != set(names):
+                # 跳过了已完成的区域时，去重后的分块划分可能与清单不同，沿用文件名重新记录
+                manifest = JobManifest.create(self.output_path, signature, f"{output_filename}.tif", names)
+            region.manifest = manifest
+            for chunk in region.chunks:
+                chunk.done = manifest.is_done(chunk.key)
+        if self.claims is not None:
+            for chunk in region.chunks:
+                self.claims.add(date, chunk.tile_range, chunk)
+        region.chunks.extend(shared)
+        for chunk in region.chunks:
+            with chunk.lock:
+                chunk.references += 1
+        return region
+
+    def plan_patch(self, index, bbox, cells, base_file=None):
+        """
+        变化检测的区域任务：只下载变化的单元，每个单元使用自己的最新影像日期
+        :param cells:[(TileRange, 范围, 日期)]
+        :param base_file:已有的拼接结果，下载的单元拼接后覆盖在它上面；为None时分配新的输出名
+        """
+        if self.names is None:
+            self.names = OutputNameAllocator(self.output_path)
+        reserved_name = None
+        if base_file is None:
+            output_filename = reserved_name = self.names.allocate()
+            output_file = os.path.join(self.output_path, f"{output_filename}.tif")
+        else:
+            output_filename = os.path.splitext(os.path.basename(base_file))[0]
+            output_file = base_file
+        region = RegionTask(index, bbox, output_file, reserved_name=reserved_name,
+                            date=max(date for _, _, date in cells))
+        region.base_file = base_file
+        if base_file is None and len(cells) == 1:
+            tile_range, cell_bbox, date = cells[0]
+            region.chunks.append(ChunkTask(region, f"{tile_range.x0}_{tile_range.y0}", tile_range, cell_bbox,
+                                           output_file, date=date))
+        else:
+            parts_dir = os.path.join(self.output_path, f"{output_filename}_parts")
+            os.makedirs(parts_dir, exist_ok=True)
+            for tile_range, cell_bbox, date in cells:
+                key = f"{tile_range.x0}_{tile_range.y0}"
+                region.chunks.append(ChunkTask(region, key, tile_range, cell_bbox,
+                                               os.path.join(parts_dir, f"chunk_{key}.tif"), date=date))
+        for chunk in region.chunks:
+            with chunk.lock:
+                chunk.references += 1
+        return region
+
+    def build_command(self, task):
+        return exe_command(self.exe_path) + [
+            "download",
+            "--lower-left", task.lower_left,
+            "--upper-right", task.upper_right,
+            "--zoom", str(self.zoom_level),
+            "--date", task.imagery_date,
+            "--provider", self.provider,
+            "--output", task.output_file
+        ]
+
+    def span_fields(self, chunk):
+        """分块耗时区间的公共字段"""
+        return {"region": chunk.region.index, "chunk": chunk.key, "zoom": self.zoom_level,
+                "tiles": chunk.tile_range.count, "bbox_area_km2": round(bbox_area_km2(chunk.bbox), 6), "retries": 0}
+
+    def run_chunk(self, chunk):
+        """在工作线程中执行单个分块的下载，缓存命中时跳过子进程"""
+        result = None
+        if self.cancelled:
+            result = RegionResult(chunk, error=f"Download cancelled for {chunk.label}", failure_kind=CANCELLED)
+        elif self.cache is not None:
+            with self.metrics.span("cache", **self.span_fields(chunk)) as span:
+                try:
+                    if self.cache.fetch(chunk.bbox, self.zoom_level, chunk.imagery_date, self.provider,
+                                        chunk.output_file):
+                        print(f"{chunk.label} served from cache")
+                        result = RegionResult(chunk, 0, cached=True)
+                except Exception as e:
+                    print(f"Cache lookup failed for {chunk.label}: {e}")
+                span["ok"] = result is not None
+                span["bytes"] = self.output_size(chunk) if result is not None else 0
+
+        if result is None:
+            result = self.download_with_retry(chunk)
+            if result.ok and self.cache is not None and os.path.exists(chunk.output_file):
+                try:
+                    self.cache.store(chunk.bbox, self.zoom_level, chunk.imagery_date, self.provider,
+                                     chunk.output_file)
+                except Exception as e:
+                    print(f"Failed to cache {chunk.label}: {e}")
+
+        region = chunk.region
+        if result.ok and region.manifest is not None:
+            region.manifest.mark_done(chunk.key)
+        if self.stats is not None:
+            self.stats.finish(chunk, result.ok, self.output_size(chunk) if result.ok else 0)
+            self.report_progress()
+        with chunk.lock:
+            chunk.result = result
+            consumers = list(chunk.consumers)
+        for consumer in consumers:
+            self.chunk_finished(consumer, result)
+        return result
+
+    def chunk_finished(self, region, result=None):
+        """
+        区域需要的一个分块已结束，由完成最后一个分块的线程拼接，不阻塞其他区域的回调
+        :param result:分块的结果，续传时已完成的分块为None
+        """
+        with region.lock:
+            if result is not None:
+                region.chunk_results.append(result)
+                region.failed = region.failed or not result.ok
+            region.remaining -= 1
+            last = region.remaining == 0
+        if last:
+            self.region_finished(region)
+
+    def region_finished(self, region):
+        if not region.failed:
+            self.merge_region(region)
+        self.release_chunks(region)
+        self._completed.append(region)
+
+    def download_with_retry(self, chunk):
+        """
+        下载一个分块，临时性失败按重试策略退避后重试，每次超时后放宽下一次的超时时间
+        """
+        attempt = 0
+        timeouts = 0
+        while True:
+            attempt += 1
+            timeout = self.retry.timeout_for(chunk.tile_range.count, self.timeout, timeouts)
+            fields = self.span_fields(chunk)
+            fields["retries"] = attempt - 1
+            permit = None
+            if self.governor is not None:
+                # 等待并发名额和限速预算，重试时重新排队
+                permit = self.governor.acquire(chunk.tile_range.count, self._cancel_event)
+                if permit is None:
+                    return RegionResult(chunk, error=f"Download cancelled for {chunk.label}", failure_kind=CANCELLED)
+                if permit.waited > 0.01:
+                    self.metrics.record("throttle", permit.waited, **fields)
+            with self.metrics.span("download", **fields) as span:
+                result = self.run_command(chunk, timeout)
+                span["ok"] = result.ok
+                span["bytes"] = self.output_size(chunk) if result.ok else 0
+            if permit is not None:
+                self.governor.release(permit, result.failure_kind, span["bytes"])
+            result.attempts = attempt
+            if result.ok or self.cancelled or not self.retry.should_retry(result.failure_kind, attempt):
+                return result
+            if result.timed_out:
+                timeouts += 1
+            delay = self.retry.delay(attempt)
+            print(f"{result.error} ({result.failure_kind}), retrying in {delay:.1f}s "
+                  f"[attempt {attempt + 1}/{self.retry.max_attempts}]")
+            if self._cancel_event.wait(delay):
+                return result
+
+    @staticmethod
+    def output_size(chunk):
+        try:
+            return os.path.getsize(chunk.output_file)
+        except OSError:
+            return 0
+
+    def merge_region(self, region):
+        """
+        把多分块区域的分块拼接成一个COG，按多边形下载的区域同时裁剪到多边形
+        失败时保留分块和清单以便重试
+        """
+        if not region.needs_merge:
+            if region.footprint is None:
+                return
+            if load_gdal() is None:
+                # 单分块区域不需要拼接，没有GDAL时保留未裁剪的输出
+                print(f"GDAL not available, {region.label} is not clipped to its polygon")
+                return
+        with self.metrics.span("write", region=region.index, zoom=self.zoom_level,
+                               bbox_area_km2=round(bbox_area_km2(region.bbox), 6)) as span:
+            try:
+                print(f"Merging {len(region.chunks)} chunks into {region.output_file}")
+                sources = [chunk.output_file for chunk in region.chunks]
+                if region.base_file is not None:
+                    # VRT中后面的文件覆盖前面的，变化的分块覆盖已有拼接结果中的旧影像
+                    sources.insert(0, region.base_file)
+                # 去重时分块是完整的瓦片，可能来自其他区域，需要裁回本区域的范围
+                build_cog(sources, region.output_file,
+                          cutline=region.footprint, bounds=region.bbox if self.claims is not None else None)
+            except Exception as e:
+                region.merge_error = str(e)
+                span["ok"] = False
+                return
+            span["ok"] = True
+            span["bytes"] = os.path.getsize(region.output_file)
+
+    def release_chunks(self, region):
+        """
+        区域成功拼接后释放对分块文件的引用，某个区域的分块都不再被引用时删除它的分块目录
+        下载或拼接失败的区域不释放引用：它自己的分块和引用的其他区域的分块都保留，以便续传和重新拼接
+        """
+        if self.keep_parts or region.failed or region.merge_error is not None:
+            return
+        released = []
+        with self._claims_lock:
+            owners = []
+            for chunk in region.chunks:
+                with chunk.lock:
+                    chunk.references -= 1
+                if chunk.output_file != chunk.region.output_file and chunk.region not in owners:
+                    owners.append(chunk.region)
+            for owner in owners:
+                own = owner.own_chunks
+                # 失败的区域没有释放自己分块的引用，这里不会删除
+                if own and all(chunk.references <= 0 for chunk in own):
+                    if self.claims is not None:
+                        # 撤销认领，后面规划的区域自己下载这些瓦片，不会引用已删除的文件
+                        for chunk in own:
+                            self.claims.remove(owner.date, chunk.tile_range, chunk)
+                    released.append(os.path.dirname(own[0].output_file))
+        for parts_dir in released:
+            shutil.rmtree(parts_dir, ignore_errors=True)
+
+    def run_command(self, task, timeout=None):
+        """
+        通过异步引擎执行单个分块的GEHistoricalImagery下载命令，实时解析输出中的进度
+        :param timeout:超时时间(秒)，默认为self.timeout
+        """
+        from async_engine import AsyncProcessEngine, parse_progress  # asyncio只在下载时导入，不拖慢界面启动
+
+        cmd = self.build_command(task)
+        print(f"Executing: {' '.join(cmd)}")
+        print(f"Working directory: {self.output_path}")
+
+        def on_line(stream, line):
+            fraction = parse_progress(line)
+            if fraction is not None and self.stats is not None and self.stats.update(task, fraction):
+                self.report_progress()
+
+        engine = self.engine or AsyncProcessEngine()
+        try:
+            result = engine.run(cmd, cwd=self.output_path, timeout=timeout or self.timeout, on_line=on_line)
+        finally:
+            if engine is not self.engine:
+                engine.close()
+        self.metrics.record("spawn", result.spawn_seconds, **self.span_fields(task))
+
+        region_result = RegionResult(task, result.returncode, result.stdout, result.stderr)
+        region_result.timed_out = result.timed_out
+        if result.error is not None:
+            # 可执行文件不存在或无法启动，重试没有意义
+            region_result.error = f"Failed to execute download for {task.label}: {result.error}"
+            region_result.failure_kind = PERMANENT
+        elif result.timed_out:
+            region_result.error = f"Download timeout for {task.label}"
+            region_result.failure_kind = TRANSIENT
+        elif result.cancelled:
+            region_result.error = f"Download cancelled for {task.label}"
+            region_result.failure_kind = CANCELLED
+        elif result.returncode != 0:
+            region_result.error = f"Download failed for {task.label}: {result.stderr}"
+            region_result.failure_kind = classify_output(result.stderr + "\n" + result.stdout)
+        return region_result
+
+    def report_progress(self):
+        if self.on_progress is not None and self.stats is not None:
+            self.on_progress(self.stats.snapshot())
+
+    def cancel(self):
+        """取消下载：终止正在运行的子进程，尚未开始的分块直接标记为取消"""
+        self.cancelled = True
+        self._cancel_event.set()
+        engine = self.engine
+        if engine is not None:
+            engine.cancel_all()
+
+    def finish_region(self, region, chunk_results):
+        """汇总区域内各分块的结果"""
+        failed = [r for r in chunk_results if not r.ok]
+        if failed:
+            kinds = {r.failure_kind for r in failed}
+            kind = PERMANENT if PERMANENT in kinds else (CANCELLED if CANCELLED in kinds else TRANSIENT)
+            result = RegionResult(region, failed[0].returncode, error="; ".join(r.error for r in failed),
+                                  failure_kind=kind)
+        elif region.merge_error is not None:
+            result = RegionResult(region, 0, error=f"Failed to merge chunks for {region.label}: {region.merge_error}",
+                                  failure_kind=PERMANENT)
+        else:
+            result = RegionResult(region, 0, cached=bool(chunk_results) and all(r.cached for r in chunk_results))
+            if region.manifest is not None:
+                region.manifest.remove()
+        result.stdout = "".join(r.stdout for r in chunk_results if r.stdout)
+        result.stderr = "".join(r.stderr for r in chunk_results if r.stderr)
+        result.chunk_results = chunk_results
+        result.attempts = max([r.attempts for r in chunk_results] or [1])
+        if region.reserved_name is not None:
+            self.names.release(region.reserved_name)
+        return result
+
+    def start_region(self, region, executor, pending):
+        """
+        提交区域中尚未完成的分块；引用的其他区域的分块已结束时直接计入，否则登记为等待者
+        """
+        own = region.own_chunks
+        todo = [chunk for chunk in own if not chunk.done]
+        shared = [chunk for chunk in region.chunks if chunk.region is not region]
+        # 先按上限设置计数，避免登记过程中分块结束导致提前拼接
+        region.remaining = len(todo) + len(shared) + 1
+        self.stats.add_chunks(len(own), len(own) - len(todo))
+        for chunk in todo:
+            chunk.consumers.append(region)
+        for chunk in shared:
+            with chunk.lock:
+                waiting = chunk.result is None and not chunk.done
+                if waiting:
+                    chunk.consumers.append(region)
+            if not waiting:
+                self.chunk_finished(region, chunk.result)
+        for chunk in todo:
+            pending[executor.submit(self.run_chunk, chunk)] = region
+        # 续传时所有分块都已完成的区域在这里拼接
+        self.chunk_finished(region)
+
+    def run(self, tasks, on_result=None, on_progress=None, on_start=None):
+        """
+        并发执行所有区域的分块
+        :param tasks:RegionTask列表或惰性迭代器，迭代器只按需取出，读取和下载可以同时进行
+        :param on_result:回调on_result(result, done, total)，在调用线程中按区域序号依次触发；
+                         tasks为迭代器且尚未取完时total为None
+        :param on_progress:回调on_progress(stats)，stats见TransferStats.snapshot，
+                           在工作线程中按子进程输出实时触发(最多每PROGRESS_INTERVAL秒一次)
+        :param on_start:回调on_start(region)，区域的分块提交执行时在调用线程中触发
+        :return:按区域序号排列的RegionResult列表
+        """
+        total = len(tasks) if hasattr(tasks, "__len__") else None
+        task_iter = iter(tasks)
+        exhausted = False
+        positions = {}  # 已取出的区域 -> 序号
+        self._completed.clear()
+        self.results = []
+        pending = {}
+        finished = {}
+        next_pos = 0
+        self.on_progress = on_progress
+        self.stats = TransferStats()
+        from async_engine import AsyncProcessEngine
+        self.engine = AsyncProcessEngine()
+        if self.governor is not None:
+            self.governor.set_max_concurrency(self.max_workers)
+        if self.cancelled:
+            self.engine.cancel_all()
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                while True:
+                    # 最多保留max_workers*2个已提交的分块，避免一次取空迭代器；取消后不再取新区域
+                    while not exhausted and len(pending) < self.max_workers * 2:
+                        if self.cancelled:
+                            exhausted = True
+                            total = len(positions)
+                            break
+                        try:
+                            region = next(task_iter)
+                        except StopIteration:
+                            exhausted = True
+                            total = len(positions)
+                            break
+                        pos = len(positions)
+                        positions[region] = pos
+                        if region.error is None and region.needs_merge and not self.can_merge:
+                            # 在下载之前失败，不要等分块都下载完才发现无法拼接
+                            region.error = f"GDAL Python bindings are required to merge chunks for {region.label}"
+                        if region.error is not None:
+                            finished[pos] = RegionResult(region, error=region.error, failure_kind=PERMANENT)
+                            continue
+                        if on_start is not None:
+                            on_start(region)
+                        self.start_region(region, executor, pending)
+
+                    if pending:
+                        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            pending.pop(future)
+                            future.result()
+                    while self._completed:
+                        region = self._completed.popleft()
+                        finished[positions[region]] = self.finish_region(region, region.chunk_results)
+                        region.chunk_results = None
+
+                    # 只有前面的区域都结束后才回调，保证顺序确定
+                    while next_pos in finished:
+                        result = finished.pop(next_pos)
+                        self.results.append(result)
+                        next_pos += 1
+                        if on_result is not None:
+                            on_result(result, next_pos, total)
+
+                    if exhausted and not pending:
+                        break
+        finally:
+            self.engine.close()
+            self.engine = None
+        self.report_progress()
+        return self.results
+
+    def merge_results(self, results, output_file=None):
+        """
+        把所有成功区域的输出合并为一个COG，时间序列按影像日期分别合并
+        :param output_file:默认为输出目录下的historical_mosaic_<时间>.tif
+        :return:输出路径列表
+        """
+        if output_file is None:
+            output_file = os.path.join(self.output_path, f"historical_mosaic_{time.strftime('%Y%m%d_%H%M%S')}.tif")
+        groups = {}
+        for r in results:
+            if r.ok:
+                groups.setdefault(r.task.date if r.task.series else None, []).append(r.task.output_file)
+        outputs = []
+        for date, sources in sorted(groups.items(), key=lambda item: item[0] or ""):
+            target = output_file
+            if date is not None:
+                target = f"{os.path.splitext(output_file)[0]}_{date.replace('-', '')}.tif"
+            with self.metrics.span("write", region="mosaic") as span:
+                outputs.append(build_cog(sources, target))
+                span["bytes"] = os.path.getsize(target)
+                span["ok"] = True
+        return outputs
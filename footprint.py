@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+多边形瓦片覆盖 - 把多边形栅格化到数据源的瓦片网格上，只下载与多边形相交的瓦片所在的分块
+L形、斜向的河道等不规则区域不再下载整个外接矩形；下载后再用多边形裁掉范围外的像素
+覆盖结果用每行的瓦片区间表示，不需要为整个外接矩形分配栅格，高缩放级别的大区域也不会占用大量内存
+"""
+
+import json
+import math
+
+import numpy as np
+
+from tile_grid import TileRange, DEFAULT_CHUNK_TILES
+
+
+def ring_tile_coords(ring, grid, zoom):
+    """
+    :param ring:Nx2的WGS84坐标环
+    :return:(fx, fy)，顶点在瓦片网格中的小数坐标
+    """
+    coords = np.array([grid.fractional_tile(lng, lat, zoom) for lng, lat in np.asarray(ring)[:, :2]],
+                      dtype=np.float64)
+    return coords[:, 0], coords[:, 1]
+
+
+def _edge_intervals(fx, fy):
+    """多边形边经过的瓦片，产出(行, 起始列, 结束列)数组"""
+    rows, starts, ends = [], [], []
+    for xa, ya, xb, yb in zip(fx[:-1], fy[:-1], fx[1:], fy[1:]):
+        ymin, ymax = min(ya, yb), max(ya, yb)
+        r0 = math.floor(ymin)
+        r1 = max(r0, math.ceil(ymax) - 1)
+        r = np.arange(r0, r1 + 1, dtype=np.int64)
+        if ya == yb:
+            x_lo = np.full(len(r), min(xa, xb))
+            x_hi = np.full(len(r), max(xa, xb))
+        else:
+            # 边在每个行带[r, r+1]内的部分
+            y_lo = np.maximum(r, ymin)
+            y_hi = np.minimum(r + 1, ymax)
+            xs_lo = xa + (y_lo - ya) * (xb - xa) / (yb - ya)
+            xs_hi = xa + (y_hi - ya) * (xb - xa) / (yb - ya)
+            x_lo = np.minimum(xs_lo, xs_hi)
+            x_hi = np.maximum(xs_lo, xs_hi)
+        c0 = np.floor(x_lo).astype(np.int64)
+        rows.append(r)
+        starts.append(c0)
+        ends.append(np.maximum(c0, np.ceil(x_hi).astype(np.int64) - 1))
+    return rows, starts, ends
+
+
+def _interior_intervals(fx, fy):
+    """中心点在多边形内部的瓦片(按行中心扫描线奇偶填充)"""
+    rows, xs = [], []
+    for xa, ya, xb, yb in zip(fx[:-1], fy[:-1], fx[1:], fy[1:]):
+        if ya == yb:
+            continue
+        ymin, ymax = min(ya, yb), max(ya, yb)
+        # 行中心r+0.5落在[ymin, ymax)内的行
+        r = np.arange(math.ceil(ymin - 0.5), math.ceil(ymax - 0.5), dtype=np.int64)
+        if len(r) == 0:
+            continue
+        rows.append(r)
+        xs.append(xa + (r + 0.5 - ya) * (xb - xa) / (yb - ya))
+    if not rows:
+        return [], [], []
+    rows = np.concatenate(rows)
+    xs = np.concatenate(xs)
+    order = np.lexsort((xs, rows))
+    rows, xs = rows[order], xs[order]
+    # 闭合环每行的交点数为偶数，相邻两个交点之间是内部
+    left, right = xs[0::2], xs[1::2]
+    row = rows[0::2]
+    c0 = np.ceil(left - 0.5).astype(np.int64)
+    c1 = np.floor(right - 0.5).astype(np.int64)
+    keep = c1 >= c0
+    return [row[keep]], [c0[keep]], [c1[keep]]
+
+
+def cover_intervals(fx, fy):
+    """
+    与多边形相交的瓦片，合并为每行互不重叠的区间
+    :return:(行, 起始列, 结束列)的列表，按行和列排序，列为闭区间
+    """
+    if len(fx) < 3:
+        return []
+    if fx[0] != fx[-1] or fy[0] != fy[-1]:
+        fx = np.append(fx, fx[0])
+        fy = np.append(fy, fy[0])
+    rows, starts, ends = _edge_intervals(fx, fy)
+    i_rows, i_starts, i_ends = _interior_intervals(fx, fy)
+    rows = np.concatenate(rows + i_rows)
+    starts = np.concatenate(starts + i_starts)
+    ends = np.concatenate(ends + i_ends)
+
+    order = np.lexsort((starts, rows))
+    merged = []
+    for r, c0, c1 in zip(rows[order].tolist(), starts[order].tolist(), ends[order].tolist()):
+        if merged and merged[-1][0] == r and c0 <= merged[-1][2] + 1:
+            if c1 > merged[-1][2]:
+                merged[-1][2] = c1
+        else:
+            merged.append([r, c0, c1])
+    return [tuple(m) for m in merged]
+
+
+class FootprintCover:
+    """
+    多边形在某一缩放级别下的瓦片覆盖
+    :param bbox:多边形的外接矩形(west, south, east, north)
+    """
+
+    def __init__(self, ring, bbox, grid, zoom):
+        self.grid = grid
+        self.zoom = zoom
+        self.bbox = bbox
+        full = grid.tile_range(bbox, zoom)
+        self.intervals = []
+        for r, c0, c1 in cover_intervals(*ring_tile_coords(ring, grid, zoom)):
+            # 限制在外接矩形的瓦片范围内，避免浮点误差多出一行/列
+            if full.y0 <= r <= full.y1:
+                c0, c1 = max(c0, full.x0), min(c1, full.x1)
+                if c0 <= c1:
+                    self.intervals.append((r, c0, c1))
+
+    @property
+    def tile_count(self):
+        return sum(c1 - c0 + 1 for _, c0, c1 in self.intervals)
+
+    def iter_chunks(self, chunk_tiles=DEFAULT_CHUNK_TILES):
+        """
+        与TileGrid.iter_chunks相同的全局对齐分块，但跳过与多边形不相交的分块，
+        并把每个分块收缩到其中被覆盖瓦片的外接范围
+        :return:产出(TileRange, 与bbox求交后的分块范围)
+        """
+        bounds = {}  # (cx, cy) -> [x0, y0, x1, y1]
+        for r, c0, c1 in self.intervals:
+            cy = r // chunk_tiles
+            for cx in range(c0 // chunk_tiles, c1 // chunk_tiles + 1):
+                x0 = max(c0, cx * chunk_tiles)
+                x1 = min(c1, (cx + 1) * chunk_tiles - 1)
+                b = bounds.get((cx, cy))
+                if b is None:
+                    bounds[(cx, cy)] = [x0, r, x1, r]
+                else:
+                    b[0], b[1], b[2], b[3] = min(b[0], x0), min(b[1], r), max(b[2], x1), max(b[3], r)
+        west, south, east, north = self.bbox
+        for cx, cy in sorted(bounds, key=lambda k: (k[1], k[0])):
+            x0, y0, x1, y1 = bounds[(cx, cy)]
+            chunk = TileRange(self.zoom, x0, y0, x1, y1)
+            c_west, c_south, c_east, c_north = self.grid.range_bounds(chunk)
+            yield chunk, (max(west, c_west), max(south, c_south), min(east, c_east), min(north, c_north))
+
+
+def footprint_geojson(ring):
+    """把WGS84坐标环写成GeoJSON字符串，作为GDAL的裁剪多边形"""
+    coords = np.asarray(ring)[:, :2].tolist()
+    if coords and coords[0] != coords[-1]:
+        coords.append(coords[0])
+    return json.dumps({"type": "FeatureCollection", "features": [
+        {"type": "Feature", "properties": {}, "geometry": {"type": "Polygon", "coordinates": [coords]}}]})
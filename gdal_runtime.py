@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+GDAL运行环境 - 使用随程序分发的gdal目录(DLL、GDAL_DATA、PROJ数据)加载osgeo.gdal
+osgeo为可选依赖，不可用时load_gdal返回None，调用方自行降级
+"""
+
+import os
+import threading
+
+GDAL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "gdal")
+
+_lock = threading.Lock()
+_gdal = None
+_loaded = False
+
+
+def configure_environment(gdal_dir=GDAL_DIR):
+    """把随程序分发的gdal目录加入DLL搜索路径，并设置GDAL_DATA和PROJ_LIB"""
+    if not os.path.isdir(gdal_dir):
+        return
+    bin_dir = os.path.join(gdal_dir, "x64")
+    if os.path.isdir(bin_dir):
+        os.environ["PATH"] = bin_dir + os.pathsep + os.environ.get("PATH", "")
+        if hasattr(os, "add_dll_directory"):
+            os.add_dll_directory(bin_dir)
+    os.environ.setdefault("GDAL_DATA", os.path.join(gdal_dir, "data"))
+    os.environ.setdefault("PROJ_LIB", os.path.join(gdal_dir, "share"))
+
+
+def load_gdal():
+    """
+    导入osgeo.gdal
+    :return:gdal模块，未安装GDAL的Python绑定时返回None
+    """
+    global _gdal, _loaded
+    with _lock:
+        if not _loaded:
+            _loaded = True
+            configure_environment()
+            try:
+                from osgeo import gdal
+                gdal.UseExceptions()
+                _gdal = gdal
+            except ImportError as e:
+                print(f"GDAL Python bindings not available: {e}")
+        return _gdal
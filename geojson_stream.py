@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+GeoJSON流式读取 - 逐个feature解析FeatureCollection，峰值内存只与最大的单个feature有关
+每个多边形环以Nx2的numpy数组产出，适合数百MB的行政区划边界文件
+"""
+
+import json
+import re
+
+import numpy as np
+
+CHUNK_SIZE = 1 << 20  # 每次读取1M字符
+
+_OUTSIDE_STRING = re.compile(r'[{}\[\]"]')
+_INSIDE_STRING = re.compile(r'["\\]')
+_PRIMITIVE = re.compile(r'[^,}\]\s]+')
+_WHITESPACE = re.compile(r'\s*')
+_DECODER = json.JSONDecoder()
+
+
+class _StreamReader:
+    """在文本流上维护一个缓冲区，每次读入新内容时丢弃已经消费的部分"""
+
+    def __init__(self, f, chunk_size):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def read_more(self, size=None):
+        if self.eof:
+            return False
+        data = self.f.read(size or self.chunk_size)
+        if not data:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + data
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """跳过空白，返回下一个字符，到达文件末尾时返回空字符串"""
+        while True:
+            self.pos = _WHITESPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.read_more():
+                return ""
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f"Invalid GeoJSON: expected '{char}' at offset {self.pos}")
+        self.pos += 1
+
+    def container_end(self):
+        """从当前位置的'{'或'['开始，找到与之匹配的结束位置"""
+        depth = 0
+        in_string = False
+        i = self.pos
+        read_size = self.chunk_size
+        while True:
+            pattern = _INSIDE_STRING if in_string else _OUTSIDE_STRING
+            m = pattern.search(self.buf, i)
+            if m is None or (in_string and m.group() == "\\" and m.end() >= len(self.buf)):
+                # 当前缓冲区扫描完毕(或转义符落在末尾)，读入更多内容，单个大feature时读取量翻倍
+                offset = (len(self.buf) if m is None else m.start()) - self.pos
+                if not self.read_more(read_size):
+                    raise ValueError("Invalid GeoJSON: unexpected end of file")
+                read_size *= 2
+                i = self.pos + offset
+                continue
+            char = m.group()
+            i = m.end()
+            if in_string:
+                if char == "\\":
+                    i += 1
+                else:
+                    in_string = False
+            elif char == '"':
+                in_string = True
+            elif char in "{[":
+                depth += 1
+            else:
+                depth -= 1
+                if depth == 0:
+                    return i
+
+    def read_string(self):
+        while True:
+            try:
+                value, end = json.decoder.scanstring(self.buf, self.pos + 1)
+            except json.JSONDecodeError:
+                if not self.read_more():
+                    raise
+                continue
+            self.pos = end
+            return value
+
+    def skip_value(self):
+        char = self.peek()
+        if char in "{[":
+            self.pos = self.container_end()
+        elif char == '"':
+            self.read_string()
+        else:
+            while True:
+                m = _PRIMITIVE.match(self.buf, self.pos)
+                if m is None or m.end() < len(self.buf) or not self.read_more():
+                    break
+            if m is None:
+                raise ValueError(f"Invalid GeoJSON: unexpected value at offset {self.pos}")
+            self.pos = m.end()
+
+    def read_value(self):
+        """
+        解析当前位置的一个对象或数组
+        缓冲区内容不完整时读入更多内容重试，单个大feature时读取量翻倍，总解析量与feature大小成线性关系
+        """
+        read_size = self.chunk_size
+        while True:
+            try:
+                value, end = _DECODER.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError as e:
+                # 出错位置在缓冲区末尾附近或字符串未结束时，认为是内容被截断
+                truncated = e.pos >= len(self.buf) - 8 or e.msg.startswith("Unterminated string")
+                if not truncated or not self.read_more(read_size):
+                    raise ValueError(f"Invalid GeoJSON: {e}") from e
+                read_size *= 2
+                continue
+            self.pos = end
+            return value
+
+
+def _find_features(reader):
+    """定位顶层对象的"features"数组，找到返回True"""
+    reader.expect("{")
+    while True:
+        char = reader.peek()
+        if char == "}" or char == "":
+            return False
+        if char == ",":
+            reader.pos += 1
+            continue
+        if char != '"':
+            raise ValueError(f"Invalid GeoJSON: expected key at offset {reader.pos}")
+        key = reader.read_string()
+        reader.expect(":")
+        if key == "features" and reader.peek() == "[":
+            reader.pos += 1
+            return True
+        reader.skip_value()
+
+
+def iter_features(jsonfile, chunk_size=CHUNK_SIZE):
+    """
+    逐个产出GeoJSON文件中的feature
+    FeatureCollection按流式解析；单个Feature或Geometry文件直接整体读取
+    :param jsonfile:GeoJSON文件路径
+    :param chunk_size:每次读取的字符数
+    """
+    with open(jsonfile, 'r', encoding='utf-8') as f:
+        reader = _StreamReader(f, chunk_size)
+        if reader.peek() == "{" and _find_features(reader):
+            while True:
+                char = reader.peek()
+                if char == ",":
+                    reader.pos += 1
+                    continue
+                if char == "]":
+                    return
+                if char != "{":
+                    raise ValueError(f"Invalid GeoJSON: expected feature at offset {reader.pos}")
+                yield reader.read_value()
+
+    # 不是FeatureCollection，整体读取
+    with open(jsonfile, 'r', encoding='utf-8') as f:
+        json_data = json.load(f)
+    if not isinstance(json_data, dict):
+        raise ValueError(f"Invalid GeoJSON: expected an object at the top level, got {type(json_data).__name__}")
+    if json_data.get("type") == "Feature":
+        yield json_data
+    elif json_data.get("type") in ("Polygon", "MultiPolygon"):
+        yield {"type": "Feature", "geometry": json_data}
+
+
+def _ring_array(ring):
+    try:
+        ring = np.asarray(ring, dtype=np.float64)
+    except (TypeError, ValueError):
+        raise ValueError("Invalid GeoJSON: polygon ring is not a list of coordinate pairs")
+    if ring.ndim != 2 or len(ring) == 0:
+        return None
+    if ring.shape[1] < 2:
+        raise ValueError("Invalid GeoJSON: polygon ring is not a list of coordinate pairs")
+    return np.ascontiguousarray(ring[:, :2])
+
+
+def _list(value, what):
+    if not isinstance(value, list):
+        raise ValueError(f"Invalid GeoJSON: {what} must be a list, got {type(value).__name__}")
+    return value
+
+
+def geometry_rings(geometry):
+    """
+    产出Polygon/MultiPolygon中的每个环，geometry为null时不产出
+    :return:Nx2的float64数组，丢弃高程
+    """
+    geometry = geometry or {}
+    if not isinstance(geometry, dict):
+        raise ValueError(f"Invalid GeoJSON: geometry must be an object, got {type(geometry).__name__}")
+    coords = geometry.get("coordinates", [])
+
+    # Handle Polygon
+    if geometry.get("type") == "Polygon":
+        for polygon in _list(coords, "Polygon coordinates"):
+            ring = _ring_array(polygon)
+            if ring is not None:
+                yield ring
+
+    # Handle MultiPolygon
+    elif geometry.get("type") == "MultiPolygon":
+        for multi_polygon in _list(coords, "MultiPolygon coordinates"):
+            for polygon in _list(multi_polygon, "MultiPolygon part"):
+                ring = _ring_array(polygon)
+                if ring is not None:
+                    yield ring
+
+
+def iter_rings(jsonfile, chunk_size=CHUNK_SIZE):
+    """逐个产出GeoJSON文件中所有多边形的环"""
+    for feature in iter_features(jsonfile, chunk_size):
+        if not isinstance(feature, dict):
+            raise ValueError(f"Invalid GeoJSON: feature must be an object, got {type(feature).__name__}")
+        yield from geometry_rings(feature.get("geometry"))
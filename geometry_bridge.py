@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+绘制几何桥接 - 通过QWebChannel把地图上的绘制、编辑、删除事件直接推送到Python
+不再需要先导出GeoJSON文件、选择目录、再由Worker读取解析；每次事件只传递变化的那个图形，
+坐标转换也按图形增量进行，点击"开始下载"时区域已经准备好
+"""
+
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from PyQt5.QtCore import QObject, QFile, QIODevice, pyqtSignal, pyqtSlot
+
+from coord_convert import rings_gcj02_to_wgs84
+
+QWEBCHANNEL_JS = ":/qtwebchannel/qwebchannel.js"
+
+
+def qwebchannel_script():
+    """
+    读取Qt自带的qwebchannel.js，内联到页面中，避免setHtml的页面加载qrc资源受限
+    :return:脚本内容，读取失败时为空字符串
+    """
+    f = QFile(QWEBCHANNEL_JS)
+    if not f.open(QIODevice.ReadOnly):
+        print(f"Failed to load {QWEBCHANNEL_JS}, drawn shapes must be exported as GeoJSON")
+        return ""
+    try:
+        return bytes(f.readAll()).decode("utf-8")
+    finally:
+        f.close()
+
+
+class GeometryBridge(QObject):
+    """
+    注册到QWebChannel的对象，页面中的脚本见map_page.BRIDGE_HTML
+    图形以Leaflet图层id为键，按绘制顺序保存地图坐标(GCJ02)的坐标环
+    图形只在GUI线程中修改；坐标转换可以在后台线程中对snapshot进行，转换结果的缓存用锁保护
+    """
+    shapes_changed = pyqtSignal(int)  # 图形增加、修改或删除后发出，参数为当前图形数
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.shapes = OrderedDict()  # 图层id -> Nx2坐标环
+        self._wgs84 = {}  # (图层id, 反算模式) -> WGS84坐标环
+        self._lock = threading.Lock()
+
+    @pyqtSlot(int, 'QVariantList')
+    def shapeCreated(self, layer_id, ring):
+        self._set(layer_id, ring)
+
+    @pyqtSlot(int, 'QVariantList')
+    def shapeEdited(self, layer_id, ring):
+        self._set(layer_id, ring)
+
+    @pyqtSlot(int)
+    def shapeDeleted(self, layer_id):
+        with self._lock:
+            removed = self.shapes.pop(layer_id, None)
+            self._forget(layer_id)
+        if removed is not None:
+            self.shapes_changed.emit(len(self.shapes))
+
+    def _set(self, layer_id, ring):
+        try:
+            coords = np.asarray(ring, dtype=np.float64)[:, :2]
+        except (ValueError, IndexError, TypeError) as e:
+            print(f"Ignoring invalid shape {layer_id}: {e}")
+            return
+        if len(coords) < 3:
+            return
+        with self._lock:
+            self.shapes[layer_id] = coords
+            self._forget(layer_id)
+        self.shapes_changed.emit(len(self.shapes))
+
+    def _forget(self, layer_id):
+        for key in [key for key in self._wgs84 if key[0] == layer_id]:
+            del self._wgs84[key]
+
+    def rings(self):
+        """:return:地图坐标(GCJ02)的坐标环列表"""
+        return list(self.shapes.values())
+
+    def snapshot(self):
+        """:return:当前图形的[(图层id, 坐标环)]，之后的绘制和编辑不影响它，可交给后台线程转换"""
+        with self._lock:
+            return list(self.shapes.items())
+
+    def convert(self, snapshot, mode):
+        """
+        把snapshot中的图形转换为WGS84，只转换尚未转换过的图形，可在后台线程中调用
+        :param mode:coord_convert的反算模式
+        :return:WGS84坐标环列表
+        """
+        with self._lock:
+            cached = [self._wgs84.get((layer_id, mode)) for layer_id, _ in snapshot]
+        missing = [i for i, ring in enumerate(cached) if ring is None]
+        if missing:
+            converted = rings_gcj02_to_wgs84([snapshot[i][1] for i in missing], mode)
+            with self._lock:
+                for i, ring in zip(missing, converted):
+                    cached[i] = ring
+                    layer_id, coords = snapshot[i]
+                    # 转换期间图形被编辑或删除时不缓存旧的结果
+                    if self.shapes.get(layer_id) is coords:
+                        self._wgs84[(layer_id, mode)] = ring
+        return cached
+
+    def wgs84_rings(self, mode):
+        """
+        :param mode:coord_convert的反算模式
+        :return:当前所有图形的WGS84坐标环列表
+        """
+        return self.convert(self.snapshot(), mode)
+
+    def clear(self):
+        with self._lock:
+            self.shapes.clear()
+            self._wgs84.clear()
+        self.shapes_changed.emit(0)
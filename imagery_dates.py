@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+影像日期查询 - 通过GEHistoricalImagery查询区域内实际存在的影像日期
+多日期(时间序列)下载时，把解析到同一期影像的请求日期合并，只下载不重复的影像
+"""
+
+import datetime
+import re
+import subprocess
+
+from download_scheduler import EXE_PATH, exe_command
+
+QUERY_TIMEOUT = 120
+_DATE_PATTERN = re.compile(r"(\d{4})[/-](\d{1,2})[/-](\d{1,2})")
+
+
+def parse_date(text):
+    """解析yyyy-MM-dd或yyyy/MM/dd"""
+    m = _DATE_PATTERN.search(text)
+    if m is None:
+        raise ValueError(f"Invalid date: {text}")
+    return datetime.date(int(m.group(1)), int(m.group(2)), int(m.group(3)))
+
+
+def parse_dates(output):
+    """从GEHistoricalImagery的输出中提取所有日期，去重并排序"""
+    dates = set()
+    for m in _DATE_PATTERN.finditer(output):
+        try:
+            dates.add(datetime.date(int(m.group(1)), int(m.group(2)), int(m.group(3))))
+        except ValueError:
+            continue
+    return sorted(dates)
+
+
+def query_available_dates(bbox, zoom, provider="TM", exe_path=EXE_PATH, timeout=QUERY_TIMEOUT):
+    """
+    查询bbox内可用的影像日期
+    先用availability查询整个范围；失败时退回用info查询范围中心点
+    :return:datetime.date的有序列表
+    """
+    west, south, east, north = bbox
+    commands = [
+        ["availability", "--lower-left", f"{south},{west}", "--upper-right", f"{north},{east}",
+         "--zoom", str(zoom), "--provider", provider],
+        ["info", "--location", f"{(south + north) / 2},{(west + east) / 2}",
+         "--zoom", str(zoom), "--provider", provider],
+    ]
+    errors = []
+    for args in commands:
+        cmd = exe_command(exe_path) + args
+        try:
+            # availability在列出日期后会等待输入，关闭stdin让其直接退出
+            result = subprocess.run(cmd, stdin=subprocess.DEVNULL, capture_output=True, text=True,
+                                    encoding='gbk', errors='ignore', timeout=timeout)
+        except subprocess.TimeoutExpired as e:
+            output = e.stdout or ""
+            if isinstance(output, bytes):
+                output = output.decode('gbk', errors='ignore')
+            dates = parse_dates(output)
+            if dates:
+                return dates
+            errors.append(f"{args[0]} timed out")
+            continue
+        except Exception as e:
+            errors.append(f"{args[0]}: {e}")
+            continue
+        dates = parse_dates(result.stdout)
+        if dates:
+            return dates
+        errors.append(f"{args[0]} returned {result.returncode}: {result.stderr.strip()}")
+    raise RuntimeError("; ".join(errors))
+
+
+def resolve_dates(requested, available):
+    """
+    把每个请求日期解析为最接近的可用影像日期(距离相同时取较早的一期)
+    :return:{影像日期: [解析到该影像的请求日期]}，按影像日期排序
+    """
+    resolved = {}
+    if not available:
+        return resolved
+    for date in sorted(set(requested)):
+        capture = min(available, key=lambda d: (abs((d - date).days), d))
+        resolved.setdefault(capture, []).append(date)
+    return dict(sorted(resolved.items()))
+
+
+class DateResolver:
+    """
+    为每个区域给出需要下载的影像日期
+    requested为请求日期列表时解析到最近的影像并去重；date_range为(开始, 结束)时取范围内所有影像
+    """
+
+    def __init__(self, zoom, provider="TM", exe_path=EXE_PATH, requested=None, date_range=None):
+        self.zoom = zoom
+        self.provider = provider
+        self.exe_path = exe_path
+        self.requested = [parse_date(d) if isinstance(d, str) else d for d in (requested or [])]
+        self.date_range = None
+        if date_range is not None:
+            self.date_range = tuple(parse_date(d) if isinstance(d, str) else d for d in date_range)
+
+    def __call__(self, bbox):
+        """
+        :return:yyyy-MM-dd日期字符串列表
+        """
+        try:
+            available = query_available_dates(bbox, self.zoom, self.provider, self.exe_path)
+        except Exception as e:
+            if self.date_range is not None:
+                raise RuntimeError(f"Failed to query imagery dates: {e}")
+            # 查询失败时按请求日期逐个下载，不做去重
+            print(f"Failed to query imagery dates, using requested dates as-is: {e}")
+            return [d.isoformat() for d in sorted(set(self.requested))]
+
+        if self.date_range is not None:
+            start, end = self.date_range
+            captures = [d for d in available if start <= d <= end]
+        else:
+            resolved = resolve_dates(self.requested, available)
+            for capture, dates in resolved.items():
+                if len(dates) > 1:
+                    print(f"Dates {', '.join(d.isoformat() for d in dates)} resolve to capture {capture.isoformat()}")
+            captures = list(resolved)
+        return [d.isoformat() for d in captures]
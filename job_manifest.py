@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+下载清单 - 记录分块下载中每个区域的输出文件和各分块状态
+清单保存在输出目录的.download_jobs下，中断后再次提交相同区域时只补下缺失的分块
+"""
+
+import hashlib
+import json
+import os
+import threading
+
+MANIFEST_DIR = ".download_jobs"
+
+
+def region_signature(bbox, zoom, date, provider, occurrence=0, footprint=False, dedup=False):
+    """
+    区域任务的签名，相同范围和参数的任务签名相同
+    :param occurrence:同一批任务中相同区域出现的次数，用于区分重复绘制的区域
+    :param footprint:是否只下载多边形覆盖的分块，分块划分不同，不能共用清单
+    :param dedup:是否与前面的区域去重，分块划分同样不同
+    """
+    key = [[round(v, 9) for v in bbox], zoom, date, provider, occurrence]
+    if footprint:
+        key.append("footprint")
+    if dedup:
+        key.append("dedup")
+    text = json.dumps(key)
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:16]
+
+
+class JobManifest:
+    """单个区域的下载清单"""
+
+    def __init__(self, path, data):
+        self.path = path
+        self.data = data
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, output_path, signature):
+        """读取未完成的清单，不存在或损坏时返回None"""
+        path = os.path.join(output_path, MANIFEST_DIR, f"{signature}.json")
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return cls(path, json.load(f))
+        except (OSError, ValueError):
+            return None
+
+    @classmethod
+    def create(cls, output_path, signature, output_file, chunks):
+        """
+        :param output_file:区域输出文件名(相对输出目录)
+        :param chunks:{分块键: 分块输出文件名(相对输出目录)}
+        """
+        path = os.path.join(output_path, MANIFEST_DIR, f"{signature}.json")
+        manifest = cls(path, {
+            "signature": signature,
+            "output_file": output_file,
+            "chunks": {key: {"file": name, "done": False} for key, name in chunks.items()},
+        })
+        manifest.save()
+        return manifest
+
+    @property
+    def output_file(self):
+        return self.data["output_file"]
+
+    def chunk_keys(self):
+        return list(self.data["chunks"])
+
+    def chunk_file(self, key):
+        return self.data["chunks"][key]["file"]
+
+    def is_done(self, key):
+        chunk = self.data["chunks"].get(key)
+        if not chunk or not chunk["done"]:
+            return False
+        # 清单标记完成但文件已被删除时重新下载
+        return os.path.exists(os.path.join(os.path.dirname(os.path.dirname(self.path)), chunk["file"]))
+
+    def mark_done(self, key):
+        with self._lock:
+            self.data["chunks"][key]["done"] = True
+            self.save()
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def remove(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
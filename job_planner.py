@@ -0,0 +1,290 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+下载规模预估 - 在启动下载之前按数据源的瓦片网格精确计算每个区域的瓦片范围，
+再根据历史吞吐量估算数据量和耗时；超过上限的任务直接拒绝，避免误操作占满带宽和磁盘
+历史吞吐量和上限保存在用户目录下的planner.json中，可以手动修改
+"""
+
+import json
+import os
+import threading
+
+import numpy as np
+
+from download_scheduler import reorganize_coords
+from footprint import FootprintCover
+from gdal_runtime import load_gdal
+from tile_claims import TileClaimIndex
+from tile_grid import grid_for_provider, DEFAULT_CHUNK_TILES
+
+DEFAULT_SETTINGS_FILE = os.path.join(os.path.expanduser("~"), ".xiaobai_downloader", "planner.json")
+DEFAULT_BYTES_PER_TILE = 20 * 1024  # 没有历史数据时的估计值
+DEFAULT_SECONDS_PER_TILE = 0.1
+DEFAULT_MAX_TILES = 1000000
+DEFAULT_MAX_BYTES = 20 * 1024 ** 3
+HISTORY_WEIGHT = 0.3  # 新一次运行在滑动平均中的权重
+
+
+class JobLimits:
+    """
+    任务规模上限，为None表示不限制
+    :param max_tiles:整个任务的瓦片总数上限
+    :param max_bytes:整个任务的预计数据量上限
+    """
+
+    def __init__(self, max_tiles=DEFAULT_MAX_TILES, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_tiles = max_tiles
+        self.max_bytes = max_bytes
+
+    def to_dict(self):
+        return {"max_tiles": self.max_tiles, "max_bytes": self.max_bytes}
+
+
+class ThroughputHistory:
+    """
+    按缩放级别记录的历史吞吐量(每瓦片字节数和每瓦片耗时的滑动平均)以及任务上限
+    :param path:设置文件路径，默认为DEFAULT_SETTINGS_FILE
+    """
+
+    def __init__(self, path=None):
+        path = DEFAULT_SETTINGS_FILE if path is None else path
+        self.path = path
+        self._lock = threading.Lock()
+        self.zooms = {}  # str(zoom) -> {"bytes_per_tile", "seconds_per_tile", "tiles"}
+        self.limits = JobLimits()
+        if path and os.path.exists(path):
+            try:
+                with open(path, encoding="utf-8") as f:
+                    data = json.load(f)
+                self.zooms = data.get("throughput", {})
+                self.limits = JobLimits(**data.get("limits", {}))
+            except (OSError, ValueError, TypeError) as e:
+                print(f"Failed to load planner settings {path}: {e}")
+
+    def estimate(self, zoom):
+        """
+        :return:(每瓦片字节数, 每瓦片耗时)，该级别没有记录时使用最接近级别的记录
+        """
+        if self.zooms:
+            nearest = min(self.zooms, key=lambda z: abs(int(z) - zoom))
+            entry = self.zooms[nearest]
+            return entry["bytes_per_tile"], entry["seconds_per_tile"]
+        return DEFAULT_BYTES_PER_TILE, DEFAULT_SECONDS_PER_TILE
+
+    def update(self, metrics):
+        """用一次运行中成功下载的分块更新滑动平均"""
+        totals = {}
+        for span in list(metrics.spans):
+            if span["stage"] != "download" or not span.get("ok") or not span.get("tiles"):
+                continue
+            entry = totals.setdefault(str(span["zoom"]), [0, 0, 0.0])
+            entry[0] += span["tiles"]
+            entry[1] += span.get("bytes") or 0
+            entry[2] += span["seconds"]
+        with self._lock:
+            for zoom, (tiles, written, seconds) in totals.items():
+                bytes_per_tile, seconds_per_tile = written / tiles, seconds / tiles
+                old = self.zooms.get(zoom)
+                if old is not None:
+                    bytes_per_tile = old["bytes_per_tile"] + HISTORY_WEIGHT * (bytes_per_tile - old["bytes_per_tile"])
+                    seconds_per_tile = (old["seconds_per_tile"]
+                                        + HISTORY_WEIGHT * (seconds_per_tile - old["seconds_per_tile"]))
+                    tiles += old.get("tiles", 0)
+                self.zooms[zoom] = {"bytes_per_tile": bytes_per_tile, "seconds_per_tile": seconds_per_tile,
+                                    "tiles": tiles}
+        return bool(totals)
+
+    def save(self):
+        with self._lock:
+            data = {"throughput": self.zooms, "limits": self.limits.to_dict()}
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+
+class RegionEstimate:
+    def __init__(self, index, bbox, tile_range, chunks, covered=None):
+        self.index = index
+        self.bbox = bbox
+        self.tile_range = tile_range
+        self.chunks = chunks  # 调度器会切成的分块(子进程)数
+        self.covered = covered  # 按多边形下载时实际请求的瓦片数
+
+    @property
+    def tiles(self):
+        return self.tile_range.count if self.covered is None else self.covered
+
+
+class JobEstimate:
+    """
+    整个任务的瓦片数、数据量和耗时估计，用add_region逐个区域累计
+    :param footprint:与DownloadScheduler的footprint相同，按多边形实际请求的分块计算
+    :param dedup:与DownloadScheduler的dedup相同，已被前面区域覆盖的瓦片不再计入
+    """
+
+    def __init__(self, zoom, provider, workers, bytes_per_tile, seconds_per_tile, dates_per_region=1,
+                 chunk_tiles=DEFAULT_CHUNK_TILES, footprint=False, dedup=False):
+        self.zoom = zoom
+        self.provider = provider
+        self.workers = workers
+        self.bytes_per_tile = bytes_per_tile
+        self.seconds_per_tile = seconds_per_tile
+        self.dates_per_region = dates_per_region  # 时间序列时每个区域下载的期数
+        self.chunk_tiles = chunk_tiles
+        self.footprint = footprint
+        self.grid = grid_for_provider(provider)
+        self.claims = TileClaimIndex(chunk_tiles) if dedup else None
+        self.can_merge = load_gdal() is not None
+        self.regions = []
+
+    def add_region(self, coords):
+        """
+        按调度器的规划方式计算一个区域的瓦片范围和分块数并累计
+        :param coords:WGS84坐标环
+        :return:RegionEstimate
+        """
+        grid, zoom, chunk_tiles = self.grid, self.zoom, self.chunk_tiles
+        longitudes, latitudes = reorganize_coords(coords)
+        bbox = (min(longitudes), min(latitudes), max(longitudes), max(latitudes))
+        tile_range = grid.tile_range(bbox, zoom)
+        index = len(self.regions) + 1
+        chunks = None
+        if self.claims is None and (not self.can_merge or tile_range.count <= chunk_tiles ** 2):
+            # 与调度器一致：没有GDAL或不超过一个分块时整个区域是一个下载任务
+            region = RegionEstimate(index, bbox, tile_range, 1)
+            self.regions.append(region)
+            return region
+        if self.footprint and len(longitudes) >= 3:
+            # 与调度器一致：按分块请求，分块内被收缩到覆盖瓦片的外接范围
+            chunks = [chunk for chunk, _ in FootprintCover(np.asarray(coords), bbox, grid, zoom)
+                      .iter_chunks(chunk_tiles)] or None
+        if self.claims is not None:
+            # 各期影像的去重结果相同，只需按一个日期计算
+            pieces = []
+            for chunk in chunks or [chunk for chunk, _ in grid.iter_chunks(bbox, zoom, chunk_tiles)]:
+                pieces.extend(self.claims.claim(None, chunk)[1])
+            for piece in pieces:
+                self.claims.add(None, piece)
+            chunks = pieces
+        if chunks is not None:
+            region = RegionEstimate(index, bbox, tile_range, len(chunks), sum(chunk.count for chunk in chunks))
+        else:
+            region = RegionEstimate(index, bbox, tile_range, grid.chunk_count(bbox, zoom, chunk_tiles))
+        self.regions.append(region)
+        return region
+
+    @property
+    def tiles(self):
+        return sum(r.tiles for r in self.regions) * self.dates_per_region
+
+    @property
+    def chunks(self):
+        return sum(r.chunks for r in self.regions) * self.dates_per_region
+
+    @property
+    def bytes(self):
+        return self.tiles * self.bytes_per_tile
+
+    @property
+    def seconds(self):
+        """分块并发下载，总耗时约为串行耗时除以并发数"""
+        return self.tiles * self.seconds_per_tile / max(1, min(self.workers, self.chunks or 1))
+
+    def violations(self, limits):
+        """
+        :return:超出上限的说明列表，为空表示可以下载
+        """
+        problems = []
+        if limits.max_tiles is not None and self.tiles > limits.max_tiles:
+            problems.append(f"{self.tiles:,} tiles exceeds the limit of {limits.max_tiles:,}")
+        if limits.max_bytes is not None and self.bytes > limits.max_bytes:
+            problems.append(f"estimated {format_bytes(self.bytes)} exceeds the limit of "
+                            f"{format_bytes(limits.max_bytes)}")
+        return problems
+
+    def format(self, max_regions=10):
+        """多行文本：总计以及瓦片数最多的几个区域"""
+        series = f" x {self.dates_per_region} dates" if self.dates_per_region > 1 else ""
+        lines = [f"{len(self.regions)} regions{series} at zoom {self.zoom}: {self.tiles:,} tiles in "
+                 f"{self.chunks:,} chunks",
+                 f"Estimated size {format_bytes(self.bytes)}, duration {format_duration(self.seconds)} "
+                 f"with {self.workers} workers"]
+        for r in sorted(self.regions, key=lambda r: -r.tiles)[:max_regions]:
+            text = f"  region {r.index}: {r.tile_range.width} x {r.tile_range.height} = {r.tile_range.count:,} tiles"
+            if r.covered is not None:
+                text += f", {r.covered:,} requested"
+            lines.append(f"{text}, {r.chunks} chunks")
+        if len(self.regions) > max_regions:
+            lines.append(f"  ... {len(self.regions) - max_regions} more regions")
+        return "\n".join(lines)
+
+
+def format_bytes(size):
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024.0
+    return f"{size:.1f} TB"
+
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return f"{hours}h{minutes:02d}m"
+    if minutes:
+        return f"{minutes}m{seconds:02d}s"
+    return f"{seconds}s"
+
+
+def estimate_job(coordinates, zoom, provider="TM", workers=1, chunk_tiles=DEFAULT_CHUNK_TILES, history=None,
+                 dates_per_region=1, footprint=False, dedup=False):
+    """
+    计算每个区域在数据源网格上的瓦片范围并估算数据量和耗时
+    :param coordinates:WGS84坐标环的列表或迭代器，与DownloadScheduler.plan的输入相同
+    :param history:ThroughputHistory，为None时使用默认吞吐量
+    :param footprint:与DownloadScheduler的footprint相同，按多边形实际请求的分块计算
+    :param dedup:与DownloadScheduler的dedup相同，已被前面区域覆盖的瓦片不再计入
+    """
+    bytes_per_tile, seconds_per_tile = (history.estimate(zoom) if history is not None
+                                        else (DEFAULT_BYTES_PER_TILE, DEFAULT_SECONDS_PER_TILE))
+    job = JobEstimate(zoom, provider, workers, bytes_per_tile, seconds_per_tile, dates_per_region,
+                      chunk_tiles, footprint, dedup)
+    for coords in coordinates:
+        job.add_region(coords)
+    return job
+
+
+class JobLimitExceeded(Exception):
+    pass
+
+
+class JobGuard:
+    """
+    流水线中不能在下载前得到全部区域，改为逐个区域累计预估规模，超过上限时中止
+    规模与estimate_job的计算相同，包括期数、按多边形下载和重叠去重
+    :param limits:JobLimits
+    :param on_exceeded:超过上限时的回调，如DownloadScheduler.cancel，终止已经开始的下载
+    """
+
+    def __init__(self, limits, zoom, provider="TM", workers=1, chunk_tiles=DEFAULT_CHUNK_TILES, history=None,
+                 dates_per_region=1, footprint=False, dedup=False, on_exceeded=None):
+        self.limits = limits
+        self.on_exceeded = on_exceeded
+        self.job = estimate_job([], zoom, provider, workers, chunk_tiles, history, dates_per_region, footprint, dedup)
+        self.error = None  # 超过上限时的JobLimitExceeded
+
+    def check(self, rings):
+        """逐个产出rings中的坐标环，累计的规模超过上限时抛出JobLimitExceeded"""
+        for ring in rings:
+            region = self.job.add_region(ring)
+            problems = self.job.violations(self.limits)
+            if problems:
+                self.error = JobLimitExceeded(f"Download stopped at region {region.index}: " + "; ".join(problems))
+                if self.on_exceeded is not None:
+                    self.on_exceeded()
+                raise self.error
+            yield ring
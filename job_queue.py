@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+下载任务队列 - 把每批下载(导出的GeoJSON或绘制的区域)作为一个任务保存在SQLite中，依次执行
+记录每个任务的参数和每个区域的状态(pending/running/done/failed)，支持暂停、继续和取消；
+程序崩溃或被关闭后，未完成的任务在下次启动时恢复，已完成的区域跳过，未完成的区域按清单续传
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_QUEUE_DB = os.path.join(os.path.expanduser("~"), ".xiaobai_downloader", "jobs.sqlite")
+
+# 任务状态
+QUEUED = "queued"
+RUNNING = "running"
+PAUSED = "paused"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+ACTIVE_STATES = (QUEUED, RUNNING, PAUSED)  # 尚未结束的任务
+
+# 区域状态
+REGION_PENDING = "pending"
+REGION_RUNNING = "running"
+REGION_DONE = "done"
+REGION_FAILED = "failed"
+
+
+class Job:
+    """
+    队列中的一个任务
+    :param params:下载参数(缩放级别、日期、并发数等)，可以序列化为JSON
+    :param source:区域来源，{"jsonfile": 路径, "precision": 反算模式}或{"rings": WGS84坐标环列表, "prefetch": 底图预取范围}
+    """
+
+    def __init__(self, job_id, output_path, params, source, state, message="", created=None):
+        self.id = job_id
+        self.output_path = output_path
+        self.params = params
+        self.source = source
+        self.state = state
+        self.message = message
+        self.created = created
+
+    @property
+    def label(self):
+        name = os.path.basename(self.source["jsonfile"]) if "jsonfile" in self.source else "drawn regions"
+        return f"job {self.id} ({name})"
+
+
+class JobQueue:
+    """
+    SQLite中的任务队列，可以在多个线程中使用(共用一个连接，用锁串行化)
+    :param path:数据库路径，默认在用户目录下，多个输出目录的任务排在同一个队列中
+    """
+
+    def __init__(self, path=DEFAULT_QUEUE_DB):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT, output_path TEXT, params TEXT, source TEXT,"
+                " state TEXT, message TEXT DEFAULT '', created REAL, updated REAL)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS regions ("
+                " job_id INTEGER, region INTEGER, date TEXT, state TEXT, output_file TEXT, error TEXT,"
+                " updated REAL, PRIMARY KEY (job_id, region, date))"
+            )
+
+    def _job(self, row):
+        job_id, output_path, params, source, state, message, created = row
+        return Job(job_id, output_path, json.loads(params), json.loads(source), state, message, created)
+
+    def add(self, output_path, params, source):
+        """
+        加入队列末尾
+        :return:Job
+        """
+        now = time.time()
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "INSERT INTO jobs (output_path, params, source, state, created, updated) VALUES (?, ?, ?, ?, ?, ?)",
+                (output_path, json.dumps(params), json.dumps(source), QUEUED, now, now))
+            job_id = cursor.lastrowid
+        return Job(job_id, output_path, params, source, QUEUED, created=now)
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, output_path, params, source, state, message, created FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        return self._job(row) if row is not None else None
+
+    def jobs(self, states=ACTIVE_STATES):
+        """:return:处于states中的任务，按加入顺序"""
+        marks = ", ".join("?" * len(states))
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT id, output_path, params, source, state, message, created FROM jobs"
+                f" WHERE state IN ({marks}) ORDER BY id", tuple(states)
+            ).fetchall()
+        return [self._job(row) for row in rows]
+
+    def next_job(self):
+        """:return:最早加入的排队任务，没有时返回None"""
+        queued = self.jobs((QUEUED,))
+        return queued[0] if queued else None
+
+    def set_state(self, job_id, state, message=""):
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE jobs SET state = ?, message = ?, updated = ? WHERE id = ?",
+                               (state, message, time.time(), job_id))
+
+    def resume(self, job_id=None):
+        """
+        把暂停的任务重新排队
+        :param job_id:为None时恢复所有暂停的任务
+        :return:重新排队的任务数
+        """
+        with self._lock, self._conn:
+            if job_id is None:
+                cursor = self._conn.execute("UPDATE jobs SET state = ?, updated = ? WHERE state = ?",
+                                            (QUEUED, time.time(), PAUSED))
+            else:
+                cursor = self._conn.execute("UPDATE jobs SET state = ?, updated = ? WHERE id = ? AND state = ?",
+                                            (QUEUED, time.time(), job_id, PAUSED))
+            return cursor.rowcount
+
+    def recover(self):
+        """
+        启动时调用：上次运行中断(崩溃或被关闭)时仍为running的任务和区域改为暂停/待下载
+        :return:中断的任务列表
+        """
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE regions SET state = ? WHERE state = ?", (REGION_PENDING, REGION_RUNNING))
+            self._conn.execute("UPDATE jobs SET state = ?, message = ?, updated = ? WHERE state = ?",
+                               (PAUSED, "interrupted", time.time(), RUNNING))
+        return [job for job in self.jobs((PAUSED,)) if job.message == "interrupted"]
+
+    def region_planned(self, job_id, region, date):
+        """区域任务已规划，尚未开始下载；已有记录时(恢复的任务)保持原状态"""
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR IGNORE INTO regions (job_id, region, date, state, updated)"
+                               " VALUES (?, ?, ?, ?, ?)", (job_id, region, date or "", REGION_PENDING, time.time()))
+
+    def region_started(self, job_id, region, date, output_file=None):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO regions (job_id, region, date, state, output_file, error, updated)"
+                " VALUES (?, ?, ?, ?, ?, NULL, ?)",
+                (job_id, region, date or "", REGION_RUNNING, output_file, time.time()))
+
+    def region_finished(self, job_id, region, date, ok, output_file=None, error=None, cancelled=False):
+        """
+        :param cancelled:因暂停或取消而中止的区域记为待下载
+        """
+        state = REGION_DONE if ok else (REGION_PENDING if cancelled else REGION_FAILED)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO regions (job_id, region, date, state, output_file, error, updated)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, region, date or "", state, output_file, error, time.time()))
+
+    def done_regions(self, job_id):
+        """:return:已完成的{(区域序号, 日期)}，恢复任务时跳过"""
+        with self._lock:
+            rows = self._conn.execute("SELECT region, date FROM regions WHERE job_id = ? AND state = ?",
+                                      (job_id, REGION_DONE)).fetchall()
+        return {(region, date) for region, date in rows}
+
+    def region_counts(self, job_id):
+        """:return:{区域状态: 数量}"""
+        with self._lock:
+            rows = self._conn.execute("SELECT state, COUNT(*) FROM regions WHERE job_id = ? GROUP BY state",
+                                      (job_id,)).fetchall()
+        return dict(rows)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
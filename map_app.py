@@ -1,16 +1,29 @@
 # download google image
-import io
+import multiprocessing
 import os
+import sqlite3
 import sys
-import subprocess
-import folium
-from folium.plugins.draw import Draw
-from PyQt5.QtWidgets import QApplication, QFileDialog, QVBoxLayout, QHBoxLayout, QWidget, QMessageBox, QLabel, QProgressBar, QSpinBox, QDateEdit, QPushButton, QDialog
+import time
+
+STARTUP_ORIGIN = time.perf_counter()  # 启动计时的起点，放在其他导入之前
+
+from PyQt5.QtWidgets import QApplication, QFileDialog, QVBoxLayout, QHBoxLayout, QWidget, QMessageBox, QLabel, QProgressBar, QSpinBox, QDateEdit, QPushButton, QDialog, QComboBox, QCheckBox, QDoubleSpinBox, QGroupBox
 from PyQt5.QtWebEngineWidgets import QWebEngineView, QWebEngineDownloadItem
-from PyQt5.QtCore import QThread, pyqtSignal, Qt, QDate
-import json
-from PyQt5.QtGui import QIcon, QPixmap
-from coord_convert import gcj02_to_wgs84
+from PyQt5.QtWebChannel import QWebChannel
+from PyQt5.QtCore import QThread, pyqtSignal, Qt, QDate, QTimer
+from PyQt5.QtGui import QIcon, QPixmap, QFontDatabase
+# 这里只导入创建窗口需要的模块；只在下载时使用的模块(调度、变化检测、流水线、后处理等)在用到时再导入
+from coord_convert import MODE_FAST, MODE_PRECISE
+from defaults import DEFAULT_MAX_WORKERS, COMPRESS_CHOICES
+from gdal_runtime import load_gdal
+from geometry_bridge import GeometryBridge, qwebchannel_script
+from job_queue import JobQueue, QUEUED, RUNNING, PAUSED, DONE, FAILED, CANCELLED
+from map_page import load_map_html
+from metrics import RunMetrics, StartupTimer, format_summary
+from retry_policy import CANCELLED as REGION_CANCELLED
+from tile_server import BasemapTileServer, TileStore
+
+STARTUP_REPORT_FILE = os.path.join(os.path.expanduser("~"), ".xiaobai_downloader", "startup_report.json")
 
 
 class InfoDialog(QDialog):
@@ -70,167 +83,345 @@ class InfoDialog(QDialog):
         layout.addLayout(button_layout)
         layout.setContentsMargins(20, 20, 20, 20)
 
-class Worker(QThread):
-    progress = pyqtSignal(int)
-    coordinates_ready = pyqtSignal(list)  # Signal to emit coordinates
-
-    def __init__(self, jsonfile):
-        super().__init__()
-        self.jsonfile = jsonfile
-
-    def readjson(self):
-        try:
-            with open(self.jsonfile, 'r', encoding='utf-8') as f:
-                json_data = json.load(f)
-        except Exception as e:
-            print(f"Error reading JSON file: {e}")
-            self.coordinates_ready.emit([])  # Emit empty list on error
-            return []
-
-        coordinates_info = []
-        for feature in json_data.get("features", []):
-            geometry = feature.get("geometry", {})
-            coords = geometry.get("coordinates", [])
-
-            # Handle Polygon
-            if geometry.get("type") == "Polygon":
-                for polygon in coords:
-                    coordinates_info.append(polygon)
-
-            # Handle MultiPolygon
-            elif geometry.get("type") == "MultiPolygon":
-                for multi_polygon in coords:
-                    for polygon in multi_polygon:
-                        coordinates_info.append(polygon)
-
-        return coordinates_info
-
-    def run(self):
-        coordinates = self.readjson()
-        if coordinates:
-            print("Coordinates loaded successfully.")
-            self.coordinates_ready.emit(coordinates)
-        else:
-            print("No coordinates found or failed to read JSON.")
-
-
 class DownloadWorker(QThread):
     progress_update = pyqtSignal(int)  # Signal to update download progress
     download_complete = pyqtSignal(str)  # Signal emitted when download is complete
     error_occurred = pyqtSignal(str)  # Signal emitted when an error occurs
+    throughput_update = pyqtSignal(float, float, float)  # 实时进度: 完成比例, 瓦片/秒, 字节/秒
+    metrics_update = pyqtSignal(dict)  # 各阶段耗时汇总，见RunMetrics.summary
 
-    def __init__(self, coordinates, output_path, zoom_level=18, date="2010-01-01"):
+    def __init__(self, coordinates, output_path, zoom_level=18, date="2010-01-01", max_workers=DEFAULT_MAX_WORKERS,
+                 use_cache=True, merge_output=False, end_date=None, metrics=None, history=None, footprint=False,
+                 dedup=False, jsonfile=None, precision=MODE_FAST, limits=None, tile_server=None, prefetch=None,
+                 postprocess=None, job_queue=None, job_id=None, governor=None, changes=False):
         super().__init__()
-        self.coordinates = coordinates
+        self.coordinates = coordinates  # WGS84坐标环；为None时从jsonfile边解析边转换
+        self.jsonfile = jsonfile
+        self.precision = precision
+        self.limits = limits  # JobLimits，从文件读取时逐个区域检查，超过时中止
+        self.tile_server = tile_server  # 不为None时预取区域周围的底图瓦片
+        self.prefetch = prefetch  # 地图坐标下需要预取底图的区域范围列表
+        self.guard = None  # JobGuard，从文件读取并限制规模时创建
+        self.postprocess = postprocess  # PostProcessOptions，为None时不做后处理
+        self.postprocessor = None
+        self.job_queue = job_queue  # JobQueue，记录每个区域的状态，恢复任务时跳过已完成的区域
+        self.job_id = job_id
+        self.governor = governor  # RateGovernor，所有任务共用的限速预算，运行中可以调整
+        self.outcome = None  # 结束后的任务状态(job_queue.DONE/FAILED/CANCELLED)
         self.output_path = output_path
         self.zoom_level = zoom_level
         self.date = date
-
-    def reorganize_coords(self, coords):
-        longitudes = []
-        latitudes = []
-        for point in coords:
-            longitude, latitude = point
-            longitudes.append(longitude)
-            latitudes.append(latitude)
-        return longitudes, latitudes
+        self.max_workers = max_workers
+        self.use_cache = use_cache
+        self.merge_output = merge_output
+        self.end_date = end_date  # 不为None时下载date到end_date之间的所有影像
+        self.metrics = metrics if metrics is not None else RunMetrics()
+        self.history = history  # ThroughputHistory，结束后用本次吞吐量更新
+        self.footprint = footprint  # 只下载多边形覆盖的分块
+        self.dedup = dedup  # 重叠区域的瓦片只下载一次
+        self.changes = changes  # 变化检测：只下载影像日期变化的单元，覆盖到已有的输出上
+        self.change_planner = None
+        self.scheduler = None
+        self.cancel_requested = False
+        self.results = []
+        self.failure_summary = ""
+
+    def on_region_started(self, region):
+        if self.job_queue is not None:
+            self.job_queue.region_started(self.job_id, region.index, region.date, region.output_file)
+
+    def iter_tracked(self, tasks):
+        """规划出的区域任务先登记到任务队列，再交给调度器"""
+        for task in tasks:
+            if self.job_queue is not None:
+                self.job_queue.region_planned(self.job_id, task.index, task.date)
+            yield task
+
+    def on_region_finished(self, result, done, total):
+        if self.job_queue is not None:
+            task = result.task
+            self.job_queue.region_finished(self.job_id, task.index, task.date, result.ok, task.output_file,
+                                           result.error, cancelled=result.failure_kind == REGION_CANCELLED)
+        if result.ok and result.cached:
+            print(f"Region {result.index} reused from cache")
+        elif result.ok:
+            print(f"Download completed successfully for region {result.index}")
+            if result.stdout:
+                print(f"Output: {result.stdout}")
+        else:
+            # 失败不再逐个弹窗，全部结束后汇总显示
+            print(result.error)
+        if self.change_planner is not None:
+            self.change_planner.commit(result)
+        if result.ok and self.postprocessor is not None:
+            # 在进程池中处理，与后面区域的下载同时进行
+            task = result.task
+            self.postprocessor.submit(task.output_file, {
+                "region": task.index, "date": task.date, "zoom": self.zoom_level, "bbox": list(task.bbox)})
+
+        # 更新进度(总数未知时暂不更新)
+        if total:
+            progress_percent = int((done / total) * 100)
+            self.progress_update.emit(progress_percent)
+        self.metrics_update.emit(self.metrics.summary())
+
+    def on_progress(self, stats):
+        self.throughput_update.emit(stats["fraction"], stats["tiles_per_second"], stats["bytes_per_second"])
+
+    def cancel(self):
+        """终止正在运行的下载，已完成的分块保留，下次可以续传"""
+        self.cancel_requested = True
+        if self.scheduler is not None:
+            self.scheduler.cancel()
 
     def run(self):
+        from change_detection import ChangePlanner
+        from download_scheduler import DownloadScheduler
+        from imagery_dates import DateResolver
+        from job_planner import JobLimitExceeded
+        from pipeline import ThreadedStage, ResultStage
+        from postprocess import PostProcessor
+        from region_cache import RegionCache
+        from retry_policy import summarize_failures
         try:
-            total = len(self.coordinates)
-            j = 0
-            # 获取GEHistoricalImagery.exe的路径
-            exe_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "GEHistoricalImagery.exe")
-            
-            for i, coords in enumerate(self.coordinates, start=1):
-                longitudes, latitudes = self.reorganize_coords(coords)
-                
-                # 生成唯一的输出文件名
-                output_filename = f"historical_img_{j}"
-                while any(f.startswith(output_filename) for f in os.listdir(self.output_path) if os.path.isfile(os.path.join(self.output_path, f))):
-                    j += 1
-                    output_filename = f"historical_img_{j}"
-
-                # 构建GEHistoricalImagery命令
-                lower_left = f"{min(latitudes)},{min(longitudes)}"
-                upper_right = f"{max(latitudes)},{max(longitudes)}"
-                
-                # 设置输出文件路径
-                output_file = os.path.join(self.output_path, f"{output_filename}.tif")
-                
-                cmd = [
-                    exe_path,
-                    "download",
-                    "--lower-left", lower_left,
-                    "--upper-right", upper_right,
-                    "--zoom", str(self.zoom_level),
-                    "--date", self.date,
-                    "--provider", "TM",
-                    "--output", output_file
-                ]
-                
-                # 执行下载命令
+            cache = RegionCache() if self.use_cache else None
+            scheduler = DownloadScheduler(self.output_path, self.zoom_level, self.date, self.max_workers, cache=cache,
+                                          metrics=self.metrics, footprint=self.footprint, dedup=self.dedup,
+                                          governor=self.governor)
+            self.scheduler = scheduler
+            if self.cancel_requested:
+                scheduler.cancel()
+            if self.postprocess is not None and self.postprocess.enabled:
+                if load_gdal() is None:
+                    print("Post-processing disabled: GDAL Python bindings are not available")
+                else:
+                    self.postprocessor = PostProcessor(self.postprocess, metrics=self.metrics)
+            dates = None
+            if self.end_date is not None:
+                dates = DateResolver(self.zoom_level, date_range=(self.date, self.end_date))
+            if self.changes:
+                if load_gdal() is None:
+                    raise RuntimeError("Change detection needs GDAL Python bindings to patch existing outputs")
+                self.change_planner = ChangePlanner(scheduler, workers=self.max_workers)
+            # 恢复的任务跳过已经完成的区域
+            skip = None
+            finished = self.job_queue.done_regions(self.job_id) if self.job_queue is not None else set()
+            if finished:
+                print(f"Skipping {len(finished)} regions finished in an earlier run")
+                skip = lambda index, date: (index, date or "") in finished
+            # 解析、转换、规划、下载、结果处理各在一个线程中运行，第一个区域解析完即可开始下载
+            stages = []
+            try:
+                rings = self.iter_regions(scheduler, stages)
+                if self.change_planner is not None:
+                    tasks = self.change_planner.iter_plan(rings)
+                else:
+                    tasks = scheduler.iter_plan(rings, dates, skip)
+                plan = ThreadedStage("plan", self.iter_tracked(tasks))
+                stages.append(plan)
+                results = ResultStage(self.on_region_finished)
                 try:
-                    print(f"Executing: {' '.join(cmd)}")
-                    print(f"Working directory: {self.output_path}")
-                    
-                    result = subprocess.run(
-                        cmd,
-                        cwd=self.output_path,
-                        capture_output=True,
-                        text=True,
-                        encoding='gbk',  # 使用gbk编码处理中文输出
-                        errors='ignore',  # 忽略编码错误
-                        timeout=300  # 5分钟超时
-                    )
-                    
-                    if result.returncode == 0:
-                        print(f"Download completed successfully for region {i}")
-                        if result.stdout:
-                            print(f"Output: {result.stdout}")
-                    else:
-                        error_message = f"Download failed for region {i}: {result.stderr}"
-                        print(error_message)
-                        self.error_occurred.emit(error_message)
-                        continue
-                        
-                except subprocess.TimeoutExpired:
-                    error_message = f"Download timeout for region {i}"
-                    print(error_message)
-                    self.error_occurred.emit(error_message)
-                    continue
+                    self.results = scheduler.run(plan, on_result=results.submit, on_progress=self.on_progress,
+                                                 on_start=self.on_region_started)
+                finally:
+                    results.close()
+            finally:
+                for stage in reversed(stages):
+                    stage.close()
+            if self.guard is not None and self.guard.error is not None:
+                # 调度器可能先看到取消而没有取到规划阶段抛出的异常
+                raise self.guard.error
+            if scheduler.cancelled:
+                self.outcome = CANCELLED
+                self.download_complete.emit("Downloads cancelled.")
+                return
+            if not self.results and finished:
+                self.outcome = DONE
+                self.download_complete.emit("All regions were already downloaded.")
+                return
+            if not self.results and self.change_planner is not None and self.change_planner.unchanged:
+                self.outcome = DONE
+                self.download_complete.emit("No imagery changed since the last run.")
+                return
+            if not self.results:
+                self.outcome = FAILED
+                self.error_occurred.emit("No coordinates found in the GeoJSON file.")
+                return
+            post_failures = self.wait_postprocess()
+            if self.merge_output and not scheduler.can_merge:
+                print("GDAL not available, outputs are kept per region")
+            elif self.merge_output and any(r.ok for r in self.results):
+                # 合并所有区域的输出为一个COG
+                try:
+                    for mosaic_file in scheduler.merge_results(self.results):
+                        print(f"Merged outputs into {mosaic_file}")
                 except Exception as e:
-                    error_message = f"Failed to execute download for region {i}: {e}"
-                    print(error_message)
-                    self.error_occurred.emit(error_message)
-                    continue
-
-                # 更新进度
-                progress_percent = int((i / total) * 100)
-                self.progress_update.emit(progress_percent)
-                j += 1
-
-            self.download_complete.emit("All downloads completed successfully!")
+                    self.error_occurred.emit(f"Failed to merge outputs: {e}")
+            self.failure_summary = summarize_failures(self.results)
+            self.outcome = FAILED if self.failure_summary else DONE
+            if self.failure_summary:
+                print(self.failure_summary)
+                self.download_complete.emit(self.failure_summary.splitlines()[0])
+            elif post_failures:
+                self.failure_summary = "\n".join(f"{path}: {error}" for path, error in post_failures)
+                self.download_complete.emit(f"All downloads completed, {len(post_failures)} outputs failed "
+                                            f"post-processing.")
+            else:
+                self.download_complete.emit("All downloads completed successfully!")
+        except JobLimitExceeded as e:
+            self.outcome = FAILED
+            message = f"{e}\nLower the zoom level or split the area. Limits: {self.history.path}"
+            print(message)
+            self.error_occurred.emit(message)
         except Exception as e:
+            self.outcome = FAILED
             error_message = f"An error occurred during downloads: {e}"
             print(error_message)
             self.error_occurred.emit(error_message)
+        finally:
+            if self.postprocessor is not None:
+                # 取消或出错时不再等待排队的文件
+                self.postprocessor.cancel()
+            if self.change_planner is not None:
+                self.change_planner.close()
+            self.write_report()
+
+    def wait_postprocess(self):
+        """
+        等待后处理进程池处理完所有输出，合并输出前调用
+        :return:失败列表[(文件, 错误信息)]
+        """
+        if self.postprocessor is None:
+            return []
+        print("Waiting for post-processing to finish...")
+        failures = self.postprocessor.wait()
+        self.postprocessor = None
+        return failures
+
+    def iter_regions(self, scheduler, stages):
+        """
+        :param stages:创建的ThreadedStage加入该列表，由调用方在结束时关闭
+        :return:交给规划阶段的WGS84坐标环迭代器
+        """
+        from job_planner import JobGuard
+        from pipeline import ThreadedStage, convert_rings
+        if self.jsonfile is None:
+            if self.tile_server is not None and self.prefetch:
+                self.tile_server.prefetch(self.prefetch)
+            return self.coordinates
+        parse = ThreadedStage("parse", self.iter_parsed())
+        stages.append(parse)
+        convert = ThreadedStage("convert", convert_rings(parse, self.precision, self.metrics))
+        stages.append(convert)
+        if self.limits is None:
+            return convert
+        # 时间序列的期数在查询前未知，与下载前的预估一样按1期计算
+        self.guard = JobGuard(self.limits, self.zoom_level, workers=self.max_workers, history=self.history,
+                              dates_per_region=1, footprint=self.footprint, dedup=scheduler.dedup,
+                              on_exceeded=scheduler.cancel)
+        return self.guard.check(convert)
+
+    def iter_parsed(self):
+        """流式解析GeoJSON，逐个产出地图坐标的坐标环；解析结束后预取所有区域周围的底图"""
+        from download_scheduler import ring_bbox
+        from geojson_stream import iter_rings
+        bboxes = []
+        for ring in self.metrics.timed_iter(iter_rings(self.jsonfile), "read_geojson",
+                                            file=os.path.basename(self.jsonfile)):
+            if self.tile_server is not None:
+                bboxes.append(ring_bbox(ring))
+            yield ring
+        if bboxes:
+            self.tile_server.prefetch(bboxes)
+
+    def write_report(self):
+        """在输出目录写出本次运行的JSON/CSV报告"""
+        summary = self.metrics.summary()
+        print(format_summary(summary))
+        self.metrics_update.emit(summary)
+        try:
+            for path in self.metrics.write_report(self.output_path):
+                print(f"Run report written to {path}")
+        except Exception as e:
+            print(f"Failed to write run report: {e}")
+        if self.history is not None and self.history.update(self.metrics):
+            try:
+                self.history.save()
+            except OSError as e:
+                print(f"Failed to save throughput history: {e}")
+
+
+class EstimateWorker(QThread):
+    """在后台转换绘制图形的坐标并预估规模，GUI线程不做坐标计算"""
+    estimated = pyqtSignal(object, object, object)  # 地图坐标环列表, WGS84坐标环列表, JobEstimate(失败时为None)
+
+    def __init__(self, bridge, precision, zoom_level, max_workers, history, footprint=False, dedup=False):
+        super().__init__()
+        self.bridge = bridge
+        self.snapshot = bridge.snapshot()  # 在GUI线程中取快照，之后的编辑不影响本次预估
+        self.precision = precision
+        self.zoom_level = zoom_level
+        self.max_workers = max_workers
+        self.history = history
+        self.footprint = footprint
+        self.dedup = dedup
+
+    def run(self):
+        from job_planner import estimate_job
+        rings = [ring for _, ring in self.snapshot]
+        try:
+            wgs84_coordinates = self.bridge.convert(self.snapshot, self.precision)
+            estimate = estimate_job(wgs84_coordinates, self.zoom_level, workers=self.max_workers,
+                                    history=self.history, footprint=self.footprint, dedup=self.dedup)
+        except Exception as e:
+            print(f"Failed to estimate drawn regions: {e}")
+            self.estimated.emit(rings, [], None)
+            return
+        self.estimated.emit(rings, wgs84_coordinates, estimate)
 
 
 class Mapy(QWidget):
-    def __init__(self, parent=None):
+    def __init__(self, parent=None, startup=None):
         super().__init__(parent)
-        self.worker = None
+        self.estimate_worker = None
+        self.estimate_pending = False  # 预估进行中图形又有变化，结束后重新预估
+        self.start_requested = False  # 预估结束后开始下载
         self.download_worker = None
+        self.job_queue = self.open_job_queue()  # 持久化的下载任务队列，依次执行
+        self.interrupted_jobs = self.job_queue.recover()  # 上次运行中断的任务，须在开始新任务之前取出
+        self.current_job = None
+        self.pause_requested = False
         self.output_path = None
+        self.metrics = RunMetrics()
+        self._history = None  # 历史吞吐量和任务规模上限，第一次用到时读取
+        self._governor = None  # 下载限速，第一次用到时创建
+        self.startup = startup if startup is not None else StartupTimer()  # 启动计时
+        self.tile_server = self.start_tile_server()
         self.init_ui()
+        self.startup.mark("window_shown")
+        # 上次未完成的任务在事件循环开始后询问是否继续
+        QTimer.singleShot(0, self.recover_jobs)
+
+    @property
+    def history(self):
+        """ThroughputHistory；job_planner连带导入下载调度模块，不在启动时加载"""
+        if self._history is None:
+            from job_planner import ThroughputHistory
+            self._history = ThroughputHistory()
+        return self._history
+
+    @property
+    def governor(self):
+        """RateGovernor，所有任务共用，界面上调整的预算立即作用于正在运行的下载"""
+        if self._governor is None:
+            from rate_governor import RateGovernor
+            self._governor = RateGovernor()
+            self.apply_rate_limits()
+        return self._governor
 
     def init_ui(self):
         vbox = QVBoxLayout(self)
 
-        # 参数设置区域
-        params_layout = QHBoxLayout()
-        
         # 缩放比例设置
         zoom_label = QLabel("缩放比例:")
         self.zoom_spinbox = QSpinBox()
@@ -242,22 +433,116 @@ class Mapy(QWidget):
         self.date_edit = QDateEdit()
         self.date_edit.setDate(QDate(2024, 1, 1))  # 默认日期
         self.date_edit.setCalendarPopup(True)
+
+        # 时间序列：下载开始日期到结束日期之间的所有影像
+        self.series_checkbox = QCheckBox("时间序列至")
+        self.end_date_edit = QDateEdit()
+        self.end_date_edit.setDate(QDate.currentDate())
+        self.end_date_edit.setCalendarPopup(True)
+        self.end_date_edit.setEnabled(False)
+        self.series_checkbox.toggled.connect(self.end_date_edit.setEnabled)
+
+        # 并发数设置
+        workers_label = QLabel("并发数:")
+        self.workers_spinbox = QSpinBox()
+        self.workers_spinbox.setRange(1, 16)
+        self.workers_spinbox.setValue(DEFAULT_MAX_WORKERS)
+
+        # 所有并发下载合计的限速，0为不限，下载中修改立即生效
+        rate_label = QLabel("限速:")
+        self.tile_rate_spinbox = QSpinBox()
+        self.tile_rate_spinbox.setRange(0, 10000)
+        self.tile_rate_spinbox.setSingleStep(10)
+        self.tile_rate_spinbox.setSpecialValueText("不限")
+        self.tile_rate_spinbox.setSuffix(" 瓦片/秒")
+        self.bandwidth_spinbox = QDoubleSpinBox()
+        self.bandwidth_spinbox.setRange(0, 1000)
+        self.bandwidth_spinbox.setDecimals(1)
+        self.bandwidth_spinbox.setSpecialValueText("不限")
+        self.bandwidth_spinbox.setSuffix(" MB/s")
+        self.tile_rate_spinbox.valueChanged.connect(self.apply_rate_limits)
+        self.bandwidth_spinbox.valueChanged.connect(self.apply_rate_limits)
+
+        # 坐标反算精度设置
+        precision_label = QLabel("坐标精度:")
+        self.precision_combo = QComboBox()
+        self.precision_combo.addItem("快速", MODE_FAST)
+        self.precision_combo.addItem("精确", MODE_PRECISE)
+
+        # 是否复用之前下载过的相同区域
+        self.cache_checkbox = QCheckBox("使用缓存")
+        self.cache_checkbox.setChecked(True)
+
+        # 是否把所有区域合并为一个COG
+        self.merge_checkbox = QCheckBox("合并输出")
+
+        # 是否只下载多边形覆盖的范围(否则下载外接矩形)
+        self.footprint_checkbox = QCheckBox("按多边形裁剪")
+
+        # 多个区域重叠时共享的瓦片只下载一次(需要GDAL拼接)
+        self.dedup_checkbox = QCheckBox("重叠去重")
+
+        # 定期更新同一批区域时只下载影像日期变化的部分，覆盖到上次的输出上(需要GDAL拼接)
+        self.changes_checkbox = QCheckBox("仅下载变化")
+
+        # 下载完成后在进程池中建立金字塔、重新压缩和重投影(需要GDAL)
+        postprocess_label = QLabel("后处理:")
+        self.postprocess_combo = QComboBox()
+        self.postprocess_combo.addItem("无", None)
+        self.postprocess_combo.addItem("金字塔", "")
+        for compress in COMPRESS_CHOICES:
+            self.postprocess_combo.addItem(compress, compress)
+        self.srs_combo = QComboBox()
+        self.srs_combo.addItem("原坐标系", None)
+        self.srs_combo.addItem("EPSG:3857", "EPSG:3857")
+        self.srs_combo.addItem("EPSG:4326", "EPSG:4326")
+        self.srs_combo.setEnabled(False)
+        self.postprocess_combo.currentIndexChanged.connect(
+            lambda: self.srs_combo.setEnabled(self.postprocess_combo.currentData() is not None))
+
+        # 是否显示各阶段耗时统计
+        self.stats_checkbox = QCheckBox("统计面板")
         
+        # 用地图上绘制的区域直接开始下载，不需要先导出GeoJSON
+        self.download_button = QPushButton("开始下载")
+        self.download_button.clicked.connect(self.start_drawn_download)
+        self.download_button.setEnabled(False)
+
         # 更多信息按钮
         self.info_button = QPushButton("更多信息")
         self.info_button.clicked.connect(self.show_info_dialog)
         self.info_button.setMaximumWidth(100)
         
-        params_layout.addWidget(zoom_label)
-        params_layout.addWidget(self.zoom_spinbox)
-        params_layout.addWidget(date_label)
-        params_layout.addWidget(self.date_edit)
-        params_layout.addStretch()  # 添加弹性空间，使按钮靠右
-        params_layout.addWidget(self.info_button)
+        # 参数设置区域分为两行的几组，不再挤在一行里
+        imagery_group = self.group_box("影像", zoom_label, self.zoom_spinbox, date_label, self.date_edit,
+                                       self.series_checkbox, self.end_date_edit, precision_label, self.precision_combo)
+        download_group = self.group_box("下载", workers_label, self.workers_spinbox, rate_label,
+                                        self.tile_rate_spinbox, self.bandwidth_spinbox, self.cache_checkbox)
+        output_group = self.group_box("输出", self.merge_checkbox, self.footprint_checkbox, self.dedup_checkbox,
+                                      self.changes_checkbox, postprocess_label, self.postprocess_combo,
+                                      self.srs_combo)
+        params_row = QHBoxLayout()
+        params_row.addWidget(imagery_group)
+        params_row.addWidget(download_group)
+        params_row.addStretch()
+        actions_row = QHBoxLayout()
+        actions_row.addWidget(output_group)
+        actions_row.addWidget(self.stats_checkbox)
+        actions_row.addStretch()  # 添加弹性空间，使按钮靠右
+        actions_row.addWidget(self.download_button)
+        actions_row.addWidget(self.info_button)
 
         # WebEngineView to display the map
         self.webEngineView = QWebEngineView()
         self.webEngineView.page().profile().downloadRequested.connect(self.handle_downloadRequested)
+        self.webEngineView.loadFinished.connect(self.on_map_loaded)
+
+        # 绘制的图形通过QWebChannel实时同步到bridge
+        self.bridge = GeometryBridge(self)
+        self.bridge.shapes_changed.connect(self.on_shapes_changed)
+        self.channel = QWebChannel(self)
+        self.channel.registerObject("bridge", self.bridge)
+        self.webEngineView.page().setWebChannel(self.channel)
         self.setWindowTitle('Icon')
 
         # 设置窗口图标
@@ -273,83 +558,90 @@ class Mapy(QWidget):
         self.progress_bar.setValue(0)
         self.progress_bar.setVisible(False)  # Hidden initially
 
+        # 取消按钮，下载期间显示
+        self.cancel_button = QPushButton("取消", self)
+        self.cancel_button.clicked.connect(self.cancel_download)
+        self.cancel_button.setVisible(False)
+
+        # 暂停当前任务和队列，有暂停的任务时变为"继续"
+        self.pause_button = QPushButton("暂停", self)
+        self.pause_button.clicked.connect(self.toggle_pause)
+        self.pause_button.setVisible(False)
+
         # Status label to show messages
         self.status_label = QLabel("", self)
         self.status_label.setAlignment(Qt.AlignCenter)
 
-        # Load the initial map
-        self.loadPage()
+        # 统计面板，显示各阶段的次数和耗时
+        self.stats_label = QLabel("", self)
+        self.stats_label.setFont(QFontDatabase.systemFont(QFontDatabase.FixedFont))
+        self.stats_label.setTextInteractionFlags(Qt.TextSelectableByMouse)
+        self.stats_label.setVisible(False)
+        self.stats_checkbox.toggled.connect(self.stats_label.setVisible)
+
+        # 窗口显示后再加载地图，先让界面完成首次绘制
+        QTimer.singleShot(0, self.loadPage)
 
         # Add widgets to layout
-        vbox.addLayout(params_layout)
+        vbox.addLayout(params_row)
+        vbox.addLayout(actions_row)
         vbox.addWidget(self.webEngineView)
-        vbox.addWidget(self.progress_bar)
+        progress_layout = QHBoxLayout()
+        progress_layout.addWidget(self.progress_bar)
+        progress_layout.addWidget(self.pause_button)
+        progress_layout.addWidget(self.cancel_button)
+        vbox.addLayout(progress_layout)
         vbox.addWidget(self.status_label)
+        vbox.addWidget(self.stats_label)
 
         self.setLayout(vbox)
         self.setGeometry(300, 300, 800, 600)
         self.setWindowTitle("小白影像下载")
         self.show()
 
-    def loadPage(self):
-        location = [30.2899, 120.1568]
-        folium_map = folium.Map(
-            location=location,
-            zoom_start=10,
-            tiles='http://webrd01.is.autonavi.com/appmaptile?lang=zh_cn&size=1&scale=1&style=7&x={x}&y={y}&z={z}',
-            attr='AutoNavi Map',
-        )
+    @staticmethod
+    def group_box(title, *widgets):
+        """:return:把widgets横向排列的QGroupBox"""
+        group = QGroupBox(title)
+        layout = QHBoxLayout(group)
+        for widget in widgets:
+            layout.addWidget(widget)
+        return group
+
+    def open_job_queue(self):
+        """打开用户目录下的任务队列，失败时使用内存中的队列(不能跨重启恢复)"""
+        try:
+            return JobQueue()
+        except (OSError, sqlite3.Error) as e:
+            print(f"Failed to open job queue, queued jobs will not survive a restart: {e}")
+            return JobQueue(":memory:")
 
-        Draw(
-            export=True,
-            filename="data.geojson",
-            position="topleft",
-            draw_options={
-                'polyline': False,
-                'rectangle': {'shapeOptions': {'color': '#f06'}},
-                'circle': False,
-                'marker': False,
-                'polygon': False,
-                'circlemarker': False
-            },
-            edit_options={
-                'edit': True,
-                'remove': True
-            }
-        ).add_to(folium_map)
-
-        data = io.BytesIO()
-        folium_map.save(data, close_file=False)
-        
-        # 获取HTML内容并修改export按钮文字
-        html_content = data.getvalue().decode()
-        # 添加JavaScript来修改export按钮文字并隐藏Leaflet按钮
-        custom_js = """
-        <style>
-        /* 隐藏Leaflet attribution控件 */
-        .leaflet-control-attribution {
-            display: none !important;
-        }
-        </style>
-        <script>
-        document.addEventListener('DOMContentLoaded', function() {
-            // 等待页面完全加载后修改按钮文字
-            setTimeout(function() {
-                var exportButton = document.getElementById('export');
-                if (exportButton) {
-                    exportButton.innerHTML = 'download';
-                    exportButton.title = 'download data';
-                }
-            }, 1000);
-        });
-        </script>
-        """
-        
-        # 在</body>标签前插入自定义JavaScript
-        html_content = html_content.replace('</body>', custom_js + '</body>')
-        
+    def start_tile_server(self):
+        """启动本地底图瓦片缓存，失败时地图直接请求在线瓦片"""
+        try:
+            return BasemapTileServer(TileStore()).start()
+        except (OSError, sqlite3.Error) as e:
+            print(f"Failed to start basemap tile cache: {e}")
+            return None
+
+    def loadPage(self):
+        self.startup.mark("event_loop")
+        # 优先使用缓存的地图模板，参数变化后才导入folium重新渲染
+        tile_url = self.tile_server.url_template if self.tile_server is not None else None
+        html_content, source = load_map_html(tile_url, head_script=qwebchannel_script())
+        self.startup.mark(f"map_html_{source}")
         self.webEngineView.setHtml(html_content)
 
+    def on_map_loaded(self, ok):
+        """地图首次加载完成时输出启动计时报告"""
+        self.webEngineView.loadFinished.disconnect(self.on_map_loaded)
+        self.startup.mark("map_loaded" if ok else "map_load_failed")
+        print("Startup timing:\n" + self.startup.format())
+        try:
+            self.startup.write(STARTUP_REPORT_FILE)
+        except OSError as e:
+            print(f"Failed to write startup report: {e}")
+
     def handle_downloadRequested(self, item: QWebEngineDownloadItem):
         directory = QFileDialog.getExistingDirectory(self, "Select Directory")
 
@@ -371,41 +663,249 @@ class Mapy(QWidget):
     def onStateChanged(self, state, jsonfile):
         if state == QWebEngineDownloadItem.DownloadCompleted:
             print(f"Download completed: {jsonfile}")
-            self.output_path = os.path.dirname(jsonfile)
-
-            # Start Worker to read JSON and emit coordinates
-            self.worker = Worker(jsonfile)
-            self.worker.coordinates_ready.connect(self.start_download)
-            self.worker.start()
-            self.status_label.setText("Processing coordinates...")
+            self.start_file_download(jsonfile)
         elif state == QWebEngineDownloadItem.DownloadFailed:
             QMessageBox.critical(self, "Download Failed", "The GeoJSON file failed to download.")
 
-    def start_download(self, coordinates):
-        if not coordinates:
-            QMessageBox.warning(self, "No Coordinates", "No coordinates found in the GeoJSON file.")
+    def download_params(self):
+        """:return:界面上设置的下载参数，作为DownloadWorker的关键字参数"""
+        end_date = None
+        if self.series_checkbox.isChecked():
+            end_date = self.end_date_edit.date().toString("yyyy-MM-dd")
+        return dict(
+            zoom_level=self.zoom_spinbox.value(),
+            date=self.date_edit.date().toString("yyyy-MM-dd"),
+            max_workers=self.workers_spinbox.value(),
+            use_cache=self.cache_checkbox.isChecked(),
+            merge_output=self.merge_checkbox.isChecked() and load_gdal() is not None,
+            end_date=end_date,
+            history=self.history,
+            footprint=self.footprint_checkbox.isChecked(),
+            dedup=self.dedup_checkbox.isChecked() and load_gdal() is not None,
+            changes=self.changes_checkbox.isChecked(),
+            postprocess=self.postprocess_options(),
+        )
+
+    def postprocess_options(self):
+        """:return:PostProcessOptions，未选择后处理时为None"""
+        from postprocess import PostProcessOptions
+        compress = self.postprocess_combo.currentData()
+        if compress is None:
+            return None
+        return PostProcessOptions(target_srs=self.srs_combo.currentData(), compress=compress or None)
+
+    def start_file_download(self, jsonfile):
+        """
+        导出的GeoJSON在DownloadWorker中边解析、边转换、边下载，不等整个文件读完
+        区域总数事先未知，不再显示预估对话框，改为逐个区域累计规模，超过上限时中止
+        """
+        self.output_path = os.path.dirname(jsonfile)
+        self.enqueue_job({"jsonfile": jsonfile, "precision": self.precision_combo.currentData()})
+
+    def on_shapes_changed(self, count):
+        """绘制的图形变化后在后台转换坐标并预估规模，点击开始下载时不需要再等待"""
+        self.download_button.setEnabled(count > 0)
+        if not count:
+            self.status_label.setText("")
+            return
+        self.request_estimate()
+
+    def request_estimate(self, start=False):
+        """
+        :param start:预估结束后开始下载
+        """
+        self.start_requested = self.start_requested or start
+        if self.estimate_worker is not None and self.estimate_worker.isRunning():
+            self.estimate_pending = True
+            return
+        self.estimate_pending = False
+        params = self.download_params()
+        self.estimate_worker = EstimateWorker(self.bridge, self.precision_combo.currentData(), params["zoom_level"],
+                                              params["max_workers"], self.history, params["footprint"],
+                                              params["dedup"])
+        self.estimate_worker.estimated.connect(self.on_estimated)
+        self.estimate_worker.start()
+
+    def on_estimated(self, rings, wgs84_coordinates, estimate):
+        if self.estimate_pending:
+            # 结果已过期，按最新的图形重新预估
+            self.request_estimate()
+            return
+        if estimate is not None:
+            self.status_label.setText(f"{len(rings)} regions drawn: {estimate.tiles:,} tiles "
+                                      f"at zoom {estimate.zoom}")
+        if self.start_requested:
+            self.start_requested = False
+            self.confirm_download(rings, wgs84_coordinates, estimate)
+
+    def start_drawn_download(self):
+        """用bridge中的图形开始下载，第一次下载时选择输出目录"""
+        if not self.output_path:
+            directory = QFileDialog.getExistingDirectory(self, "Select Directory")
+            if not directory:
+                return
+            self.output_path = directory
+        self.status_label.setText("Preparing regions...")
+        self.request_estimate(start=True)
+
+    def confirm_download(self, coordinates, wgs84_coordinates, estimate):
+        """
+        显示预估的规模，确认后开始下载
+        :param coordinates:地图坐标(GCJ02)的坐标环列表，用于预取底图
+        :param wgs84_coordinates:已经转换好的WGS84坐标环
+        :param estimate:JobEstimate，为None时表示转换或预估失败
+        """
+        if not wgs84_coordinates or estimate is None:
+            QMessageBox.warning(self, "No Coordinates", "No valid regions to download.")
             self.status_label.setText("No coordinates to download.")
             return
 
-        # 将坐标转换为WGS84坐标系
-        wgs84_coordinates = []
-        for i in coordinates:
-            wgs84_coordinates.append([])
-            for j in i:
-                wgs84_coordinates[-1].append(gcj02_to_wgs84(j[0], j[1]))
+        params = self.download_params()
+        summary = estimate.format()
+        if params["end_date"] is not None:
+            summary += "\n(time series: each available capture is downloaded separately)"
+        problems = estimate.violations(self.history.limits)
+        if problems:
+            QMessageBox.warning(self, "Job Too Large",
+                                summary + "\n\n" + "\n".join(problems)
+                                + f"\n\nLower the zoom level or split the area. Limits: {self.history.path}")
+            self.status_label.setText("Download refused: job exceeds the configured limits.")
+            return
+        answer = QMessageBox.question(self, "Download Preview", summary + "\n\nStart download?",
+                                      QMessageBox.Yes | QMessageBox.No, QMessageBox.Yes)
+        if answer != QMessageBox.Yes:
+            self.status_label.setText("Download cancelled.")
+            return
 
-        # 获取用户设置的参数
-        zoom_level = self.zoom_spinbox.value()
-        selected_date = self.date_edit.date().toString("yyyy-MM-dd")
-        
-        self.download_worker = DownloadWorker(wgs84_coordinates, self.output_path, zoom_level, selected_date)
+        # 地图坐标下的范围用于预取底图
+        from download_scheduler import ring_bbox
+        self.enqueue_job({"rings": [ring.tolist() for ring in wgs84_coordinates],
+                          "prefetch": [ring_bbox(ring) for ring in coordinates]})
+
+    def job_params(self):
+        """:return:保存到任务队列中的下载参数(可以序列化为JSON)"""
+        params = self.download_params()
+        del params["history"]
+        postprocess = params.pop("postprocess")
+        if postprocess is not None:
+            params["postprocess"] = {"target_srs": postprocess.target_srs, "compress": postprocess.compress}
+        return params
+
+    def enqueue_job(self, source):
+        """
+        把一批区域加入任务队列，正在下载时排在后面，不会替换正在运行的任务
+        :param source:{"jsonfile": 路径, "precision": 反算模式}或{"rings": WGS84坐标环列表, "prefetch": 范围列表}
+        """
+        job = self.job_queue.add(self.output_path, self.job_params(), source)
+        if self.download_running():
+            waiting = len(self.job_queue.jobs((QUEUED,)))
+            self.status_label.setText(f"Queued {job.label}, {waiting} jobs waiting.")
+            return
+        self.run_next_job()
+
+    def download_running(self):
+        """当前任务的状态在on_worker_finished中记录后才算结束，线程结束和finished信号之间不会开始下一个任务"""
+        return self.current_job is not None
+
+    def create_worker(self, job):
+        """按任务队列中保存的参数创建DownloadWorker"""
+        from postprocess import PostProcessOptions
+        params = dict(job.params)
+        postprocess = params.pop("postprocess", None)
+        source = job.source
+        from_file = "jsonfile" in source
+        self.metrics = RunMetrics()
+        return DownloadWorker(source.get("rings"), job.output_path, metrics=self.metrics, history=self.history,
+                              jsonfile=source.get("jsonfile"), precision=source.get("precision", MODE_FAST),
+                              limits=self.history.limits if from_file else None, tile_server=self.tile_server,
+                              prefetch=source.get("prefetch"),
+                              postprocess=PostProcessOptions(**postprocess) if postprocess else None,
+                              job_queue=self.job_queue, job_id=job.id, governor=self.governor, **params)
+
+    def run_next_job(self):
+        """没有正在运行的任务时开始队列中最早的任务"""
+        if self.download_running():
+            return
+        job = self.job_queue.next_job()
+        if job is None:
+            self.update_queue_controls()
+            return
+        self.current_job = job
+        self.pause_requested = False
+        self.job_queue.set_state(job.id, RUNNING)
+        self.output_path = job.output_path
+        self.launch_download(self.create_worker(job))
+        self.status_label.setText(f"Starting {job.label}...")
+
+    def on_worker_finished(self):
+        """任务结束后记录状态并开始下一个任务；暂停时队列停止"""
+        worker, job = self.download_worker, self.current_job
+        if job is None:
+            return
+        self.current_job = None
+        if self.pause_requested:
+            state = PAUSED
+        else:
+            state = worker.outcome or FAILED
+        self.job_queue.set_state(job.id, state, worker.failure_summary.splitlines()[0] if worker.failure_summary
+                                 else "")
+        if state != PAUSED:
+            self.run_next_job()
+        self.update_queue_controls()
+
+    def update_queue_controls(self):
+        """没有运行的任务时，有暂停的任务则显示"继续"按钮"""
+        if self.download_running():
+            return
+        paused = self.job_queue.jobs((PAUSED,))
+        self.pause_button.setText("继续")
+        self.pause_button.setEnabled(True)
+        self.pause_button.setVisible(bool(paused))
+
+    def toggle_pause(self):
+        if self.download_running():
+            self.pause_requested = True
+            self.download_worker.cancel()
+            self.pause_button.setEnabled(False)
+            self.cancel_button.setEnabled(False)
+            self.status_label.setText("Pausing, finished chunks are kept...")
+        else:
+            resumed = self.job_queue.resume()
+            self.status_label.setText(f"Resuming {resumed} jobs...")
+            self.run_next_job()
+
+    def recover_jobs(self):
+        """启动时检查上次没有完成的任务，确认后继续"""
+        interrupted, self.interrupted_jobs = self.interrupted_jobs, []
+        if interrupted:
+            answer = QMessageBox.question(
+                self, "Resume Downloads",
+                f"{len(interrupted)} download jobs were interrupted last time:\n"
+                + "\n".join(f"{job.label} -> {job.output_path}" for job in interrupted)
+                + "\n\nResume them now? Finished regions are skipped.",
+                QMessageBox.Yes | QMessageBox.No, QMessageBox.Yes)
+            if answer == QMessageBox.Yes:
+                for job in interrupted:
+                    self.job_queue.resume(job.id)
+        self.run_next_job()
+
+    def launch_download(self, worker):
+        self.download_worker = worker
         self.download_worker.progress_update.connect(self.update_progress)
         self.download_worker.download_complete.connect(self.on_download_complete)
         self.download_worker.error_occurred.connect(self.on_download_error)
+        self.download_worker.throughput_update.connect(self.update_throughput)
+        self.download_worker.metrics_update.connect(self.update_stats)
+        self.download_worker.finished.connect(self.on_worker_finished)
         self.download_worker.start()
 
         # Show and reset the progress bar
         self.progress_bar.setVisible(True)
+        self.cancel_button.setVisible(True)
+        self.cancel_button.setEnabled(True)
+        self.pause_button.setText("暂停")
+        self.pause_button.setVisible(True)
+        self.pause_button.setEnabled(True)
         self.progress_bar.setValue(0)
         self.status_label.setText("Starting downloads...")
 
@@ -413,15 +913,71 @@ class Mapy(QWidget):
         self.progress_bar.setValue(progress)
         self.status_label.setText(f"Download Progress: {progress}%")
 
+    def update_throughput(self, fraction, tiles_per_second, bytes_per_second):
+        percent = int(fraction * 100)
+        self.progress_bar.setValue(percent)
+        governor = self.governor.snapshot()
+        self.status_label.setText(f"Download Progress: {percent}%  "
+                                  f"{tiles_per_second:.1f} tiles/s  {bytes_per_second / 1024 ** 2:.2f} MB/s  "
+                                  f"concurrency {governor['concurrency']}/{governor['max_concurrency']}")
+
+    def apply_rate_limits(self):
+        """限速预算所有任务共用，修改后正在等待的分块立即按新预算开始"""
+        if self._governor is None:
+            return  # 还没有开始下载，创建时再读取界面上的预算
+        tiles = self.tile_rate_spinbox.value()
+        megabytes = self.bandwidth_spinbox.value()
+        self.governor.set_limits(tiles or None, megabytes * 1024 ** 2 if megabytes else None)
+
+    def update_stats(self, summary):
+        self.stats_label.setText(format_summary(summary))
+
+    def cancel_download(self):
+        """取消当前任务，队列中的下一个任务随后开始"""
+        if self.download_running():
+            self.download_worker.cancel()
+            self.cancel_button.setEnabled(False)
+            self.pause_button.setEnabled(False)
+            self.status_label.setText("Cancelling downloads...")
+
     def on_download_complete(self, message):
         self.progress_bar.setVisible(False)
+        self.cancel_button.setVisible(False)
+        self.pause_button.setVisible(False)
+        if self.pause_requested:
+            self.status_label.setText("Downloads paused, click 继续 to resume.")
+            return
         self.status_label.setText(message)
-        QMessageBox.information(self, "Download Complete", message)
+        summary = self.download_worker.failure_summary if self.download_worker is not None else ""
+        if summary:
+            # 所有失败汇总在一个对话框里，详细信息中列出每个区域的失败原因
+            box = QMessageBox(QMessageBox.Warning, "Download Complete", message, QMessageBox.Ok, self)
+            box.setDetailedText(summary)
+            box.exec_()
+        else:
+            QMessageBox.information(self, "Download Complete", message)
 
     def on_download_error(self, error_message):
+        self.progress_bar.setVisible(False)
+        self.cancel_button.setVisible(False)
+        self.pause_button.setVisible(False)
         QMessageBox.critical(self, "Download Error", error_message)
         self.status_label.setText("Error occurred during downloads.")
 
+    def closeEvent(self, event):
+        if self.download_running():
+            # 当前任务下次启动时恢复，已完成的分块保留
+            self.pause_requested = True
+            self.download_worker.cancel()
+            self.download_worker.wait(5000)
+            if self.current_job is not None:
+                self.job_queue.set_state(self.current_job.id, PAUSED, "interrupted")
+                self.current_job = None
+        if self.tile_server is not None:
+            self.tile_server.stop()
+            self.tile_server = None
+        super().closeEvent(event)
+
     def show_info_dialog(self):
         """显示更多信息对话框"""
         dialog = InfoDialog(self)
@@ -429,6 +985,10 @@ class Mapy(QWidget):
 
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()  # 打包后后处理进程池的子进程从这里启动
+    startup = StartupTimer(STARTUP_ORIGIN)
+    startup.mark("imports")
     app = QApplication(sys.argv)
-    window = Mapy()
+    startup.mark("qapplication")
+    window = Mapy(startup=startup)
     sys.exit(app.exec_())
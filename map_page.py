@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+地图页面 - 生成带矩形绘制工具的folium地图HTML
+导入folium并渲染页面需要较长时间，生成的HTML缓存在用户目录下；打包时预先生成到resources/map_template.html，
+启动时直接读取缓存或预生成的模板，只有地图参数变化后才重新导入folium渲染
+
+用法: python map_page.py --output resources/map_template.html
+"""
+
+import argparse
+import hashlib
+import io
+import os
+
+MAP_LOCATION = [30.2899, 120.1568]
+MAP_ZOOM = 10
+MAP_TILES = 'http://webrd01.is.autonavi.com/appmaptile?lang=zh_cn&size=1&scale=1&style=7&x={x}&y={y}&z={z}'
+MAP_ATTR = 'AutoNavi Map'
+DRAW_OPTIONS = {
+    'polyline': False,
+    'rectangle': {'shapeOptions': {'color': '#f06'}},
+    'circle': False,
+    'marker': False,
+    'polygon': False,
+    'circlemarker': False
+}
+EDIT_OPTIONS = {
+    'edit': True,
+    'remove': True
+}
+# 修改export按钮文字并隐藏Leaflet attribution控件
+CUSTOM_HTML = """
+        <style>
+        /* 隐藏Leaflet attribution控件 */
+        .leaflet-control-attribution {
+            display: none !important;
+        }
+        </style>
+        <script>
+        document.addEventListener('DOMContentLoaded', function() {
+            // 等待页面完全加载后修改按钮文字
+            setTimeout(function() {
+                var exportButton = document.getElementById('export');
+                if (exportButton) {
+                    exportButton.innerHTML = 'download';
+                    exportButton.title = 'download data';
+                }
+            }, 1000);
+        });
+        </script>
+        """
+# 绘制、编辑、删除事件通过QWebChannel直接推送给Python(geometry_bridge.GeometryBridge)
+# qwebchannel.js由程序在加载页面时内联，页面在浏览器中单独打开时不启用
+BRIDGE_HTML = """
+        <script>
+        document.addEventListener('DOMContentLoaded', function() {
+            if (typeof QWebChannel === 'undefined' || typeof qt === 'undefined') {
+                return;
+            }
+            var map = null;
+            for (var name in window) {
+                if (name.indexOf('map_') === 0 && window[name] instanceof L.Map) {
+                    map = window[name];
+                    break;
+                }
+            }
+            if (map === null) {
+                return;
+            }
+            new QWebChannel(qt.webChannelTransport, function(channel) {
+                var bridge = channel.objects.bridge;
+                function ring(layer) {
+                    return layer.toGeoJSON().geometry.coordinates[0];
+                }
+                map.on('draw:created', function(e) {
+                    bridge.shapeCreated(L.stamp(e.layer), ring(e.layer));
+                });
+                map.on('draw:edited', function(e) {
+                    e.layers.eachLayer(function(layer) {
+                        bridge.shapeEdited(L.stamp(layer), ring(layer));
+                    });
+                });
+                map.on('draw:deleted', function(e) {
+                    e.layers.eachLayer(function(layer) {
+                        bridge.shapeDeleted(L.stamp(layer));
+                    });
+                });
+            });
+        });
+        </script>
+        """
+# 模板中的瓦片地址占位符，加载时替换为本地瓦片代理或MAP_TILES，代理端口每次启动可能不同
+TILE_URL_PLACEHOLDER = 'http://basemap.invalid/{z}/{x}/{y}.png'
+TEMPLATE_VERSION = 3  # 修改render_map_html的生成方式时加1，使旧的缓存失效
+
+DEFAULT_CACHE_FILE = os.path.join(os.path.expanduser("~"), ".xiaobai_downloader", "map_template.html")
+BUNDLED_TEMPLATE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "resources", "map_template.html")
+
+
+def template_key():
+    """地图参数的摘要，写在模板末尾，参数变化后旧模板不再使用"""
+    text = repr((TEMPLATE_VERSION, MAP_LOCATION, MAP_ZOOM, TILE_URL_PLACEHOLDER, MAP_ATTR, DRAW_OPTIONS,
+                 EDIT_OPTIONS, CUSTOM_HTML, BRIDGE_HTML))
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:16]
+
+
+def template_marker():
+    return f"<!-- map-template {template_key()} -->"
+
+
+def render_map_html():
+    """用folium渲染地图页面，只在没有可用模板时调用"""
+    import folium
+    from folium.plugins.draw import Draw
+
+    folium_map = folium.Map(location=MAP_LOCATION, zoom_start=MAP_ZOOM, tiles=TILE_URL_PLACEHOLDER, attr=MAP_ATTR)
+    Draw(
+        export=True,
+        filename="data.geojson",
+        position="topleft",
+        draw_options=DRAW_OPTIONS,
+        edit_options=EDIT_OPTIONS
+    ).add_to(folium_map)
+
+    data = io.BytesIO()
+    folium_map.save(data, close_file=False)
+    html_content = data.getvalue().decode()
+    # 在</body>标签前插入自定义样式和脚本
+    html_content = html_content.replace('</body>', CUSTOM_HTML + BRIDGE_HTML + '</body>')
+    return f"{html_content}\n{template_marker()}\n"
+
+
+def read_template(path):
+    """
+    :return:与当前地图参数一致的模板HTML，文件不存在或已过期时返回None
+    """
+    try:
+        with open(path, encoding="utf-8") as f:
+            html_content = f.read()
+    except OSError:
+        return None
+    return html_content if html_content.rstrip().endswith(template_marker()) else None
+
+
+def write_template(path, html_content):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(html_content)
+    os.replace(tmp_path, path)
+    return path
+
+
+def load_map_html(tile_url=None, cache_file=DEFAULT_CACHE_FILE, bundled=BUNDLED_TEMPLATE, head_script=""):
+    """
+    依次使用用户缓存、打包时预生成的模板，都不可用时渲染并写入缓存
+    :param tile_url:底图瓦片地址模板，如本地瓦片代理的地址，默认直接使用MAP_TILES
+    :param head_script:插入到<head>中的脚本内容，如qwebchannel.js
+    :return:(HTML, 来源"cache"/"bundled"/"rendered")
+    """
+    for path, source in ((cache_file, "cache"), (bundled, "bundled")):
+        html_content = read_template(path) if path else None
+        if html_content is not None:
+            break
+    else:
+        html_content, source = render_map_html(), "rendered"
+        if cache_file:
+            try:
+                write_template(cache_file, html_content)
+            except OSError as e:
+                print(f"Failed to cache map template {cache_file}: {e}")
+    html_content = html_content.replace(TILE_URL_PLACEHOLDER, tile_url or MAP_TILES)
+    if head_script:
+        html_content = html_content.replace('</head>', f'<script>{head_script}</script>\n</head>', 1)
+    return html_content, source
+
+
+def main():
+    parser = argparse.ArgumentParser(description="预先生成地图页面模板")
+    parser.add_argument("--output", default=BUNDLED_TEMPLATE, help="模板输出路径")
+    args = parser.parse_args()
+    print(f"Map template written to {write_template(args.output, render_map_html())}")
+
+
+if __name__ == "__main__":
+    main()
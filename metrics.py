@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+下载指标 - 记录每个阶段(GeoJSON读取、坐标转换、变化检测、限速等待、子进程启动、下载、写出、后处理)的耗时区间
+每个区间带有区域序号、范围面积、缩放级别、写出字节数和重试次数，
+运行结束后写出JSON/CSV报告，用于分析耗时分布和对比不同版本的性能
+"""
+
+import csv
+import json
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+STAGES = ("read_geojson", "convert", "detect", "cache", "throttle", "spawn", "download", "write", "postprocess")
+CSV_FIELDS = ("stage", "region", "chunk", "file", "start", "seconds", "items", "bbox_area_km2", "zoom", "tiles",
+              "bytes", "retries", "ok")
+EARTH_RADIUS_KM = 6371.0088
+
+
+def bbox_area_km2(bbox):
+    """
+    bbox在球面上的近似面积
+    :param bbox:(west, south, east, north)，单位为度
+    """
+    west, south, east, north = bbox
+    return (EARTH_RADIUS_KM ** 2 * math.radians(east - west)
+            * abs(math.sin(math.radians(north)) - math.sin(math.radians(south))))
+
+
+def percentile(values, q):
+    """最近秩法求百分位数，values须已排序"""
+    if not values:
+        return 0.0
+    rank = max(int(math.ceil(q / 100.0 * len(values))) - 1, 0)
+    return values[rank]
+
+
+class RunMetrics:
+    """一次运行的所有耗时区间，可以在多个线程中同时记录"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started_at = time.time()
+        self._origin = time.perf_counter()
+        self.spans = []
+
+    def record(self, stage, seconds, start=None, **fields):
+        """
+        直接记录一个区间
+        :param start:相对运行开始的秒数，默认为当前时间减去seconds
+        """
+        if start is None:
+            start = time.perf_counter() - self._origin - seconds
+        span = dict(fields, stage=stage, start=round(start, 6), seconds=round(seconds, 6))
+        with self._lock:
+            self.spans.append(span)
+        return span
+
+    @contextmanager
+    def span(self, stage, **fields):
+        """
+        记录with块的耗时，块内可以向返回的字典补充字段(如bytes、ok)
+        """
+        start = time.perf_counter()
+        span = dict(fields)
+        try:
+            yield span
+        finally:
+            self.record(stage, time.perf_counter() - start, start=start - self._origin, **span)
+
+    def timed_iter(self, iterable, stage, **fields):
+        """
+        包装惰性迭代器，只统计迭代器内部的耗时(不含调用方处理每个元素的时间)，结束时记录为一个区间
+        """
+        iterator = iter(iterable)
+        start = time.perf_counter()
+        seconds = 0.0
+        count = 0
+        try:
+            while True:
+                t = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    seconds += time.perf_counter() - t
+                    return
+                seconds += time.perf_counter() - t
+                count += 1
+                yield item
+        finally:
+            self.record(stage, seconds, start=start - self._origin, items=count, **fields)
+
+    def summary(self):
+        """
+        :return:{"wall_seconds", "bytes", "bytes_per_second", "regions", "stages": {阶段: 统计}}
+        """
+        with self._lock:
+            spans = list(self.spans)
+        wall = time.perf_counter() - self._origin
+        stages = {}
+        for stage in STAGES + tuple(sorted({s["stage"] for s in spans} - set(STAGES))):
+            durations = sorted(s["seconds"] for s in spans if s["stage"] == stage)
+            if not durations:
+                continue
+            total = sum(durations)
+            stages[stage] = {
+                "count": len(durations),
+                "total": round(total, 6),
+                "mean": round(total / len(durations), 6),
+                "p95": percentile(durations, 95),
+                "max": durations[-1],
+            }
+        written = sum(s.get("bytes") or 0 for s in spans if s["stage"] == "download")
+        regions = {s["region"] for s in spans if s["stage"] in ("cache", "download")}
+        return {
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started_at)),
+            "wall_seconds": round(wall, 3),
+            "bytes": written,
+            "bytes_per_second": written / wall if wall > 0 else 0.0,
+            "regions": len(regions),
+            "stages": stages,
+        }
+
+    def write_report(self, directory, basename=None):
+        """
+        写出JSON报告(汇总和全部区间)和CSV报告(每行一个区间)
+        :param basename:默认为download_report_<开始时间>
+        :return:(json路径, csv路径)
+        """
+        if basename is None:
+            basename = "download_report_" + time.strftime("%Y%m%d_%H%M%S", time.localtime(self.started_at))
+        with self._lock:
+            spans = sorted(self.spans, key=lambda s: s["start"])
+        json_path = os.path.join(directory, basename + ".json")
+        csv_path = os.path.join(directory, basename + ".csv")
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump({"summary": self.summary(), "spans": spans}, f, ensure_ascii=False, indent=2)
+        with open(csv_path, "w", encoding="utf-8", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=CSV_FIELDS, extrasaction="ignore")
+            writer.writeheader()
+            writer.writerows(spans)
+        return json_path, csv_path
+
+
+def format_summary(summary):
+    """把summary()的结果格式化为多行文本"""
+    lines = [f"{summary['regions']} regions, {summary['wall_seconds']:.1f}s wall, "
+             f"{summary['bytes'] / 1024 ** 2:.1f} MB ({summary['bytes_per_second'] / 1024 ** 2:.2f} MB/s)"]
+    for stage, s in summary["stages"].items():
+        lines.append(f"{stage:<13}{s['count']:>6}  total {s['total']:>8.2f}s  "
+                     f"mean {s['mean']:>7.3f}s  p95 {s['p95']:>7.3f}s  max {s['max']:>7.3f}s")
+    return "\n".join(lines)
+
+
+class StartupTimer:
+    """
+    程序启动过程的计时，记录从起点到每个里程碑(导入完成、窗口创建、首次绘制、地图加载完成)的耗时
+    :param origin:起点，time.perf_counter()的值，默认为创建时刻
+    """
+
+    def __init__(self, origin=None):
+        self.started_at = time.time()
+        self.origin = time.perf_counter() if origin is None else origin
+        self.marks = []  # [(里程碑, 距起点的秒数)]
+
+    def mark(self, name):
+        seconds = time.perf_counter() - self.origin
+        self.marks.append((name, seconds))
+        return seconds
+
+    def format(self):
+        lines = []
+        previous = 0.0
+        for name, seconds in self.marks:
+            lines.append(f"{name:<24}{seconds * 1000:>9.1f} ms  (+{(seconds - previous) * 1000:.1f} ms)")
+            previous = seconds
+        return "\n".join(lines)
+
+    def write(self, path):
+        """写出JSON格式的启动报告，只保留最近一次"""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"started_at": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.started_at)),
+                       "marks": [{"name": name, "seconds": round(seconds, 6)} for name, seconds in self.marks]},
+                      f, ensure_ascii=False, indent=2)
+        return path
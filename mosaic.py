@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+影像拼接 - 把分块或多个区域的GeoTIFF合并成一个带内部金字塔的Cloud-Optimized GeoTIFF
+先用VRT虚拟拼接，再由GDAL按块读写，不会把整幅影像读入内存
+"""
+
+import os
+
+from footprint import footprint_geojson
+from gdal_runtime import load_gdal
+
+DEFAULT_COMPRESS = "DEFLATE"
+DEFAULT_BLOCKSIZE = 512
+GDAL_CACHE_BYTES = 256 * 1024 * 1024  # 限制GDAL块缓存，内存占用与影像大小无关
+
+
+def require_gdal():
+    gdal = load_gdal()
+    if gdal is None:
+        raise RuntimeError("GDAL Python bindings are required to merge GeoTIFF files")
+    return gdal
+
+
+def cog_creation_options(compress=DEFAULT_COMPRESS, blocksize=DEFAULT_BLOCKSIZE, threads="ALL_CPUS"):
+    options = [f"COMPRESS={compress}", f"BLOCKSIZE={blocksize}", "OVERVIEWS=AUTO",
+               "BIGTIFF=IF_SAFER", f"NUM_THREADS={threads}"]
+    if compress in ("DEFLATE", "LZW", "ZSTD"):
+        options.append("PREDICTOR=YES")
+    return options
+
+
+def build_cog(sources, output_file, compress=DEFAULT_COMPRESS, blocksize=DEFAULT_BLOCKSIZE, cutline=None,
+              bounds=None, dst_srs=None, threads="ALL_CPUS"):
+    """
+    把多个GeoTIFF拼接为一个COG
+    :param sources:输入GeoTIFF路径列表，可以包含output_file本身，都必须存在
+    :param output_file:输出路径，先写临时文件，成功后再替换
+    :param compress:DEFLATE/LZW/ZSTD/JPEG/WEBP
+    :param blocksize:内部分块大小(像素)
+    :param cutline:可选的WGS84坐标环，多边形外的像素置为透明(增加alpha波段)
+    :param bounds:可选的WGS84范围(west, south, east, north)，输出裁剪到该范围
+    :param dst_srs:可选的目标坐标系(如"EPSG:3857")，输出重投影到该坐标系
+    :param threads:GDAL压缩使用的线程数，在进程池中运行时为1，避免与其他进程争抢CPU
+    """
+    if not sources:
+        raise ValueError("No GeoTIFF files to merge")
+    # 缺少任何一个源文件都会在拼接结果中留下空洞，不能当作成功
+    missing = [path for path in sources if not os.path.exists(path)]
+    if missing:
+        raise FileNotFoundError(f"{len(missing)} of {len(sources)} GeoTIFF files to merge are missing, "
+                                f"e.g. {missing[0]}")
+    gdal = require_gdal()
+    gdal.SetCacheMax(GDAL_CACHE_BYTES)
+
+    vrt_path = f"/vsimem/{os.path.basename(output_file)}.vrt"
+    cut_path = f"/vsimem/{os.path.basename(output_file)}.cutline.geojson"
+    warped_path = f"/vsimem/{os.path.basename(output_file)}.cut.vrt"
+    tmp_path = output_file + ".tmp.tif"
+    vrt = gdal.BuildVRT(vrt_path, sources)
+    source = vrt
+    try:
+        if cutline is not None or bounds is not None or dst_srs is not None:
+            # 用虚拟的Warp VRT裁剪或重投影，仍然按块处理
+            options = {"format": "VRT"}
+            if cutline is not None:
+                gdal.FileFromMemBuffer(cut_path, footprint_geojson(cutline))
+                options.update(cutlineDSName=cut_path, dstAlpha=True)
+            if bounds is not None:
+                options.update(outputBounds=bounds, outputBoundsSRS="EPSG:4326")
+            if dst_srs is not None:
+                options.update(dstSRS=dst_srs, resampleAlg="bilinear")
+            source = gdal.Warp(warped_path, vrt, **options)
+        if gdal.GetDriverByName("COG") is not None:
+            gdal.Translate(tmp_path, source, format="COG",
+                           creationOptions=cog_creation_options(compress, blocksize, threads))
+        else:
+            # GDAL 3.1以前没有COG驱动，退化为分块GeoTIFF并补建金字塔
+            options = [f"COMPRESS={compress}", "TILED=YES", f"BLOCKXSIZE={blocksize}",
+                       f"BLOCKYSIZE={blocksize}", "BIGTIFF=IF_SAFER", f"NUM_THREADS={threads}"]
+            dataset = gdal.Translate(tmp_path, source, format="GTiff", creationOptions=options)
+            dataset.BuildOverviews("AVERAGE", [2, 4, 8, 16, 32])
+            dataset = None
+    except Exception:
+        # 写到一半失败的临时文件不再保留
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    finally:
+        source = vrt = None
+        gdal.Unlink(vrt_path)
+        if cutline is not None:
+            gdal.Unlink(cut_path)
+        if cutline is not None or bounds is not None or dst_srs is not None:
+            gdal.Unlink(warped_path)
+    os.replace(tmp_path, output_file)
+    return output_file
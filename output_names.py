@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+输出文件名分配 - 只扫描一次输出目录，之后每次分配都是常数时间
+每个名字通过独占创建的隐藏占位文件预留，多个程序实例写同一目录(如共享NAS)时不会分到相同的名字
+"""
+
+import glob
+import os
+import re
+import threading
+
+DEFAULT_PREFIX = "historical_img_"
+
+
+class OutputNameAllocator:
+    """按序号分配historical_img_N形式的输出名"""
+
+    def __init__(self, directory, prefix=DEFAULT_PREFIX):
+        self.directory = directory
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._holders = {}  # 名字 -> 尚未结束的使用者数量，时间序列的各日期共用一个名字
+        # 占位文件为".historical_img_N.reserved"，分块目录为"historical_img_N_parts"，都算作已使用
+        pattern = re.compile(r"^\.?" + re.escape(prefix) + r"(\d+)")
+        used = [int(m.group(1)) for m in (pattern.match(entry.name) for entry in os.scandir(directory)) if m]
+        self.next_index = max(used) + 1 if used else 0
+
+    def reservation_path(self, name):
+        return os.path.join(self.directory, f".{name}.reserved")
+
+    def _taken(self, name):
+        path = os.path.join(self.directory, name)
+        # 时间序列的输出为"historical_img_N_日期.tif"
+        return (os.path.exists(f"{path}.tif") or os.path.exists(f"{path}_parts")
+                or bool(glob.glob(f"{glob.escape(path)}_*.tif")))
+
+    def _remove_reservation(self, name):
+        try:
+            os.remove(self.reservation_path(name))
+        except OSError:
+            pass
+
+    def allocate(self):
+        """
+        分配一个未使用的名字并创建占位文件
+        :return:不带扩展名的名字，如"historical_img_12"
+        """
+        with self._lock:
+            while True:
+                name = f"{self.prefix}{self.next_index}"
+                self.next_index += 1
+                try:
+                    fd = os.open(self.reservation_path(name), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                except FileExistsError:
+                    continue  # 其他实例已经预留
+                os.close(fd)
+                if self._taken(name):
+                    # 扫描之后才被其他实例写出的文件
+                    self._remove_reservation(name)
+                    continue
+                self._holders[name] = 1
+                return name
+
+    def retain(self, name):
+        """
+        再登记一个使用已分配名字的区域(时间序列的其他日期)，每次retain都要对应一次release
+        :param name:allocate返回的名字
+        """
+        with self._lock:
+            count = self._holders.get(name, 0)
+            if count == 0:
+                # 之前的日期都已结束，重新创建占位文件
+                os.close(os.open(self.reservation_path(name), os.O_CREAT | os.O_WRONLY))
+            self._holders[name] = count + 1
+
+    def release(self, name):
+        """区域结束后释放名字，最后一个使用者释放时才删除占位文件"""
+        with self._lock:
+            count = self._holders.pop(name, 1) - 1
+            if count > 0:
+                self._holders[name] = count
+                return
+            self._remove_reservation(name)
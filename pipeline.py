@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+下载流水线 - GeoJSON解析、坐标转换、区域规划、下载和后处理分别在各自的线程中运行，阶段之间用有界队列连接
+第一个区域可以在后面的feature还在解析时就开始下载；队列有界，下游跟不上时上游阻塞，不会把整个文件读入内存
+任一阶段出错时异常传递到下游的迭代处，关闭下游阶段时上游阶段一并停止
+"""
+
+import queue
+import threading
+
+from coord_convert import rings_gcj02_to_wgs84
+from metrics import RunMetrics
+
+DEFAULT_QUEUE_SIZE = 64  # 每个阶段输出队列的容量
+CONVERT_BATCH = 256  # 坐标转换每批最多的坐标环数
+POLL_INTERVAL = 0.1  # 阻塞的队列操作检查关闭标志的间隔(秒)
+
+
+class _End:
+    pass
+
+
+class _Failure:
+    def __init__(self, error):
+        self.error = error
+
+
+_END = _End()
+
+
+class ThreadedStage:
+    """
+    在后台线程中迭代source，把产出的元素放入有界队列；本身也是可迭代对象，可以作为下一阶段的source
+    :param name:阶段名，用于线程名
+    :param source:可迭代对象，在阶段线程中迭代
+    :param maxsize:输出队列容量
+    """
+
+    def __init__(self, name, source, maxsize=DEFAULT_QUEUE_SIZE):
+        self.name = name
+        self.source = source
+        self._queue = queue.Queue(maxsize)
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._produce, name=f"pipeline-{name}", daemon=True)
+        self._thread.start()
+
+    def _produce(self):
+        try:
+            for item in self.source:
+                if not self._put(item):
+                    return
+        except BaseException as e:
+            self._put(_Failure(e))
+            return
+        self._put(_END)
+
+    def _put(self, item):
+        """:return:阶段已关闭时返回False"""
+        while not self._closed.is_set():
+            try:
+                self._queue.put(item, timeout=POLL_INTERVAL)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self):
+        while True:
+            try:
+                return self._queue.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                if self._closed.is_set():
+                    return _END
+
+    def _unwrap(self, item):
+        if isinstance(item, _Failure):
+            raise item.error
+        return item
+
+    def __iter__(self):
+        while True:
+            item = self._get()
+            if item is _END:
+                return
+            yield self._unwrap(item)
+
+    def batches(self, max_items):
+        """
+        按批取出元素：阻塞等待第一个，之后只取已经在队列中的，每批最多max_items个
+        上游慢时每批只有一个元素，不会为了凑满一批而延迟第一个区域
+        """
+        while True:
+            item = self._get()
+            if item is _END:
+                return
+            batch = [self._unwrap(item)]
+            while len(batch) < max_items:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _END or isinstance(item, _Failure):
+                    # 先交出已经取到的元素，再结束或抛出上游的异常
+                    yield batch
+                    self._unwrap(item)
+                    return
+                batch.append(item)
+            yield batch
+
+    def close(self):
+        """停止本阶段和上游阶段，丢弃尚未取出的元素"""
+        self._closed.set()
+        if isinstance(self.source, ThreadedStage):
+            self.source.close()
+        self._thread.join(timeout=POLL_INTERVAL * 10)
+
+
+def convert_rings(stage, mode, metrics=None, batch_size=CONVERT_BATCH):
+    """
+    把上游阶段产出的GCJ02坐标环按批转换为WGS84，每批记录一个convert区间
+    :param stage:ThreadedStage
+    """
+    if metrics is None:
+        metrics = RunMetrics()
+    for rings in stage.batches(batch_size):
+        with metrics.span("convert", items=sum(len(ring) for ring in rings)):
+            converted = rings_gcj02_to_wgs84(rings, mode)
+        for ring in converted:
+            yield ring
+
+
+class ResultStage:
+    """
+    流水线的最后一级：在单独的线程中依次处理下载结果，不占用调度线程
+    :param handler:handler(result, done, total)
+    """
+
+    def __init__(self, handler, maxsize=DEFAULT_QUEUE_SIZE):
+        self.handler = handler
+        self._queue = queue.Queue(maxsize)
+        self._thread = threading.Thread(target=self._consume, name="pipeline-results", daemon=True)
+        self._thread.start()
+
+    def _consume(self):
+        while True:
+            item = self._queue.get()
+            if item is _END:
+                return
+            try:
+                self.handler(*item)
+            except Exception as e:
+                print(f"Failed to process result: {e}")
+
+    def submit(self, result, done, total):
+        """与DownloadScheduler.run的on_result签名相同；队列满时阻塞，形成背压"""
+        self._queue.put((result, done, total))
+
+    def close(self):
+        """处理完已提交的结果后结束"""
+        self._queue.put(_END)
+        self._thread.join()
@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+输出后处理 - 区域下载完成后，为historical_img_N.tif建立金字塔、重投影、重新压缩并写出元数据文件
+GDAL的重采样和压缩是CPU密集的，放在进程池中与后面区域的下载同时进行，批量下载结束时没有串行的尾巴
+子进程各自通过gdal_runtime加载随程序分发的GDAL
+"""
+
+import json
+import multiprocessing
+import os
+import threading
+import time
+
+from gdal_runtime import load_gdal
+from mosaic import build_cog, DEFAULT_BLOCKSIZE
+
+DEFAULT_POST_WORKERS = max(1, (os.cpu_count() or 2) - 1)  # 留一个核给下载和界面
+MIN_OVERVIEW_SIZE = 256  # 最小一级金字塔的边长(像素)
+SIDECAR_SUFFIX = ".json"
+
+
+class PostProcessOptions:
+    """
+    后处理选项，需要能被pickle传给子进程
+    :param overviews:建立内部金字塔
+    :param target_srs:重投影的目标坐标系(如"EPSG:3857")，为None时保持原坐标系
+    :param compress:重新压缩的方式(COMPRESS_CHOICES)，为None时保持原压缩；重写文件时输出为COG，总是带金字塔
+    :param sidecar:写出<输出文件>.json元数据
+    """
+
+    def __init__(self, overviews=True, target_srs=None, compress=None, sidecar=True, blocksize=DEFAULT_BLOCKSIZE):
+        self.overviews = overviews
+        self.target_srs = target_srs
+        self.compress = compress
+        self.sidecar = sidecar
+        self.blocksize = blocksize
+
+    @property
+    def enabled(self):
+        return bool(self.overviews or self.rewrites or self.sidecar)
+
+    @property
+    def rewrites(self):
+        """是否需要重写整个文件(重投影或重新压缩)"""
+        return bool(self.target_srs or self.compress)
+
+    def describe(self):
+        """:return:写入元数据文件的选项说明"""
+        return {"overviews": bool(self.overviews or self.rewrites), "target_srs": self.target_srs,
+                "compress": self.compress}
+
+
+def overview_levels(width, height, min_size=MIN_OVERVIEW_SIZE):
+    """:return:金字塔级别[2, 4, ...]，直到最小边不足min_size"""
+    levels = []
+    factor = 2
+    while min(width, height) // factor >= min_size:
+        levels.append(factor)
+        factor *= 2
+    return levels
+
+
+def raster_metadata(gdal, path):
+    """
+    :return:影像的尺寸、坐标系、范围、分辨率、压缩方式和金字塔级数
+    """
+    dataset = gdal.Open(path)
+    try:
+        x0, dx, _, y0, _, dy = dataset.GetGeoTransform()
+        width, height = dataset.RasterXSize, dataset.RasterYSize
+        srs = dataset.GetSpatialRef()
+        crs = None
+        if srs is not None:
+            authority = srs.GetAuthorityName(None)
+            code = srs.GetAuthorityCode(None)
+            crs = f"{authority}:{code}" if authority and code else srs.ExportToWkt()
+        band = dataset.GetRasterBand(1)
+        return {
+            "file": os.path.basename(path),
+            "bytes": os.path.getsize(path),
+            "width": width,
+            "height": height,
+            "bands": dataset.RasterCount,
+            "crs": crs,
+            "bounds": [x0, y0 + dy * height, x0 + dx * width, y0],
+            "resolution": [dx, -dy],
+            "compression": dataset.GetMetadataItem("COMPRESSION", "IMAGE_STRUCTURE"),
+            "overviews": band.GetOverviewCount(),
+        }
+    finally:
+        dataset = None
+
+
+def write_sidecar(path, info):
+    sidecar = path + SIDECAR_SUFFIX
+    tmp_path = sidecar + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(info, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, sidecar)
+    return sidecar
+
+
+def process_output(path, options, metadata=None):
+    """
+    在子进程中处理一个输出文件，原文件被处理后的文件替换
+    :param options:PostProcessOptions
+    :param metadata:写入元数据文件的额外字段(区域、日期、缩放级别等)
+    :return:{"path", "seconds", "bytes", "sidecar"}
+    """
+    start = time.perf_counter()
+    gdal = load_gdal()
+    if gdal is None:
+        raise RuntimeError("GDAL Python bindings are required to post-process outputs")
+    if options.rewrites:
+        # 重投影和压缩一次完成，COG驱动同时建立金字塔
+        build_cog([path], path, compress=options.compress or "DEFLATE", blocksize=options.blocksize,
+                  dst_srs=options.target_srs, threads=1)
+    elif options.overviews:
+        dataset = gdal.Open(path, gdal.GA_Update)
+        try:
+            levels = overview_levels(dataset.RasterXSize, dataset.RasterYSize)
+            if levels and dataset.GetRasterBand(1).GetOverviewCount() == 0:
+                dataset.BuildOverviews("AVERAGE", levels)
+        finally:
+            dataset = None
+    sidecar = None
+    if options.sidecar:
+        info = raster_metadata(gdal, path)
+        info.update(metadata or {})
+        info["postprocess"] = options.describe()
+        info["processed_at"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+        sidecar = write_sidecar(path, info)
+    return {"path": path, "seconds": time.perf_counter() - start, "bytes": os.path.getsize(path),
+            "sidecar": sidecar}
+
+
+def create_pool(max_workers):
+    """
+    用spawn方式创建进程池：下载线程同时在启动GEHistoricalImagery子进程，
+    fork出的进程会继承正在创建的子进程的管道，使subprocess一直等待
+    """
+    from concurrent.futures import ProcessPoolExecutor  # 只在启用后处理时导入，不拖慢界面启动
+    try:
+        return ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn"))
+    except TypeError:
+        # Python 3.6没有mp_context参数
+        return ProcessPoolExecutor(max_workers=max_workers)
+
+
+class PostProcessor:
+    """
+    把下载完成的输出提交到进程池处理，进程池在第一次提交时创建
+    :param options:PostProcessOptions
+    :param max_workers:进程数
+    :param metrics:RunMetrics，每个文件记录一个postprocess区间
+    """
+
+    def __init__(self, options, max_workers=DEFAULT_POST_WORKERS, metrics=None):
+        self.options = options
+        self.max_workers = max_workers
+        self.metrics = metrics
+        self.failures = []  # [(文件, 错误信息)]
+        self.processed = 0
+        self._executor = None
+        self._futures = []
+        self._lock = threading.Lock()
+
+    def submit(self, path, metadata=None):
+        """
+        :param metadata:写入元数据文件的额外字段
+        """
+        if not os.path.exists(path):
+            return None
+        if self._executor is None:
+            self._executor = create_pool(self.max_workers)
+        future = self._executor.submit(process_output, path, self.options, metadata)
+        future.add_done_callback(lambda f: self._finished(path, f))
+        with self._lock:
+            self._futures.append(future)
+        return future
+
+    def _finished(self, path, future):
+        if future.cancelled():
+            return
+        try:
+            result = future.result()
+        except Exception as e:
+            print(f"Post-processing failed for {path}: {e}")
+            with self._lock:
+                self.failures.append((path, str(e)))
+            return
+        with self._lock:
+            self.processed += 1
+        print(f"Post-processed {path} in {result['seconds']:.1f}s")
+        if self.metrics is not None:
+            # 只计子进程内的处理时间，不含在进程池中排队的时间
+            self.metrics.record("postprocess", result["seconds"], file=os.path.basename(path),
+                                bytes=result["bytes"], ok=True)
+
+    def wait(self):
+        """
+        等待已提交的文件处理完并关闭进程池
+        :return:失败列表[(文件, 错误信息)]
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        return list(self.failures)
+
+    def cancel(self):
+        """丢弃尚未开始的文件，正在处理的文件在后台处理完"""
+        with self._lock:
+            futures, self._futures = self._futures, []
+        for future in futures:
+            future.cancel()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
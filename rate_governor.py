@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+下载限速 - 所有并发子进程共用一个瓦片/秒和字节/秒的预算，并按失败率自动调整并发数
+GEHistoricalImagery在子进程内自行下载，无法逐个请求限速；每个分块开始前按瓦片数预先扣除令牌，
+预算透支时后面的分块等待令牌恢复，长期平均速率不超过预算。
+字节数在开始时按此前的平均瓦片大小预估，结束时按实际写出的大小修正
+并发数按AIMD调整：最近的分块中临时性失败(超时、限流)的比例超过阈值时减半，连续成功后逐个恢复
+"""
+
+import threading
+import time
+from collections import deque
+
+from defaults import DEFAULT_MAX_WORKERS
+from retry_policy import CANCELLED, TRANSIENT
+
+BURST_SECONDS = 2.0  # 令牌桶容量，相当于几秒的预算
+POLL_INTERVAL = 0.1  # 等待令牌时检查取消的间隔(秒)
+ERROR_WINDOW = 20  # 计算失败率的最近分块数
+ERROR_THRESHOLD = 0.2  # 失败率超过该值时减少并发
+BACKOFF_COOLDOWN = 5.0  # 两次减少并发之间至少间隔的秒数，同时失败的分块只减一次
+
+
+class TokenBucket:
+    """
+    令牌桶，允许透支：余额为负时需要等待恢复到0，
+    一个大分块不会因为超过桶容量而永远无法开始
+    不加锁，由RateGovernor的锁保护
+    :param rate:每秒恢复的令牌数，为None时不限
+    """
+
+    def __init__(self, rate=None, burst_seconds=BURST_SECONDS):
+        self.burst_seconds = burst_seconds
+        self.rate = None
+        self.level = 0.0
+        self._updated = time.monotonic()
+        self.set_rate(rate)
+
+    @property
+    def capacity(self):
+        return self.rate * self.burst_seconds if self.rate else 0.0
+
+    def _refill(self):
+        now = time.monotonic()
+        if self.rate:
+            self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def set_rate(self, rate):
+        """调整速率，已有的透支按新速率恢复"""
+        self._refill()
+        self.rate = float(rate) if rate else None
+        self.level = min(self.level, self.capacity) if self.rate else 0.0
+
+    def charge(self, amount):
+        """扣除令牌(可以为负数，表示退还)"""
+        if self.rate:
+            self._refill()
+            self.level = min(self.capacity, self.level - amount)
+
+    def wait_time(self):
+        """:return:余额恢复到0还需等待的秒数"""
+        if not self.rate:
+            return 0.0
+        self._refill()
+        return max(0.0, -self.level / self.rate)
+
+
+class GovernorPermit:
+    """一次acquire得到的许可，下载结束后交还给release"""
+
+    def __init__(self, tiles, reserved_bytes, waited):
+        self.tiles = tiles
+        self.reserved_bytes = reserved_bytes
+        self.waited = waited  # 等待并发名额和令牌的秒数
+
+
+class RateGovernor:
+    """
+    多个下载线程共用的限速器，可以在运行中用set_limits调整预算
+    :param tiles_per_second:瓦片/秒预算，为None时不限
+    :param bytes_per_second:字节/秒预算，为None时不限
+    :param max_concurrency:并发数上限，调度器开始运行时用set_max_concurrency设为它的并发数
+    """
+
+    def __init__(self, tiles_per_second=None, bytes_per_second=None, max_concurrency=DEFAULT_MAX_WORKERS,
+                 min_concurrency=1, error_threshold=ERROR_THRESHOLD):
+        self._cond = threading.Condition()
+        self._tiles = TokenBucket(tiles_per_second)
+        self._bytes = TokenBucket(bytes_per_second)
+        self.min_concurrency = max(1, int(min_concurrency))
+        self.max_concurrency = max(self.min_concurrency, int(max_concurrency))
+        self.concurrency = self.max_concurrency  # 当前允许的并发数
+        self.error_threshold = error_threshold
+        self.in_flight = 0
+        self.bytes_per_tile = None  # 已完成分块的平均瓦片大小，用于预估字节数
+        self._tiles_seen = 0
+        self._bytes_seen = 0
+        self._outcomes = deque(maxlen=ERROR_WINDOW)  # 最近的分块是否临时性失败
+        self._successes = 0  # 上次调整后连续成功的分块数
+        self._last_backoff = 0.0
+
+    @property
+    def tiles_per_second(self):
+        return self._tiles.rate
+
+    @property
+    def bytes_per_second(self):
+        return self._bytes.rate
+
+    def set_limits(self, tiles_per_second=None, bytes_per_second=None):
+        """调整预算，正在等待的分块按新预算重新计算等待时间"""
+        with self._cond:
+            self._tiles.set_rate(tiles_per_second)
+            self._bytes.set_rate(bytes_per_second)
+            self._cond.notify_all()
+
+    def set_max_concurrency(self, max_concurrency):
+        """设置并发数上限，当前并发数从上限开始"""
+        with self._cond:
+            self.max_concurrency = max(self.min_concurrency, int(max_concurrency))
+            self.concurrency = self.max_concurrency
+            self._successes = 0
+            self._outcomes.clear()
+            self._cond.notify_all()
+
+    def error_rate(self):
+        with self._cond:
+            return self._error_rate()
+
+    def _error_rate(self):
+        return sum(self._outcomes) / len(self._outcomes) if self._outcomes else 0.0
+
+    def acquire(self, tiles, cancel_event=None):
+        """
+        等待并发名额和预算，然后预先扣除tiles个瓦片和预估的字节数
+        :param cancel_event:threading.Event，被设置时停止等待
+        :return:GovernorPermit，等待期间被取消时返回None
+        """
+        start = time.monotonic()
+        with self._cond:
+            while True:
+                if cancel_event is not None and cancel_event.is_set():
+                    return None
+                if self.in_flight < self.concurrency:
+                    wait = max(self._tiles.wait_time(), self._bytes.wait_time())
+                    if wait <= 0:
+                        break
+                else:
+                    wait = POLL_INTERVAL
+                self._cond.wait(min(wait, POLL_INTERVAL))
+            self.in_flight += 1
+            reserved = tiles * self.bytes_per_tile if self.bytes_per_tile else 0
+            self._tiles.charge(tiles)
+            self._bytes.charge(reserved)
+        return GovernorPermit(tiles, reserved, time.monotonic() - start)
+
+    def release(self, permit, failure_kind=None, bytes_written=0):
+        """
+        分块结束，按实际写出的字节数修正预估，并根据结果调整并发数
+        :param failure_kind:retry_policy中的失败类型，成功时为None
+        """
+        with self._cond:
+            self.in_flight -= 1
+            self._bytes.charge(bytes_written - permit.reserved_bytes)
+            if failure_kind is None and bytes_written:
+                self._tiles_seen += permit.tiles
+                self._bytes_seen += bytes_written
+                self.bytes_per_tile = self._bytes_seen / max(self._tiles_seen, 1)
+            # 永久性失败(参数错误、没有影像)与负载无关，不计入失败率
+            if failure_kind is None or failure_kind == TRANSIENT:
+                self._outcomes.append(failure_kind == TRANSIENT)
+            if failure_kind == TRANSIENT:
+                self._backoff()
+            elif failure_kind is None:
+                self._successes += 1
+                if (self._successes >= self.concurrency and self.concurrency < self.max_concurrency
+                        and self._error_rate() < self.error_threshold):
+                    self.concurrency += 1
+                    self._successes = 0
+                    print(f"Download concurrency raised to {self.concurrency}")
+            elif failure_kind != CANCELLED:
+                self._successes = 0
+            self._cond.notify_all()
+
+    def _backoff(self):
+        self._successes = 0
+        now = time.monotonic()
+        error_rate = self._error_rate()
+        if (error_rate < self.error_threshold or self.concurrency <= self.min_concurrency
+                or now - self._last_backoff < BACKOFF_COOLDOWN):
+            return
+        self._last_backoff = now
+        self.concurrency = max(self.min_concurrency, self.concurrency // 2)
+        print(f"Error rate {error_rate:.0%}, download concurrency reduced to {self.concurrency}")
+
+    def snapshot(self):
+        """
+        :return:{"concurrency", "max_concurrency", "in_flight", "tiles_per_second", "bytes_per_second", "error_rate"}
+        """
+        with self._cond:
+            return {"concurrency": self.concurrency, "max_concurrency": self.max_concurrency,
+                    "in_flight": self.in_flight,
+                    "tiles_per_second": self._tiles.rate, "bytes_per_second": self._bytes.rate,
+                    "error_rate": self._error_rate()}
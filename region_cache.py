@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+区域下载结果缓存 - 按量化后的范围、缩放级别、日期和数据源索引已完成的输出
+索引保存在SQLite中，按文件大小做LRU淘汰；多个程序实例可以共用同一个缓存目录
+"""
+
+import hashlib
+import os
+import shutil
+import sqlite3
+import threading
+import time
+
+from gdal_runtime import load_gdal
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".xiaobai_downloader", "cache")
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3  # 2GB
+BBOX_SCALE = 10 ** 6  # 范围量化到1e-6度(约0.1米)
+
+
+def quantize_bbox(bbox):
+    """
+    :param bbox:(west, south, east, north)，单位为度
+    :return:量化后的整数元组
+    """
+    return tuple(int(round(v * BBOX_SCALE)) for v in bbox)
+
+
+def cache_key(bbox, zoom, date, provider):
+    west, south, east, north = quantize_bbox(bbox)
+    return f"{provider}/{zoom}/{date}/{west},{south},{east},{north}"
+
+
+class RegionCache:
+    """磁盘缓存，缓存文件与index.sqlite保存在同一目录"""
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                " key TEXT PRIMARY KEY, provider TEXT, zoom INTEGER, date TEXT,"
+                " west INTEGER, south INTEGER, east INTEGER, north INTEGER,"
+                " path TEXT, size INTEGER, last_used REAL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS entries_lookup ON entries (provider, zoom, date)")
+
+    def _connect(self):
+        return sqlite3.connect(os.path.join(self.cache_dir, "index.sqlite"), timeout=30)
+
+    def lookup(self, bbox, zoom, date, provider):
+        """
+        查找完全相同或完全覆盖bbox的缓存项
+        :return:(缓存文件路径, 是否完全相同)，未命中返回(None, False)
+        """
+        west, south, east, north = quantize_bbox(bbox)
+        with self._lock, self._connect() as conn:
+            row = conn.execute(
+                "SELECT key, path FROM entries WHERE key = ?", (cache_key(bbox, zoom, date, provider),)
+            ).fetchone()
+            exact = row is not None
+            if row is None:
+                # 覆盖范围的缓存项中取面积最小的一个
+                row = conn.execute(
+                    "SELECT key, path FROM entries WHERE provider = ? AND zoom = ? AND date = ?"
+                    " AND west <= ? AND south <= ? AND east >= ? AND north >= ?"
+                    " ORDER BY (east - west) * (north - south) LIMIT 1",
+                    (provider, zoom, date, west, south, east, north)
+                ).fetchone()
+            if row is None:
+                return None, False
+            key, path = row
+            path = os.path.join(self.cache_dir, path)
+            if not os.path.exists(path):
+                conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                return None, False
+            conn.execute("UPDATE entries SET last_used = ? WHERE key = ?", (time.time(), key))
+            return path, exact
+
+    def fetch(self, bbox, zoom, date, provider, output_file):
+        """
+        命中时把缓存结果写到output_file
+        完全覆盖但范围不同的缓存项需要GDAL裁剪，GDAL不可用时视为未命中
+        :return:是否命中
+        """
+        path, exact = self.lookup(bbox, zoom, date, provider)
+        if path is None:
+            return False
+        if exact:
+            shutil.copyfile(path, output_file)
+            return True
+
+        gdal = load_gdal()
+        if gdal is None:
+            return False
+        west, south, east, north = bbox
+        try:
+            gdal.Translate(output_file, path, projWin=[west, north, east, south], projWinSRS="EPSG:4326")
+        except RuntimeError as e:
+            print(f"Failed to crop cached image {path}: {e}")
+            return False
+        return True
+
+    def store(self, bbox, zoom, date, provider, source_file):
+        """把下载完成的文件复制到缓存目录并登记，随后按LRU淘汰超出容量的缓存项"""
+        key = cache_key(bbox, zoom, date, provider)
+        west, south, east, north = quantize_bbox(bbox)
+        name = hashlib.sha1(key.encode("utf-8")).hexdigest() + os.path.splitext(source_file)[1]
+        tmp_path = os.path.join(self.cache_dir, name + ".tmp")
+        shutil.copyfile(source_file, tmp_path)
+        os.replace(tmp_path, os.path.join(self.cache_dir, name))
+        size = os.path.getsize(os.path.join(self.cache_dir, name))
+
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, provider, zoom, date, west, south, east, north, name, size, time.time())
+            )
+            self._evict(conn)
+
+    def _evict(self, conn):
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, path, size in conn.execute(
+                "SELECT key, path, size FROM entries ORDER BY last_used").fetchall():
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.cache_dir, path))
+            except OSError:
+                pass
+            conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            total -= size
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+重试策略 - 把下载失败分为临时性(超时、网络)和永久性(参数错误、没有影像)两类
+临时性失败按带抖动的指数退避重试，超时时间随分块的瓦片数调整；永久性失败不重试
+所有失败最后汇总为一份报告，不再逐个弹窗
+"""
+
+import random
+import re
+import threading
+
+TRANSIENT = "transient"
+PERMANENT = "permanent"
+CANCELLED = "cancelled"
+
+DEFAULT_MAX_ATTEMPTS = 3
+DEFAULT_BASE_DELAY = 2.0  # 第一次重试前的平均等待(秒)
+DEFAULT_MAX_DELAY = 60.0
+DEFAULT_TIMEOUT_PER_TILE = 0.2  # 每个瓦片增加的超时时间(秒)
+DEFAULT_MAX_TIMEOUT = 1800
+TIMEOUT_GROWTH = 1.5  # 每次超时后下一次尝试的超时时间倍数
+
+# 明确的网络错误优先判为临时性，即使输出中同时出现"invalid response"之类的字样
+_TRANSIENT_PATTERN = re.compile(
+    r"time(d)? ?out|connection|network|socket|reset by peer|unreachable|temporar|resolve|dns|ssl|tls|"
+    r"http\S*\s*(status\s*)?(code\s*)?(429|5\d\d)|too many requests|service unavailable|bad gateway|"
+    r"超时|网络|连接",
+    re.IGNORECASE)
+# 参数错误或区域内没有影像，重试也不会成功
+_PERMANENT_PATTERN = re.compile(
+    r"no (imagery|images|tiles|data)|not available|invalid|out of range|unrecognized|"
+    r"unknown (option|argument|provider)|usage:|must be|没有影像|无影像|参数错误",
+    re.IGNORECASE)
+
+
+def classify_output(text):
+    """
+    根据子进程的输出判断失败类型
+    无法识别的非零退出码按临时性处理，由重试次数上限兜底
+    """
+    text = text or ""
+    if _TRANSIENT_PATTERN.search(text):
+        return TRANSIENT
+    if _PERMANENT_PATTERN.search(text):
+        return PERMANENT
+    return TRANSIENT
+
+
+class RetryPolicy:
+    """
+    决定是否重试、重试前等待多久以及每次尝试的超时时间
+    :param max_attempts:每个分块最多尝试的次数(含第一次)
+    :param timeout_per_tile:每个瓦片增加的超时时间(秒)
+    """
+
+    def __init__(self, max_attempts=DEFAULT_MAX_ATTEMPTS, base_delay=DEFAULT_BASE_DELAY, max_delay=DEFAULT_MAX_DELAY,
+                 timeout_per_tile=DEFAULT_TIMEOUT_PER_TILE, max_timeout=DEFAULT_MAX_TIMEOUT, seed=None):
+        self.max_attempts = max(1, int(max_attempts))
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.timeout_per_tile = timeout_per_tile
+        self.max_timeout = max_timeout
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def should_retry(self, kind, attempt):
+        """
+        :param attempt:已经完成的尝试次数
+        """
+        return kind == TRANSIENT and attempt < self.max_attempts
+
+    def delay(self, attempt):
+        """
+        第attempt次失败后的等待时间：在[0.5, 1.5]倍的指数退避值之间随机取值，
+        避免多个分块同时失败后又同时重试
+        """
+        backoff = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        with self._lock:
+            return min(self.max_delay, backoff * self._random.uniform(0.5, 1.5))
+
+    def timeout_for(self, tiles, base_timeout, timeouts=0):
+        """
+        :param tiles:分块的瓦片数
+        :param base_timeout:基础超时时间(秒)，为None时不限时
+        :param timeouts:该分块此前超时的次数，每超时一次放宽TIMEOUT_GROWTH倍
+        """
+        if base_timeout is None:
+            return None
+        return min(self.max_timeout, (base_timeout + self.timeout_per_tile * tiles) * TIMEOUT_GROWTH ** timeouts)
+
+
+def summarize_failures(results):
+    """
+    把失败的区域汇总为一段文本
+    :param results:RegionResult列表
+    :return:没有失败时返回空字符串
+    """
+    failed = [r for r in results if not r.ok]
+    if not failed:
+        return ""
+    counts = {}
+    for r in failed:
+        counts[r.failure_kind] = counts.get(r.failure_kind, 0) + 1
+    lines = [f"{len(failed)}/{len(results)} regions failed ("
+             + ", ".join(f"{count} {kind}" for kind, count in sorted(counts.items(), key=lambda i: str(i[0]))) + ")"]
+    for r in failed:
+        attempts = f", {r.attempts} attempts" if r.attempts > 1 else ""
+        lines.append(f"  {r.task.label} [{r.failure_kind}{attempts}]: {r.error}")
+    return "\n".join(lines)
@@ -0,0 +1,7 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FAKE_EXE = [sys.executable, os.path.join(ROOT, "benchmarks", "fake_gehistoricalimagery.py")]
+
+sys.path.insert(0, ROOT)
@@ -0,0 +1,106 @@
+import json
+import os
+import stat
+
+import pytest
+
+import cli
+import job_planner
+from conftest import FAKE_EXE
+
+
+@pytest.fixture(autouse=True)
+def planner_settings(tmp_path, monkeypatch):
+    """CLI读写的planner.json放在临时目录，不使用也不修改用户目录中的设置"""
+    path = tmp_path / "settings" / "planner.json"
+    monkeypatch.setattr(job_planner, "DEFAULT_SETTINGS_FILE", str(path))
+    return path
+
+
+def write_fake_exe(directory):
+    """--exe只接受一个路径，用shell脚本包装模拟的GEHistoricalImagery"""
+    path = os.path.join(directory, "fakege")
+    with open(path, "w") as f:
+        f.write("#!/bin/sh\nexec \"%s\" \"%s\" \"$@\"\n" % tuple(FAKE_EXE))
+    os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR)
+    return path
+
+
+def write_regions(directory, count=1):
+    features = []
+    for i in range(count):
+        west = 120.10 + i * 0.02
+        ring = [[west, 30.10], [west + 0.01, 30.10], [west + 0.01, 30.11], [west, 30.11], [west, 30.10]]
+        features.append({"type": "Feature", "properties": {},
+                         "geometry": {"type": "Polygon", "coordinates": [ring]}})
+    path = os.path.join(directory, "regions.geojson")
+    with open(path, "w") as f:
+        json.dump({"type": "FeatureCollection", "features": features}, f)
+    return path
+
+
+def test_relative_output_dir(tmp_path, monkeypatch):
+    write_regions(str(tmp_path))
+    exe = write_fake_exe(str(tmp_path))
+    monkeypatch.chdir(tmp_path)
+
+    status = cli.main(["regions.geojson", "-o", "out", "-z", "16", "--input-crs", "wgs84", "--exe", exe,
+                       "--no-cache", "--no-report", "--force"])
+    assert status == 0
+    assert [name for name in os.listdir("out") if name.endswith(".tif")]
+    assert not os.path.exists(os.path.join("out", "out"))
+
+
+def test_input_is_read_once_and_limits_are_checked(tmp_path, monkeypatch):
+    path = write_regions(str(tmp_path), 3)
+    exe = write_fake_exe(str(tmp_path))
+    reads = []
+    iter_wgs84_rings = cli.iter_wgs84_rings
+
+    def counting(*args, **kwargs):
+        reads.append(args[0])
+        return iter_wgs84_rings(*args, **kwargs)
+
+    monkeypatch.setattr(cli, "iter_wgs84_rings", counting)
+    options = [path, "-o", str(tmp_path / "out"), "-z", "16", "--input-crs", "wgs84", "--exe", exe,
+               "--no-cache", "--no-report"]
+    assert cli.main(options + ["--max-tiles", "100000"]) == 0
+    assert len(reads) == 1
+
+    # 第一个区域就超过上限，不开始下载
+    assert cli.main(options + ["-o", str(tmp_path / "refused"), "--max-tiles", "1"]) == 3
+    assert not [name for name in os.listdir(str(tmp_path / "refused")) if name.endswith(".tif")]
+
+
+def test_rate_governor_only_with_limits(tmp_path, monkeypatch):
+    path = write_regions(str(tmp_path))
+    exe = write_fake_exe(str(tmp_path))
+    governors = []
+    run = cli.DownloadScheduler.run
+
+    def recording_run(scheduler, *args, **kwargs):
+        governors.append(scheduler.governor)
+        return run(scheduler, *args, **kwargs)
+
+    monkeypatch.setattr(cli.DownloadScheduler, "run", recording_run)
+    options = [path, "-o", str(tmp_path / "out"), "-z", "16", "--input-crs", "wgs84", "--exe", exe,
+               "--no-cache", "--no-report", "--force"]
+    assert cli.main(options) == 0
+    assert cli.main(options + ["--max-tiles-per-second", "1000"]) == 0
+    assert governors[0] is None
+    assert governors[1].tiles_per_second == 1000
+
+
+def test_limit_overrides_are_not_saved(tmp_path, planner_settings):
+    history = job_planner.ThroughputHistory()
+    history.limits = job_planner.JobLimits(5000, 2 * 1024 ** 3)
+    history.save()
+    path = write_regions(str(tmp_path))
+    exe = write_fake_exe(str(tmp_path))
+    assert cli.main([path, "-o", str(tmp_path / "out"), "-z", "16", "--input-crs", "wgs84", "--exe", exe,
+                     "--no-cache", "--no-report", "--max-tiles", "100000", "--max-gb", "50"]) == 0
+
+    with open(str(planner_settings), encoding="utf-8") as f:
+        saved = json.load(f)
+    assert saved["limits"] == {"max_tiles": 5000, "max_bytes": 2 * 1024 ** 3}
+    assert saved["throughput"]  # 吞吐量照常更新
@@ -0,0 +1,181 @@
+import os
+import time
+
+import download_scheduler
+from conftest import FAKE_EXE
+from download_scheduler import DownloadScheduler
+from output_names import OutputNameAllocator
+from pipeline import ThreadedStage
+
+
+def tiny_rings():
+    """z16下0.015°x0.01°的小区域，都跨越32瓦片分块网格的边界(TM格网每32瓦片0.17578125°)"""
+    rings = []
+    for i in range(5):
+        west, south = 120.234375 + i * 0.17578125 - 0.0075, 30.234375 + i * 0.17578125 - 0.005
+        east, north = west + 0.015, south + 0.01
+        rings.append([[west, south], [east, south], [east, north], [west, north], [west, south]])
+    return rings
+
+
+def test_regions_crossing_chunk_boundaries_download_without_gdal(tmp_path, monkeypatch):
+    monkeypatch.setattr(download_scheduler, "load_gdal", lambda: None)
+    scheduler = DownloadScheduler(str(tmp_path), zoom_level=16, exe_path=FAKE_EXE)
+    tasks = scheduler.plan(tiny_rings())
+    grid = scheduler.grid
+    assert all(grid.chunk_count(task.bbox, 16) > 1 for task in tasks)
+    assert all(len(task.chunks) == 1 and task.chunks[0].output_file == task.output_file for task in tasks)
+
+    results = scheduler.run(tasks)
+    assert [r.ok for r in results] == [True] * 5, [r.error for r in results]
+    assert all(os.path.exists(r.task.output_file) for r in results)
+    assert not [name for name in os.listdir(str(tmp_path)) if name.endswith("_parts")]
+
+
+def test_small_region_is_not_split(tmp_path):
+    scheduler = DownloadScheduler(str(tmp_path), zoom_level=16, exe_path=FAKE_EXE)
+    for task in scheduler.plan(tiny_rings()):
+        assert len(task.chunks) == 1
+
+
+def test_region_needing_merge_fails_before_download_without_gdal(tmp_path, monkeypatch):
+    monkeypatch.setattr(download_scheduler, "load_gdal", lambda: None)
+    scheduler = DownloadScheduler(str(tmp_path), zoom_level=16, exe_path=FAKE_EXE)
+    bbox = download_scheduler.ring_bbox(tiny_rings()[0])
+    cells = [(tile_range, cell_bbox, "2024-01-01")
+             for tile_range, cell_bbox in scheduler.grid.iter_chunks(bbox, 16, 16)]
+    assert len(cells) > 1
+    downloaded = []
+    monkeypatch.setattr(scheduler, "run_chunk", downloaded.append)
+
+    results = scheduler.run([scheduler.plan_patch(1, bbox, cells)])
+    assert not results[0].ok
+    assert "GDAL" in results[0].error
+    assert downloaded == []
+
+
+def overlapping_rings():
+    """z16下互相重叠、各跨越多个32瓦片分块的两个区域"""
+    rings = []
+    for west in (120.1, 120.3):
+        south, east, north = 30.1, west + 0.3, 30.3
+        rings.append([[west, south], [east, south], [east, north], [west, north], [west, south]])
+    return rings
+
+
+def dedup_scheduler(tmp_path, monkeypatch, failing_output=(None,), missing=None):
+    """
+    去重需要GDAL拼接，这里用写出空文件的build_cog代替
+    :param missing:给出列表时记录拼接时不存在的源文件，否则缺少源文件时拼接失败
+    """
+    monkeypatch.setattr(download_scheduler, "load_gdal", lambda: object())
+
+    def build_cog(sources, output_file, **kwargs):
+        if output_file == failing_output[0]:
+            raise RuntimeError("merge failed")
+        absent = [path for path in sources if not os.path.exists(path)]
+        if missing is None:
+            assert not absent
+        else:
+            missing.extend(absent)
+        open(output_file, "wb").close()
+        return output_file
+
+    monkeypatch.setattr(download_scheduler, "build_cog", build_cog)
+    return DownloadScheduler(str(tmp_path), zoom_level=16, exe_path=FAKE_EXE, dedup=True)
+
+
+def parts_dirs(path):
+    return sorted(name for name in os.listdir(str(path)) if name.endswith("_parts"))
+
+
+def test_shared_parts_are_removed_after_all_regions_merge(tmp_path, monkeypatch):
+    scheduler = dedup_scheduler(tmp_path, monkeypatch)
+    tasks = scheduler.plan(overlapping_rings())
+    assert any(chunk.region is tasks[0] for chunk in tasks[1].chunks)
+    results = scheduler.run(tasks)
+    assert [r.ok for r in results] == [True, True], [r.error for r in results]
+    assert parts_dirs(tmp_path) == []
+
+
+def test_shared_parts_are_kept_while_a_dependent_region_failed(tmp_path, monkeypatch):
+    failing = [None]
+    scheduler = dedup_scheduler(tmp_path, monkeypatch, failing)
+    tasks = scheduler.plan(overlapping_rings())
+    failing[0] = tasks[1].output_file
+    results = scheduler.run(tasks)
+    assert [r.ok for r in results] == [True, False]
+    # 区域2拼接失败，它引用的区域1的分块和它自己的分块都保留，重试时不必重新下载
+    owner_parts = os.path.dirname(tasks[0].own_chunks[0].output_file)
+    assert os.path.isdir(owner_parts)
+    assert all(os.path.exists(chunk.output_file) for chunk in tasks[1].chunks)
+
+
+def test_region_planned_after_an_overlapping_region_merged(tmp_path, monkeypatch):
+    missing = []
+    scheduler = dedup_scheduler(tmp_path, monkeypatch, missing=missing)
+
+    def delayed_rings():
+        first, second = overlapping_rings()
+        yield first
+        # 第一个区域在工作线程中拼接并删除分块目录之后才规划第二个区域
+        deadline = time.monotonic() + 30
+        while not (os.path.exists(str(tmp_path / "historical_img_0.tif")) and not parts_dirs(tmp_path)):
+            assert time.monotonic() < deadline
+            time.sleep(0.05)
+        yield second
+
+    plan = ThreadedStage("plan", scheduler.iter_plan(delayed_rings()))
+    try:
+        results = scheduler.run(plan)
+    finally:
+        plan.close()
+    assert [r.ok for r in results] == [True, True], [r.error for r in results]
+    assert missing == []
+    assert parts_dirs(tmp_path) == []
+
+
+def test_region_with_a_missing_chunk_file_fails(tmp_path, monkeypatch):
+    monkeypatch.setattr(download_scheduler, "load_gdal", lambda: object())
+    scheduler = DownloadScheduler(str(tmp_path), zoom_level=16, exe_path=FAKE_EXE)
+    task = scheduler.plan(overlapping_rings()[:1])[0]
+    assert len(task.chunks) > 1
+    # 清单记为已完成的分块中有一个文件不存在
+    for chunk in task.chunks:
+        chunk.done = True
+        if chunk is not task.chunks[0]:
+            open(chunk.output_file, "wb").close()
+
+    result = scheduler.run([task])[0]
+    assert not result.ok
+    assert "missing" in result.error
+    assert not os.path.exists(task.output_file)
+
+
+def test_series_name_is_reserved_until_the_last_date_finishes(tmp_path, monkeypatch):
+    monkeypatch.setattr(download_scheduler, "load_gdal", lambda: None)
+    scheduler = DownloadScheduler(str(tmp_path), zoom_level=16, exe_path=FAKE_EXE)
+    dates = ["2020-01-01", "2021-01-01", "2022-01-01"]
+    tasks = scheduler.plan(tiny_rings()[:1], dates=lambda bbox: dates)
+    reservation = tmp_path / ".historical_img_0.reserved"
+    reserved = []
+    release = scheduler.names.release
+
+    def recording_release(name):
+        release(name)
+        reserved.append(reservation.exists())
+
+    monkeypatch.setattr(scheduler.names, "release", recording_release)
+    results = scheduler.run(tasks)
+    assert [r.ok for r in results] == [True] * 3, [r.error for r in results]
+    assert [os.path.basename(r.task.output_file) for r in results] == [
+        "historical_img_0_20200101.tif", "historical_img_0_20210101.tif", "historical_img_0_20220101.tif"]
+    assert reserved == [True, True, False]
+
+
+def test_series_output_counts_as_taken(tmp_path):
+    allocator = OutputNameAllocator(str(tmp_path))
+    # 扫描之后才由其他实例写出的时间序列文件
+    (tmp_path / "historical_img_0_20200101.tif").write_bytes(b"")
+    assert allocator.allocate() == "historical_img_1"
+    assert not (tmp_path / ".historical_img_0.reserved").exists()
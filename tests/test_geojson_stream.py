@@ -0,0 +1,81 @@
+import json
+import random
+
+import pytest
+
+from geojson_stream import iter_rings
+
+
+def feature_collection():
+    features = []
+    for i in range(3):
+        west = 120.0 + i * 0.1
+        ring = [[west, 30.0], [west + 0.05, 30.0], [west + 0.05, 30.05], [west, 30.05], [west, 30.0]]
+        geometry = ({"type": "Polygon", "coordinates": [ring]} if i % 2 == 0
+                    else {"type": "MultiPolygon", "coordinates": [[ring], [ring]]})
+        features.append({"type": "Feature", "properties": {"name": f"区域{i}", "note": "a \"quoted\" [x]"},
+                         "geometry": geometry})
+    return json.dumps({"type": "FeatureCollection", "name": "fuzz", "features": features})
+
+
+def read(tmp_path, text, chunk_size=7):
+    path = tmp_path / "input.geojson"
+    path.write_text(text, encoding="utf-8")
+    return [ring.tolist() for ring in iter_rings(str(path), chunk_size=chunk_size)]
+
+
+@pytest.mark.parametrize("text", ["[]", "[1, 2]", '"FeatureCollection"', "42", "null", "true"])
+def test_top_level_value_that_is_not_an_object(tmp_path, text):
+    with pytest.raises(ValueError):
+        read(tmp_path, text)
+
+
+def test_valid_collection_in_small_chunks(tmp_path):
+    assert len(read(tmp_path, feature_collection(), chunk_size=3)) == 4
+
+
+def test_fuzz_malformed_input_raises_value_error(tmp_path):
+    """随机截断、删除、插入、替换字符后，解析只能成功或抛出ValueError"""
+    base = feature_collection()
+    rng = random.Random(20240101)
+    alphabet = '{}[]",:0-. abtnul'
+    for _ in range(500):
+        text = base
+        for _ in range(rng.randint(1, 3)):
+            pos = rng.randrange(len(text))
+            action = rng.randrange(4)
+            if action == 0:
+                text = text[:pos]
+            elif action == 1:
+                text = text[:pos] + text[pos + 1:]
+            elif action == 2:
+                text = text[:pos] + rng.choice(alphabet) + text[pos:]
+            else:
+                text = text[:pos] + rng.choice(alphabet) + text[pos + 1:]
+        try:
+            read(tmp_path, text, chunk_size=rng.choice((3, 7, 64, 1 << 20)))
+        except ValueError:
+            pass
+
+
+def test_fuzz_wrong_value_types_raise_value_error(tmp_path):
+    """合法的JSON、错误的GeoJSON结构：feature、geometry、coordinates替换为任意类型的值"""
+    values = [None, True, 3, "x", [], {}, [1, 2], [[1, 2]], [["a", "b"]], [[[1, 2], [3]]], [[[[1, 2, 3]]]],
+              {"type": "Polygon"}, {"type": "Polygon", "coordinates": 5}]
+    ring = [[120.0, 30.0], [120.1, 30.0], [120.1, 30.1], [120.0, 30.0]]
+    for value in values:
+        for geometry_type in ("Polygon", "MultiPolygon"):
+            documents = [
+                {"type": "FeatureCollection", "features": [value]},
+                {"type": "FeatureCollection", "features": value},
+                {"type": "FeatureCollection", "features": [{"type": "Feature", "geometry": value}]},
+                {"type": "Feature", "geometry": value},
+                {"type": geometry_type, "coordinates": value},
+                {"type": geometry_type, "coordinates": [value, ring]},
+                {"type": "MultiPolygon", "coordinates": [[ring], value]},
+            ]
+            for document in documents:
+                try:
+                    read(tmp_path, json.dumps(document))
+                except ValueError:
+                    pass
@@ -0,0 +1,32 @@
+import pytest
+
+from job_planner import JobGuard, JobLimits, JobLimitExceeded, estimate_job
+
+
+def overlapping_rings():
+    """z16下互相重叠的三个区域，每个跨越多个32瓦片的分块"""
+    rings = []
+    for i in range(3):
+        west, south = 120.1 + i * 0.1, 30.1
+        east, north = west + 0.3, south + 0.3
+        rings.append([[west, south], [east, south], [east, north], [west, north], [west, south]])
+    return rings
+
+
+@pytest.mark.parametrize("dedup", [False, True])
+def test_guard_counts_like_estimate_job(dedup):
+    guard = JobGuard(JobLimits(None, None), 16, dates_per_region=3, dedup=dedup)
+    assert list(guard.check(overlapping_rings())) == overlapping_rings()
+    estimate = estimate_job(overlapping_rings(), 16, dates_per_region=3, dedup=dedup)
+    assert (guard.job.tiles, guard.job.chunks) == (estimate.tiles, estimate.chunks)
+
+
+def test_guard_limit_includes_dates_and_dedup():
+    single = estimate_job(overlapping_rings(), 16, dedup=True)
+    assert single.tiles < estimate_job(overlapping_rings(), 16).tiles
+    # 按去重后的瓦片数判断：一期不超过上限，三期超过
+    list(JobGuard(JobLimits(single.tiles, None), 16, dedup=True).check(overlapping_rings()))
+    guard = JobGuard(JobLimits(single.tiles, None), 16, dates_per_region=3, dedup=True)
+    with pytest.raises(JobLimitExceeded):
+        list(guard.check(overlapping_rings()))
+    assert guard.error is not None
@@ -0,0 +1,46 @@
+import threading
+import time
+
+from tile_server import BasemapTileServer, TileStore
+
+
+class CheckedStore(TileStore):
+    """记录在关闭之后对瓦片库的访问"""
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.closed = False
+        self.late = []
+
+    def get(self, z, x, y):
+        if self.closed:
+            self.late.append(("get", z, x, y))
+        return super().get(z, x, y)
+
+    def put(self, z, x, y, data):
+        if self.closed:
+            self.late.append(("put", z, x, y))
+        return super().put(z, x, y, data)
+
+    def close(self):
+        self.closed = True
+        super().close()
+
+
+def test_stop_waits_for_prefetch_before_closing_store(tmp_path):
+    store = CheckedStore(str(tmp_path / "basemap.mbtiles"))
+    server = BasemapTileServer(store)
+    started = threading.Event()
+
+    def slow_fetch(z, x, y):
+        started.set()
+        time.sleep(0.2)
+        return b"png"
+
+    server.fetch = slow_fetch
+    assert server.prefetch([(120.0, 30.0, 120.5, 30.5)], zooms=(8, 12)) > 4
+    assert started.wait(5)
+    server.stop()
+    assert store.closed
+    time.sleep(0.3)
+    assert store.late == []
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+重叠去重 - 多个区域(重叠绘制的矩形、MultiPolygon相邻的部分)覆盖同一批瓦片时只下载一次
+按全局对齐的分块网格建立空间索引(网格桶)，先规划的区域认领分块中的瓦片矩形，
+后规划的区域只下载尚未被认领的部分，已认领的部分直接引用前面区域的分块文件，拼接时再裁回各自的范围
+"""
+
+from tile_grid import TileRange, DEFAULT_CHUNK_TILES
+
+
+def ranges_intersect(a, b):
+    return a.x0 <= b.x1 and b.x0 <= a.x1 and a.y0 <= b.y1 and b.y0 <= a.y1
+
+
+def subtract_range(a, b):
+    """
+    从瓦片范围a中去掉b
+    :return:互不重叠的TileRange列表(最多4个)，a与b不相交时为[a]
+    """
+    if not ranges_intersect(a, b):
+        return [a]
+    pieces = []
+    y0, y1 = max(a.y0, b.y0), min(a.y1, b.y1)
+    if a.y0 < y0:
+        pieces.append(TileRange(a.zoom, a.x0, a.y0, a.x1, y0 - 1))
+    if y1 < a.y1:
+        pieces.append(TileRange(a.zoom, a.x0, y1 + 1, a.x1, a.y1))
+    if a.x0 < b.x0:
+        pieces.append(TileRange(a.zoom, a.x0, y0, b.x0 - 1, y1))
+    if b.x1 < a.x1:
+        pieces.append(TileRange(a.zoom, b.x1 + 1, y0, a.x1, y1))
+    return pieces
+
+
+class TileClaimIndex:
+    """
+    已认领瓦片矩形的空间索引，以(日期, 缩放级别, 分块列, 分块行)为桶
+    每个分块范围只会落在一个或少数几个桶中，查询的开销与区域总数无关
+    :param chunk_tiles:桶的边长(瓦片数)，与调度器的分块大小一致
+    """
+
+    def __init__(self, chunk_tiles=DEFAULT_CHUNK_TILES):
+        self.chunk_tiles = chunk_tiles
+        self._cells = {}  # (date, zoom, cx, cy) -> [(TileRange, item), ...]
+        self.shared_tiles = 0  # 因为已被认领而不再下载的瓦片数
+
+    def _cell_keys(self, date, tile_range):
+        size = self.chunk_tiles
+        for cy in range(tile_range.y0 // size, tile_range.y1 // size + 1):
+            for cx in range(tile_range.x0 // size, tile_range.x1 // size + 1):
+                yield date, tile_range.zoom, cx, cy
+
+    def claim(self, date, tile_range):
+        """
+        查询tile_range中已被认领和尚未认领的部分，不修改索引
+        :return:(与tile_range相交的已认领对象列表, 尚未认领的TileRange列表)
+        """
+        owners = []
+        seen = set()
+        pieces = [tile_range]
+        for key in self._cell_keys(date, tile_range):
+            for claimed, item in self._cells.get(key, ()):
+                if id(item) in seen or not ranges_intersect(claimed, tile_range):
+                    continue
+                seen.add(id(item))
+                owners.append(item)
+                pieces = [rest for piece in pieces for rest in subtract_range(piece, claimed)]
+        self.shared_tiles += tile_range.count - sum(piece.count for piece in pieces)
+        return owners, pieces
+
+    def add(self, date, tile_range, item=None):
+        """
+        认领tile_range，之后的claim会返回item
+        :param item:认领者(如ChunkTask)，为None时记录tile_range本身
+        """
+        item = tile_range if item is None else item
+        for key in self._cell_keys(date, tile_range):
+            self._cells.setdefault(key, []).append((tile_range, item))
+
+    def remove(self, date, tile_range, item):
+        """撤销item对tile_range的认领，之后的claim不再返回它"""
+        for key in self._cell_keys(date, tile_range):
+            entries = self._cells.get(key)
+            if entries is None:
+                continue
+            entries[:] = [entry for entry in entries if entry[1] is not item]
+            if not entries:
+                del self._cells[key]
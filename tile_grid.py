@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+瓦片网格 - 经纬度范围与瓦片行列号之间的换算
+Google Earth历史影像(provider TM)使用经纬度四叉树：第z级把经度-180~180、纬度-180~180的正方形均分为2^z x 2^z块，
+行号从南向北递增；Esri Wayback等使用Web墨卡托(XYZ)瓦片，行号从北向南递增
+"""
+
+import math
+
+DEFAULT_CHUNK_TILES = 32  # 分块边长(瓦片数)，每块最多32x32=1024张瓦片
+MERCATOR_MAX_LAT = 85.0511287798066
+
+
+class TileRange:
+    """闭区间的瓦片行列范围"""
+
+    def __init__(self, zoom, x0, y0, x1, y1):
+        self.zoom = zoom
+        self.x0 = x0
+        self.y0 = y0
+        self.x1 = x1
+        self.y1 = y1
+
+    @property
+    def width(self):
+        return self.x1 - self.x0 + 1
+
+    @property
+    def height(self):
+        return self.y1 - self.y0 + 1
+
+    @property
+    def count(self):
+        return self.width * self.height
+
+    def to_list(self):
+        return [self.zoom, self.x0, self.y0, self.x1, self.y1]
+
+    def __eq__(self, other):
+        return isinstance(other, TileRange) and self.to_list() == other.to_list()
+
+    def __repr__(self):
+        return f"TileRange(z={self.zoom}, x={self.x0}..{self.x1}, y={self.y0}..{self.y1})"
+
+
+class TileGrid:
+    """瓦片网格基类，子类实现单个坐标与瓦片行列号的换算"""
+
+    name = ""
+
+    def fractional_tile(self, lng, lat, zoom):
+        """返回(x, y)的浮点行列号"""
+        raise NotImplementedError
+
+    def tile_bounds(self, x, y, zoom):
+        """单个瓦片的(west, south, east, north)"""
+        raise NotImplementedError
+
+    def tile_range(self, bbox, zoom):
+        """
+        覆盖bbox的瓦片范围
+        :param bbox:(west, south, east, north)
+        :return:TileRange
+        """
+        west, south, east, north = bbox
+        n = 1 << zoom
+        fx0, fy0 = self.fractional_tile(west, south, zoom)
+        fx1, fy1 = self.fractional_tile(east, north, zoom)
+        fx0, fx1 = min(fx0, fx1), max(fx0, fx1)
+        fy0, fy1 = min(fy0, fy1), max(fy0, fy1)
+        # 右/上边界正好落在瓦片边线上时不包含下一块瓦片
+        x0 = min(max(int(math.floor(fx0)), 0), n - 1)
+        y0 = min(max(int(math.floor(fy0)), 0), n - 1)
+        x1 = min(max(int(math.ceil(fx1)) - 1, x0), n - 1)
+        y1 = min(max(int(math.ceil(fy1)) - 1, y0), n - 1)
+        return TileRange(zoom, x0, y0, x1, y1)
+
+    def range_bounds(self, tile_range):
+        """瓦片范围的(west, south, east, north)"""
+        w0, s0, e0, n0 = self.tile_bounds(tile_range.x0, tile_range.y0, tile_range.zoom)
+        w1, s1, e1, n1 = self.tile_bounds(tile_range.x1, tile_range.y1, tile_range.zoom)
+        return min(w0, w1), min(s0, s1), max(e0, e1), max(n0, n1)
+
+    def tile_count(self, bbox, zoom):
+        return self.tile_range(bbox, zoom).count
+
+    def chunk_count(self, bbox, zoom, chunk_tiles=DEFAULT_CHUNK_TILES):
+        """iter_chunks产出的分块数，不逐个生成"""
+        full = self.tile_range(bbox, zoom)
+        return ((full.x1 // chunk_tiles - full.x0 // chunk_tiles + 1)
+                * (full.y1 // chunk_tiles - full.y0 // chunk_tiles + 1))
+
+    def iter_chunks(self, bbox, zoom, chunk_tiles=DEFAULT_CHUNK_TILES):
+        """
+        按全局对齐的chunk_tiles x chunk_tiles网格切分bbox
+        分块按全局网格对齐，不同区域的内部分块范围完全相同，可以共用缓存
+        :return:产出(TileRange, 与bbox求交后的分块范围)
+        """
+        full = self.tile_range(bbox, zoom)
+        west, south, east, north = bbox
+        for cy in range(full.y0 // chunk_tiles, full.y1 // chunk_tiles + 1):
+            for cx in range(full.x0 // chunk_tiles, full.x1 // chunk_tiles + 1):
+                chunk = TileRange(zoom,
+                                  max(cx * chunk_tiles, full.x0), max(cy * chunk_tiles, full.y0),
+                                  min((cx + 1) * chunk_tiles - 1, full.x1), min((cy + 1) * chunk_tiles - 1, full.y1))
+                c_west, c_south, c_east, c_north = self.range_bounds(chunk)
+                yield chunk, (max(west, c_west), max(south, c_south), min(east, c_east), min(north, c_north))
+
+
+class GeographicGrid(TileGrid):
+    """Google Earth经纬度四叉树"""
+
+    name = "geographic"
+
+    def fractional_tile(self, lng, lat, zoom):
+        size = 360.0 / (1 << zoom)
+        return (lng + 180.0) / size, (lat + 180.0) / size
+
+    def tile_bounds(self, x, y, zoom):
+        size = 360.0 / (1 << zoom)
+        return -180.0 + x * size, -180.0 + y * size, -180.0 + (x + 1) * size, -180.0 + (y + 1) * size
+
+
+class MercatorGrid(TileGrid):
+    """Web墨卡托XYZ瓦片"""
+
+    name = "mercator"
+
+    def fractional_tile(self, lng, lat, zoom):
+        n = 1 << zoom
+        lat = max(-MERCATOR_MAX_LAT, min(MERCATOR_MAX_LAT, lat))
+        rad = math.radians(lat)
+        return (lng + 180.0) / 360.0 * n, (1.0 - math.asinh(math.tan(rad)) / math.pi) / 2.0 * n
+
+    def tile_bounds(self, x, y, zoom):
+        n = 1 << zoom
+
+        def lat_of(row):
+            return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * row / n))))
+
+        return x / n * 360.0 - 180.0, lat_of(y + 1), (x + 1) / n * 360.0 - 180.0, lat_of(y)
+
+
+GEOGRAPHIC_GRID = GeographicGrid()
+MERCATOR_GRID = MercatorGrid()
+
+
+def grid_for_provider(provider):
+    """GEHistoricalImagery的TM(Google Earth)使用经纬度网格，其余数据源使用Web墨卡托"""
+    return GEOGRAPHIC_GRID if provider == "TM" else MERCATOR_GRID
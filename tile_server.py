@@ -0,0 +1,284 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+底图瓦片缓存 - 在程序内运行一个只监听本机的HTTP瓦片代理，地图页面从代理请求底图瓦片
+代理先查MBTiles(SQLite)缓存，未命中时再向高德瓦片服务器请求并写入缓存，按总大小做LRU淘汰
+再次打开程序或离线时，已浏览过和预取过的范围直接从本地返回
+"""
+
+import os
+import re
+import sqlite3
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+from tile_grid import MERCATOR_GRID
+
+DEFAULT_TILE_DB = os.path.join(os.path.expanduser("~"), ".xiaobai_downloader", "basemap.mbtiles")
+DEFAULT_MAX_BYTES = 512 * 1024 ** 2  # 512MB
+UPSTREAM_URL = ("http://webrd0{s}.is.autonavi.com/appmaptile?lang=zh_cn&size=1&scale=1&style=7"
+                "&x={x}&y={y}&z={z}")
+FETCH_TIMEOUT = 10
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64)"
+MAX_ZOOM = 18
+PREFETCH_ZOOMS = (8, 16)  # 预取的缩放级别范围
+PREFETCH_MAX_TILES = 3000  # 每次预取的瓦片数上限，从低级别开始取
+PREFETCH_WORKERS = 4
+_TILE_PATH = re.compile(r"^/tiles/(\d+)/(\d+)/(\d+)\.png$")
+
+
+class TileStore:
+    """
+    MBTiles格式的瓦片库，tiles表额外记录大小和最近访问时间用于LRU淘汰
+    行号按MBTiles规范存为TMS(从南向北)，接口使用XYZ行号
+    :param max_bytes:瓦片数据总大小上限
+    """
+
+    def __init__(self, path=DEFAULT_TILE_DB, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # 请求由代理的多个线程处理，共用一个连接并用锁串行化
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS metadata (name TEXT PRIMARY KEY, value TEXT)")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS tiles ("
+                " zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_data BLOB,"
+                " size INTEGER, last_used REAL, PRIMARY KEY (zoom_level, tile_column, tile_row))"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS tiles_last_used ON tiles (last_used)")
+            for name, value in (("name", "basemap"), ("format", "png"), ("type", "baselayer"),
+                                ("scheme", "tms"), ("attribution", "AutoNavi")):
+                self._conn.execute("INSERT OR IGNORE INTO metadata VALUES (?, ?)", (name, value))
+            self._total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM tiles").fetchone()[0]
+
+    @staticmethod
+    def _tms_row(z, y):
+        return (1 << z) - 1 - y
+
+    def get(self, z, x, y):
+        """
+        :return:瓦片数据，未缓存时返回None
+        """
+        key = (z, x, self._tms_row(z, y))
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT tile_data FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?", key
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute(
+                "UPDATE tiles SET last_used = ? WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
+                (time.time(),) + key)
+        return bytes(row[0])
+
+    def contains(self, z, x, y):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT 1 FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
+                (z, x, self._tms_row(z, y))
+            ).fetchone() is not None
+
+    def put(self, z, x, y, data):
+        """保存瓦片，随后按LRU淘汰超出容量的瓦片"""
+        key = (z, x, self._tms_row(z, y))
+        with self._lock, self._conn:
+            old = self._conn.execute(
+                "SELECT size FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?", key
+            ).fetchone()
+            self._conn.execute("INSERT OR REPLACE INTO tiles VALUES (?, ?, ?, ?, ?, ?)",
+                               key + (sqlite3.Binary(data), len(data), time.time()))
+            self._total += len(data) - (old[0] if old else 0)
+            if self._total > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        # 一次多淘汰10%，避免每写一张瓦片都触发淘汰
+        target = self.max_bytes * 0.9
+        rows = self._conn.execute("SELECT zoom_level, tile_column, tile_row, size FROM tiles ORDER BY last_used")
+        victims = []
+        for z, x, row, size in rows:
+            if self._total <= target:
+                break
+            victims.append((z, x, row))
+            self._total -= size
+        self._conn.executemany("DELETE FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
+                               victims)
+
+    def stats(self):
+        """:return:(瓦片数, 总字节数)"""
+        with self._lock:
+            count = self._conn.execute("SELECT COUNT(*) FROM tiles").fetchone()[0]
+            return count, self._total
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    # Python 3.6没有http.server.ThreadingHTTPServer
+    daemon_threads = True
+
+
+class _TileHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        match = _TILE_PATH.match(self.path)
+        if match is None:
+            self.send_error(404)
+            return
+        z, x, y = (int(v) for v in match.groups())
+        data = self.server.tiles.tile(z, x, y)
+        if data is None:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "image/png")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("Cache-Control", "max-age=86400")
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        # 每张瓦片一行日志太多，不输出
+        pass
+
+
+class BasemapTileServer:
+    """
+    本地瓦片代理
+    :param store:TileStore
+    :param upstream:上游瓦片地址模板，{s}为子域名1~4
+    :param port:监听端口，0表示由系统分配
+    """
+
+    def __init__(self, store=None, upstream=UPSTREAM_URL, host="127.0.0.1", port=0, fetch_timeout=FETCH_TIMEOUT):
+        self.store = store if store is not None else TileStore()
+        self.upstream = upstream
+        self.host = host
+        self.port = port
+        self.fetch_timeout = fetch_timeout
+        self.offline = False  # 最近一次上游请求是否失败
+        self._offline_until = 0.0
+        self._server = None
+        self._thread = None
+        self._prefetch = None  # 预取线程池，首次预取时创建
+        self._stopped = False
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def url_template(self):
+        """地图页面使用的瓦片地址"""
+        return f"http://{self.host}:{self.port}/tiles/{{z}}/{{x}}/{{y}}.png"
+
+    def start(self):
+        self._server = _ThreadingHTTPServer((self.host, self.port), _TileHandler)
+        self._server.tiles = self
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, name="basemap-tiles", daemon=True)
+        self._thread.start()
+        print(f"Basemap tile cache serving on {self.url_template}")
+        return self
+
+    def stop(self):
+        """
+        停止代理和预取后关闭瓦片库；排队的预取任务看到停止标志后直接返回，
+        正在请求上游的预取线程最多等待fetch_timeout秒
+        """
+        self._stopped = True
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        if self._prefetch is not None:
+            self._prefetch.shutdown(wait=True)
+            self._prefetch = None
+        self.store.close()
+
+    def fetch(self, z, x, y):
+        """从上游获取瓦片，失败时返回None；失败后30秒内不再请求，离线时地图不会等待超时"""
+        if time.monotonic() < self._offline_until:
+            return None
+        url = self.upstream.format(s=(x + y) % 4 + 1, x=x, y=y, z=z)
+        request = urllib.request.Request(url, headers={"User-Agent": USER_AGENT})
+        try:
+            with urllib.request.urlopen(request, timeout=self.fetch_timeout) as response:
+                data = response.read()
+        except OSError as e:
+            if not self.offline:
+                print(f"Basemap tile server unreachable, serving cached tiles only: {e}")
+            self.offline = True
+            self._offline_until = time.monotonic() + 30
+            return None
+        self.offline = False
+        return data or None
+
+    def tile(self, z, x, y):
+        """
+        :return:瓦片数据，先查缓存，未命中时从上游获取并写入缓存
+        """
+        if self._stopped or not (0 <= z <= MAX_ZOOM and 0 <= x < (1 << z) and 0 <= y < (1 << z)):
+            return None
+        data = self.store.get(z, x, y)
+        if data is not None:
+            self.hits += 1
+            return data
+        self.misses += 1
+        data = self.fetch(z, x, y)
+        if data is not None and not self._stopped:
+            self.store.put(z, x, y, data)
+        return data
+
+    def prefetch(self, bboxes, zooms=PREFETCH_ZOOMS, margin=1, max_tiles=PREFETCH_MAX_TILES):
+        """
+        在后台预取区域周围的瓦片，已缓存的跳过
+        :param bboxes:地图坐标下的(west, south, east, north)列表
+        :param zooms:(最小级别, 最大级别)
+        :param margin:每个区域向外扩展的瓦片数
+        :return:提交预取的瓦片数
+        """
+        if self._stopped:
+            return 0
+        tiles = prefetch_tiles(bboxes, zooms, margin, max_tiles)
+        todo = [tile for tile in tiles if not self.store.contains(*tile)]
+        if not todo:
+            return 0
+        if self._prefetch is None:
+            self._prefetch = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS)
+        for z, x, y in todo:
+            self._prefetch.submit(self.tile, z, x, y)
+        print(f"Prefetching {len(todo)} basemap tiles around {len(bboxes)} regions")
+        return len(todo)
+
+
+def prefetch_tiles(bboxes, zooms=PREFETCH_ZOOMS, margin=1, max_tiles=PREFETCH_MAX_TILES):
+    """
+    区域周围需要预取的XYZ瓦片，从低级别到高级别，总数不超过max_tiles
+    :return:[(z, x, y)]
+    """
+    tiles = []
+    seen = set()
+    for z in range(zooms[0], zooms[1] + 1):
+        n = 1 << z
+        for bbox in bboxes:
+            r = MERCATOR_GRID.tile_range(bbox, z)
+            x0, y0 = max(r.x0 - margin, 0), max(r.y0 - margin, 0)
+            x1, y1 = min(r.x1 + margin, n - 1), min(r.y1 + margin, n - 1)
+            if len(tiles) + (x1 - x0 + 1) * (y1 - y0 + 1) > max_tiles:
+                # 这一级放不下时停止，更高级别的瓦片只会更多
+                return tiles
+            for y in range(y0, y1 + 1):
+                for x in range(x0, x1 + 1):
+                    if (z, x, y) not in seen:
+                        seen.add((z, x, y))
+                        tiles.append((z, x, y))
+    return tiles